@@ -1,112 +1,241 @@
 # 1日籌碼集中度.py (已修改欄位顯示)
 
+import os
+import re
+import time
+import sqlite3
+import threading
+from io import BytesIO
+from datetime import time as dt_time
+from email.utils import parsedate_to_datetime
+
 import requests
 import pandas as pd
-from io import StringIO
-from bs4 import BeautifulSoup
+from lxml import etree
+
+import concentration_history
+import concentration_screens
+from price_store import latest_trading_day, previous_weekday, TAIPEI_TZ
+
+# 籌碼集中度排行的每日快照
+# 來源網頁每個交易日只更新一次：解析後的 DataFrame 依交易日保存在記憶體中，
+# 同一交易日內每隔 CONCENTRATION_REVALIDATE_SECONDS 秒才以 If-None-Match / If-Modified-Since
+# 向網站確認一次，網站回應 304 時直接沿用已解析的資料，重複點選不需重新下載與解析。
+# 解析時以 lxml iterparse 單次走訪表格，遇到含「代碼」的列即作為標題列，之後的列直接轉為資料。
+# 每份新的快照都以資料日期保存到 concentration_history，供跨日篩選使用。
+
+CONCENTRATION_URL = 'http://asp.peicheng.com.tw/main/report/dream_report/%E7%B1%8C%E7%A2%BC%E9%9B%86%E4%B8%AD%E5%BA%A61%E6%97%A5%E6%8E%92%E8%A1%8C.htm'
+TABLE_ID = '籌碼集中度排行轉網頁.(排程)_3148'
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
+    'Accept-Language': 'zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7',
+    'Connection': 'keep-alive',
+}
+
+ALL_COLUMNS = ['編號', '代碼', '股票名稱', '1日集中度', '5日集中度', '10日集中度', '20日集中度', '60日集中度', '120日集中度', '10日均量']
+NUMERIC_COLUMNS = ['1日集中度', '5日集中度', '10日集中度', '20日集中度', '60日集中度', '120日集中度', '10日均量']
+
+# 台股收盤時間：網頁在收盤後更新的內容屬於當日，收盤前的內容屬於前一交易日
+MARKET_CLOSE_TIME = dt_time(13, 30)
 
-def fetch_stock_concentration_data():
+# 同一交易日內向網站重新確認的間隔秒數，可由環境變數 CONCENTRATION_REVALIDATE_SECONDS 調整
+CONCENTRATION_REVALIDATE_SECONDS = int(os.getenv('CONCENTRATION_REVALIDATE_SECONDS', '600'))
+
+# 與 pandas.read_html 相同的空白處理：換行與連續空白合併為一個空格
+WHITESPACE_PATTERN = re.compile(r'[\r\n]+|\s{2,}')
+
+_session = requests.Session()
+_snapshot = None  # {'trading_day', 'data', 'etag', 'last_modified', 'checked_at'}
+_snapshot_lock = threading.Lock()
+
+
+def parse_concentration_table(html_text: str):
     """
-    爬取股票籌碼集中度資料並進行數據清理。
-    此版本使用 BeautifulSoup 增強解析的穩定性。
-    
-    Returns:
-        pd.DataFrame or None: 清理後的股票集中度資料，或在發生錯誤時返回 None。
+    單次走訪解析籌碼集中度表格
+    只處理 id 為 TABLE_ID 的表格 (找不到時使用第一個含「代碼」的表格)；第一個含「代碼」的列為標題列，
+    其後的列依標題轉為欄位，最後一筆代碼為數字的列之後的說明列會被捨棄。
+    :return: 清理後的 DataFrame；找不到標題列時回傳 None
     """
-    url = 'http://asp.peicheng.com.tw/main/report/dream_report/%E7%B1%8C%E7%A2%BC%E9%9B%86%E4%B8%AD%E5%BA%A61%E6%97%A5%E6%8E%92%E8%A1%8C.htm'
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
-        'Accept-Language': 'zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7',
-        'Connection': 'keep-alive',
-    }
+    target_id = TABLE_ID if TABLE_ID in html_text else None
+    if target_id is None:
+        print("警告：找不到指定的表格 ID，改用第一個含「代碼」標頭的表格。網站結構可能已變更。")
+    header = None
+    rows = []
+    last_valid = -1
+    table_depth = 0  # 目前位於目標表格內的巢狀表格層數，0 表示不在表格內
+    cells = []
 
+    events = etree.iterparse(BytesIO(html_text.encode('utf-8')), events=('start', 'end'),
+                             html=True, encoding='utf-8', recover=True)
+    for event, element in events:
+        tag = element.tag
+        if event == 'start':
+            if tag == 'table':
+                if table_depth:
+                    table_depth += 1
+                elif target_id is None or element.get('id') == target_id:
+                    table_depth = 1
+            elif table_depth == 1 and tag == 'tr':
+                cells = []
+            continue
+
+        if not table_depth:
+            element.clear()
+            continue
+        if tag == 'table':
+            table_depth -= 1
+            if not table_depth:
+                element.clear()
+                if header is not None:
+                    break
+        elif table_depth > 1:
+            continue
+        elif tag in ('td', 'th'):
+            text = WHITESPACE_PATTERN.sub(' ', ''.join(element.itertext())).strip()
+            cells.extend([text] * int(element.get('colspan') or 1))
+        elif tag == 'tr':
+            if header is None:
+                if any('代碼' in text for text in cells):
+                    header = ['股票名稱' if text == '名稱' else text for text in cells]
+            elif cells:
+                rows.append(cells)
+                code = cells[header.index('代碼')] if len(cells) > header.index('代碼') else ''
+                if code.isdigit():
+                    last_valid = len(rows) - 1
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+    if header is None:
+        print("錯誤：在表格中找不到包含 '代碼' 的標頭行。")
+        return None
+
+    width = len(header)
+    rows = [(row + [None] * width)[:width] for row in rows[:last_valid + 1]]
+    df = pd.DataFrame(rows, columns=header)
+    df = df.loc[:, ~df.columns.duplicated()]
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    df = df.dropna(subset=[col for col in NUMERIC_COLUMNS if col in df.columns]).reset_index(drop=True)
+    return df
+
+
+def _download(snapshot):
+    """
+    下載排行網頁；已有快照時附上 If-None-Match / If-Modified-Since
+    :return: (HTTP 狀態碼, 網頁內容, ETag, Last-Modified)
+    """
+    headers = dict(HEADERS)
+    if snapshot is not None:
+        if snapshot['etag']:
+            headers['If-None-Match'] = snapshot['etag']
+        if snapshot['last_modified']:
+            headers['If-Modified-Since'] = snapshot['last_modified']
+    response = _session.get(CONCENTRATION_URL, headers=headers, timeout=20)
+    if response.status_code == 304:
+        return 304, None, response.headers.get('ETag'), response.headers.get('Last-Modified')
+    response.raise_for_status()
+    response.encoding = 'big5'
+    return response.status_code, response.text, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+
+def _data_day(last_modified: str, trading_day):
+    """
+    依網頁的 Last-Modified 推算資料所屬的交易日；沒有或無法解析時使用目前的最近交易日
+    網頁在收盤後即更新，不套用 FinMind 日K的 15:00 就緒時間 (否則 15:00 前發布的當日資料會被記到前一交易日)。
+    """
     try:
-        response = requests.get(url, headers=headers, timeout=20)
-        response.raise_for_status()
-        response.encoding = 'big5'
+        modified = parsedate_to_datetime(last_modified).astimezone(TAIPEI_TZ)
+    except (TypeError, ValueError):
+        return trading_day
+    day = modified.date()
+    if day.weekday() >= 5 or modified.time() < MARKET_CLOSE_TIME:
+        day = previous_weekday(day)
+    return day
 
-        soup = BeautifulSoup(response.text, 'lxml')
-        target_table = soup.select_one('#籌碼集中度排行轉網頁\.\(排程\)_3148')
 
-        if not target_table:
-            print("錯誤：使用 BeautifulSoup 找不到指定的表格 ID。網站結構可能已變更。")
-            dfs = pd.read_html(StringIO(response.text))
-        else:
-            dfs = pd.read_html(StringIO(str(target_table)), flavor='lxml')
+def _stale_copy(snapshot):
+    """網站無法連線時沿用既有快照；沒有快照時回傳 None"""
+    if snapshot is None:
+        return None
+    print(f"沿用 {snapshot['trading_day']} 的籌碼集中度快照。")
+    return snapshot['data'].copy()
 
-        if not dfs:
-            print("錯誤：pandas 無法從 HTML 中解析出任何表格。")
-            return None
 
-        df0 = dfs[0]
-        df0.columns = df0.columns.get_level_values(0)
-        
-        header_row_index = -1
-        for i, row in df0.iterrows():
-            if '代碼' in str(row.to_string()):
-                header_row_index = i
-                break
-        
-        if header_row_index == -1:
-            print("錯誤：在表格中找不到包含 '代碼' 的標頭行。")
+def fetch_stock_concentration_data(force_refresh: bool = False):
+    """
+    取得股票籌碼集中度資料 (每個交易日的快照)。
+    同一交易日且距上次確認未滿 CONCENTRATION_REVALIDATE_SECONDS 秒時直接回傳快照；
+    否則以條件式請求向網站確認，未變更 (304) 時沿用快照，有新內容時重新解析。
+    網站暫時無法連線時沿用既有快照。
+
+    Args:
+        force_refresh (bool): 忽略確認間隔，立即向網站確認。
+
+    Returns:
+        pd.DataFrame or None: 清理後的股票集中度資料 (副本)，或在發生錯誤時返回 None。
+    """
+    global _snapshot
+    with _snapshot_lock:
+        snapshot = _snapshot
+        trading_day = latest_trading_day()
+        if (snapshot is not None and not force_refresh and snapshot['trading_day'] == trading_day
+                and time.monotonic() - snapshot['checked_at'] < CONCENTRATION_REVALIDATE_SECONDS):
+            return snapshot['data'].copy()
+
+        try:
+            status, html_text, etag, last_modified = _download(snapshot)
+        except requests.exceptions.Timeout:
+            print(f"錯誤：請求超時。目標網站 '{CONCENTRATION_URL}' 回應過慢。")
+            return _stale_copy(snapshot)
+        except requests.exceptions.RequestException as e:
+            print(f"錯誤：爬取網頁時發生網路錯誤: {e}")
+            return _stale_copy(snapshot)
+
+        if status == 304:
+            snapshot.update(trading_day=trading_day, checked_at=time.monotonic(),
+                            etag=etag or snapshot['etag'], last_modified=last_modified or snapshot['last_modified'])
+            print("籌碼集中度資料未變更，沿用已解析的快照。")
+            return snapshot['data'].copy()
+
+        try:
+            df = parse_concentration_table(html_text)
+        except Exception as e:
+            print(f"錯誤：處理資料時發生未知錯誤: {e}")
+            return None
+        if df is None:
             return None
 
-        df1 = df0.iloc[header_row_index + 1:].copy()
-        df1.columns = df0.iloc[header_row_index].values
-        df1.reset_index(drop=True, inplace=True)
-
-        last_valid_index = df1['代碼'].apply(pd.to_numeric, errors='coerce').last_valid_index()
-        if last_valid_index is not None:
-            df1 = df1.iloc[:last_valid_index + 1]
-
-        # 確保所有需要的欄位都存在
-        all_columns = ['編號', '代碼', '股票名稱', '1日集中度', '5日集中度', '10日集中度', '20日集中度', '60日集中度', '120日集中度', '10日均量']
-        # 檢查欄位是否存在，並修正可能的命名差異 (例如 "股票名稱" vs "名稱")
-        if '名稱' in df1.columns and '股票名稱' not in df1.columns:
-            df1.rename(columns={'名稱': '股票名稱'}, inplace=True)
-            
-        numeric_columns = ['1日集中度', '5日集中度', '10日集中度', '20日集中度', '60日集中度', '120日集中度', '10日均量']
-        for col in numeric_columns:
-            if col in df1.columns:
-                df1[col] = pd.to_numeric(df1[col], errors='coerce')
-        
-        df1.dropna(subset=numeric_columns, inplace=True)
-        
+        _snapshot = {'trading_day': trading_day, 'data': df, 'etag': etag,
+                     'last_modified': last_modified, 'checked_at': time.monotonic()}
         print("籌碼集中度資料獲取並清理成功。")
-        return df1
+        try:
+            concentration_history.save_snapshot(_data_day(last_modified, trading_day), df)
+        except sqlite3.Error as e:
+            print(f"警告: 無法保存籌碼集中度歷史快照: {e}")
+        return df.copy()
 
-    except requests.exceptions.Timeout:
-        print(f"錯誤：請求超時。目標網站 '{url}' 回應過慢。")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"錯誤：爬取網頁時發生網路錯誤: {e}")
-        return None
-    except Exception as e:
-        print(f"錯誤：處理資料時發生未知錯誤: {e}")
-        return None
-
-def filter_stock_data(df, min_volume=2000):
+def filter_stock_data(df, min_volume=2000, screen=None, params=None):
     """
-    篩選符合特定條件的股票，並只回傳指定的欄位。
+    以具名篩選條件 (concentration_screens) 篩選股票，並只回傳指定的欄位。
+    預設條件為 5日 > 10日 > 20日集中度、5日與10日集中度為正且 10日均量 > min_volume。
+
+    Args:
+        screen (str): 篩選條件名稱，None 表示預設條件。
+        params (dict): 覆寫條件的參數；min_volume 也會套用到有該參數的條件。
     """
     if df is None:
         return None
     try:
-        # 步驟 1: 根據條件篩選股票 (邏輯不變)
-        filtered_df = df[
-            (df['5日集中度'] > df['10日集中度']) &
-            (df['10日集中度'] > df['20日集中度']) &
-            (df['5日集中度'] > 0) &
-            (df['10日集中度'] > 0) &
-            (df['10日均量'] > min_volume)
-        ].copy()
+        # 步驟 1: 以已編譯的篩選條件計算布林遮罩
+        mask = concentration_screens.get_screen(screen).evaluate(
+            concentration_screens.column_arrays(df), dict({'min_volume': min_volume}, **(params or {})))
+        filtered_df = df[mask].copy()
 
         # 步驟 2: 定義想要顯示的欄位列表
-        display_columns = [
-            '編號', '代碼', '股票名稱', '1日集中度', '5日集中度', 
-            '10日集中度', '20日集中度', '60日集中度', '120日集中度', '10日均量'
-        ]
+        display_columns = ALL_COLUMNS
         
         # 步驟 3: 從篩選後的結果中，只選取這些欄位並回傳
         # 確保所有要顯示的欄位都存在於 DataFrame 中，避免出錯
@@ -114,8 +243,8 @@ def filter_stock_data(df, min_volume=2000):
         
         return filtered_df[final_columns]
     
-    except KeyError as e:
-        print(f"篩選時發生欄位不存在的錯誤：{e}")
+    except concentration_screens.ScreenError as e:
+        print(f"篩選條件錯誤：{e}")
         return None
 
 if __name__ == '__main__':
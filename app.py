@@ -1,9 +1,10 @@
 # app.py (已修改)
 
-from flask import Flask, render_template, request, url_for, redirect, flash
+from flask import Flask, render_template, request, url_for, redirect, flash, jsonify, Response, abort
 import os
+import gzip
+import json
 import pandas as pd
-import importlib
 
 # --------------------------------------------------------------------------------
 # 【新增】導入您的 scraper.py
@@ -22,13 +23,18 @@ from dotenv import load_dotenv
 load_dotenv('Finmind.env')
 
 try:
-    from stock_analyzer import analyze_stock
-    from stock_information_plot import plot_stock_revenue_trend, plot_stock_major_shareholders, get_stock_code
-    import stock_holders_scraper
-    
-    concentration_analyzer = importlib.import_module("1日籌碼集中度")
-    fetch_stock_concentration_data = concentration_analyzer.fetch_stock_concentration_data
-    filter_stock_data = concentration_analyzer.filter_stock_data
+    import symbol_table
+    from stock_information_plot import load_major_shareholders_data
+    from chart_pipeline import render_chart_png
+    from stock_analyzer import fetch_analyzer, compute_batch_indicators, indicator_payload
+    from finmind_scheduler import get_scheduler, request_priority, INTERACTIVE
+    import chart_cache
+    import concentration_history
+    import concentration_screens
+    import technical_screener
+    import job_queue
+    from background_jobs import CONCENTRATION_PICK, SHAREHOLDER_UPDATE, INDICATOR_REFRESH, PRICE_INGEST
+    from indicator_state import IndicatorState
 
 except ImportError as e:
     print(f"錯誤：無法導入必要的模組。請確認 'stock_analyzer.py', 'stock_information_plot.py', 'stock_holders_scraper.py' 和 '1日籌碼集中度.py' 檔案皆存在於同個資料夾中。")
@@ -39,23 +45,29 @@ except ImportError as e:
 app = Flask(__name__)
 app.secret_key = 'a_random_secret_key_for_your_app'
 
-if not os.path.exists('static'):
+# 停用磁碟圖表快取時不寫入 static，可部署在唯讀或暫時性的檔案系統
+if chart_cache.CHART_CACHE_WRITE_DISK and not os.path.exists('static'):
     os.makedirs('static')
 
-# 資料載入與管理
-stock_list_df = None
+# 首頁顯示的三種圖表 (技術分析圖、月營收趨勢圖、大戶股權變化圖)
+CHART_KINDS = ('tech', 'revenue', 'shareholders')
 
-def load_stock_list():
-    """從 CSV 檔案載入股票代碼與名稱的對照表。"""
-    try:
-        return pd.read_csv('大戶股權.csv')[['Code', 'Name']]
-    except FileNotFoundError:
-        return None
-    except Exception as e:
-        print(f"讀取 '大戶股權.csv' 時發生錯誤: {e}")
-        return None
+# 背景工作者執行緒數量；設為 0 時需另外執行 `python background_jobs.py` 啟動專用工作者行程
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '1'))
 
-stock_list_df = load_stock_list()
+# 資料載入與管理
+# 繪圖行程池以 spawn 啟動子行程時會以 __mp_main__ 重新匯入本模組 (python app.py 的情況)，
+# 子行程不應建立股票索引或啟動背景工作者，只在 web 行程 (直接執行或 gunicorn worker) 中進行
+if __name__ != '__mp_main__':
+    # 股票代碼與名稱的索引在啟動時建立，大戶股權.csv 更新後自動重建
+    symbol_table.get_symbol_table()
+    job_queue.start_workers(JOB_WORKERS)
+
+@app.context_processor
+def inject_screens():
+    """首頁的籌碼集中度選股下拉選單 (具名篩選條件)"""
+    return {'screens': list(concentration_screens.get_screens().values()),
+            'default_screen': concentration_screens.DEFAULT_SCREEN}
 
 # Flask 路由 (Routes)
 
@@ -66,129 +78,117 @@ def index():
         stock_identifier = request.form.get('stock_id')
         if not stock_identifier:
             return render_template('index.html', error="請輸入股票代碼或名稱。")
-        
-        if stock_list_df is None:
-             return render_template('index.html', error="找不到 '大戶股權.csv' 檔案，請先點擊「大戶股權每周更新」按鈕來下載最新資料。")
 
-        stock_code = None
-        try:
-            if str(stock_identifier).isdigit() and int(stock_identifier) in stock_list_df['Code'].values:
-                stock_code = str(int(stock_identifier))
-        except ValueError:
-            pass
-        
-        if not stock_code:
-            stock_code = get_stock_code(stock_identifier, stock_list_df)
+        # 互動查詢的 FinMind 請求優先於批次選股
+        with request_priority(INTERACTIVE):
+            return _render_stock_analysis(stock_identifier)
 
-        if not stock_code:
-            return render_template('index.html', stock_id_show=stock_identifier, error=f"找不到股票 '{stock_identifier}'。請確認代碼或名稱是否正確。")
+    return render_template('index.html')
 
-        stock_name = stock_list_df[stock_list_df['Code'] == int(stock_code)]['Name'].values[0]
 
-        tech_analysis_path_rel = os.path.join('static', f'stock_analysis_{stock_code}.png')
-        revenue_chart_path_rel = os.path.join('static', f'revenue_{stock_code}.png')
-        shareholder_chart_path_rel = os.path.join('static', f'shareholders_{stock_code}.png')
+def _render_stock_analysis(stock_identifier):
+    """解析股票代碼並產生 (或沿用) 三張分析圖，回傳首頁。"""
+    symbols = symbol_table.get_symbol_table()
+    if not symbols.has_shareholders:
+         return render_template('index.html', error="找不到 '大戶股權.csv' 檔案，請先點擊「大戶股權每周更新」按鈕來下載最新資料。")
 
-        if not os.path.exists(tech_analysis_path_rel):
-            print(f"技術分析圖不存在，正在為 {stock_code} 生成...")
-            error_msg = analyze_stock(stock_code)
-            if "錯誤" in str(error_msg):
-                return render_template('index.html', error=error_msg)
-        
-        if not os.path.exists(revenue_chart_path_rel):
-            print(f"營收圖不存在，正在為 {stock_code} 生成...")
-            error_msg = plot_stock_revenue_trend(stock_code, revenue_chart_path_rel)
-            if error_msg:
-                return render_template('index.html', error=error_msg)
-        
-        if not os.path.exists(shareholder_chart_path_rel):
-            print(f"大戶股權圖不存在，正在為 {stock_code} 生成...")
-            error_msg = plot_stock_major_shareholders(stock_code, shareholder_chart_path_rel)
+    stock_code = symbols.resolve(stock_identifier)
+    if not stock_code:
+        return render_template('index.html', stock_id_show=stock_identifier, error=f"找不到股票 '{stock_identifier}'。請確認代碼或名稱是否正確。")
+
+    stock_name = symbols.name(stock_code)
+
+    # 圖表快取以收盤日期 / 大戶股權更新時間區分版本，過期或尚未產生的圖才重新繪製 (在記憶體中完成)
+    # 技術分析圖由前端以 /api/indicators 的資料繪製，PNG 只在前端無法繪製時才即時產生
+    chart_urls = {}
+    for kind in CHART_KINDS:
+        if kind != 'tech':
+            png, _, error_msg = chart_cache.get_png(kind, stock_code, lambda: render_chart_png(kind, stock_code))
             if error_msg:
                 return render_template('index.html', error=error_msg)
-        
-        return render_template('index.html', 
-                               tech_chart=url_for('static', filename=f'stock_analysis_{stock_code}.png'), 
-                               revenue_chart=url_for('static', filename=f'revenue_{stock_code}.png'),
-                               shareholder_chart=url_for('static', filename=f'shareholders_{stock_code}.png'),
-                               stock_id_show=f"{stock_name} ({stock_code})")
-
-    return render_template('index.html')
+        chart_urls[kind] = url_for('chart_png', kind=kind, stock_code=stock_code)
+
+    return render_template('index.html', 
+                           tech_chart=chart_urls['tech'], 
+                           tech_data=url_for('indicator_api', stock_code=stock_code, precision='float32'),
+                           revenue_chart=chart_urls['revenue'],
+                           shareholder_chart=chart_urls['shareholders'],
+                           stock_id_show=f"{stock_name} ({stock_code})")
+
+
+@app.route('/chart/<kind>/<stock_code>.png')
+def chart_png(kind, stock_code):
+    """
+    直接從記憶體回傳圖表 PNG (快取未命中時即時繪製)。
+    網址固定，以包含資料版本的 ETag 讓瀏覽器重新驗證；資料未更新時回應 304。
+    """
+    if kind not in CHART_KINDS:
+        abort(404)
+
+    key = chart_cache.chart_key(kind, stock_code)
+    if key in request.if_none_match:
+        response = Response(status=304)
+    else:
+        # 瀏覽器載入圖片屬於互動查詢，快取未命中時的 FinMind 請求優先於批次選股
+        with request_priority(INTERACTIVE):
+            png, key, error_msg = chart_cache.get_png(kind, stock_code, lambda: render_chart_png(kind, stock_code))
+        if error_msg:
+            return Response(error_msg, status=404, mimetype='text/plain')
+        response = Response(png, mimetype='image/png')
+    response.set_etag(key)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
+
+
+# 已排入建立指標狀態工作的股票 (避免重複排入)
+_queued_states = set()
+
+
+@app.route('/api/indicators/<stock_code>')
+def indicator_api(stock_code):
+    """
+    回傳日K、技術指標與交易訊號的欄式 JSON，供前端繪製技術分析圖。
+    ?precision=float32 時數值只保留 float32 精度；用戶端支援時以 gzip 壓縮。
+    """
+    float32 = request.args.get('precision') == 'float32'
+    etag = chart_cache.chart_key('tech', stock_code) + ('_f32' if float32 else '')
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        try:
+            with request_priority(INTERACTIVE):
+                analyzer = fetch_analyzer(stock_code)
+            compute_batch_indicators([analyzer])
+        except Exception as e:
+            return jsonify({'error': f"分析過程發生錯誤 ({stock_code}): {str(e)}"}), 404
+        # 查看過的股票加入增量指標狀態的觀察清單；狀態由背景工作建立，不在請求中寫入
+        if not IndicatorState.exists(analyzer.stock_id) and analyzer.stock_id not in _queued_states:
+            _queued_states.add(analyzer.stock_id)
+            job_queue.submit_job(INDICATOR_REFRESH, {'stock_ids': [analyzer.stock_id]})
+
+        payload = indicator_payload(analyzer, float32=float32)
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        response = Response(body, mimetype='application/json')
+        if 'gzip' in request.accept_encodings:
+            response.set_data(gzip.compress(body, compresslevel=6))
+            response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
 
 
 @app.route('/concentration_pick', methods=['POST'])
 def concentration_pick():
-    """執行籌碼集中度選股，並為結果批量生成圖表。"""
-    try:
-        flash("開始執行籌碼集中度選股，過程可能需要數分鐘，請耐心等候...", "success")
-        
-        stock_data = fetch_stock_concentration_data()
-        
-        if stock_data is None:
-            flash("無法獲取籌碼集中度資料，可能是來源網站暫時無法訪問或格式已變更。", "error")
-            return redirect(url_for('index'))
-
-        filtered_stocks = filter_stock_data(stock_data)
-        
-        if filtered_stocks is None:
-            flash("資料篩選過程中發生錯誤，請查看終端機日誌。", "error")
-            return redirect(url_for('index'))
-
-        if filtered_stocks.empty:
-            flash("根據篩選條件，目前沒有找到任何符合的股票。", "success")
-            return redirect(url_for('index'))
-        
-        print("\n===== 開始為篩選出的股票批量生成圖表 =====")
-        filtered_stocks['代碼'] = filtered_stocks['代碼'].astype(str)
-
-        for index, stock in filtered_stocks.iterrows():
-            stock_code = stock['代碼']
-            stock_name = stock['股票名稱']
-            print(f"\n--- 正在處理: {stock_name} ({stock_code}) ---")
-
-            try:
-                print(f"  -> 生成技術分析圖...")
-                tech_chart_result = analyze_stock(stock_code)
-                if "錯誤" in str(tech_chart_result):
-                    print(f"     [失敗] 技術分析圖生成失敗: {tech_chart_result}")
-                else:
-                    print(f"     [成功] 技術分析圖已儲存至 {tech_chart_result}")
-
-                print(f"  -> 生成月營收趨勢圖...")
-                revenue_chart_path = os.path.join('static', f'revenue_{stock_code}.png')
-                revenue_error = plot_stock_revenue_trend(stock_code, revenue_chart_path)
-                if revenue_error:
-                    print(f"     [失敗] 月營收圖生成失敗: {revenue_error}")
-                else:
-                    print(f"     [成功] 月營收趨勢圖已儲存至 {revenue_chart_path}")
-
-                print(f"  -> 生成大戶股權變化圖...")
-                shareholder_chart_path = os.path.join('static', f'shareholders_{stock_code}.png')
-                shareholder_error = plot_stock_major_shareholders(stock_code, shareholder_chart_path)
-                if shareholder_error:
-                    print(f"     [失敗] 大戶股權圖生成失敗: {shareholder_error}")
-                else:
-                    print(f"     [成功] 大戶股權變化圖已儲存至 {shareholder_chart_path}")
-            
-            except Exception as e:
-                print(f"  -> 為 {stock_name} ({stock_code}) 生成圖表時發生未預期錯誤: {e}")
-                continue
-
-        print("===== 所有圖表生成完畢 =====\n")
-        flash("選股完成！所有符合條件的股票圖表均已在背景生成完畢。", "success")
-
-        concentration_table_html = filtered_stocks.to_html(
-            classes='table-style', 
-            index=False, 
-            border=0
-        )
-        
-        return render_template('index.html', concentration_table=concentration_table_html)
-
-    except Exception as e:
-        print(f"執行籌碼集中度選股的總過程中發生未預期錯誤: {e}")
-        flash(f"執行選股時發生嚴重錯誤: {e}", "error")
-        return redirect(url_for('index'))
+    """將籌碼集中度選股與批量生成圖表排入背景工作，並導向進度頁面。"""
+    screen = request.form.get('screen') or concentration_screens.DEFAULT_SCREEN
+    if screen not in concentration_screens.get_screens():
+        return render_template('index.html', error=f"找不到篩選條件 '{screen}'。")
+    job_id = job_queue.submit_job(CONCENTRATION_PICK, {'screen': screen})
+    flash("已開始執行籌碼集中度選股，過程可能需要數分鐘，頁面會自動更新進度...", "success")
+    return redirect(url_for('job_page', job_id=job_id))
 
 # --------------------------------------------------------------------------------
 # 【新增】處理 "我的選股" 的路由
@@ -226,19 +226,157 @@ def my_stock_picks():
 
 @app.route('/update', methods=['POST'])
 def update_data():
-    """執行爬蟲來更新大戶股權資料"""
-    global stock_list_df
+    """將大戶股權資料更新排入背景工作，並導向進度頁面。"""
+    job_id = job_queue.submit_job(SHAREHOLDER_UPDATE)
+    flash("已開始更新大戶股權資料，頁面會自動更新進度...", "success")
+    return redirect(url_for('job_page', job_id=job_id))
+
+@app.route('/update_prices', methods=['POST'])
+def update_prices():
+    """將全市場日K匯入排入背景工作 (完成後接著更新增量指標狀態)，並導向進度頁面。"""
+    job_id = job_queue.submit_job(PRICE_INGEST)
+    flash("已開始匯入全市場日K，頁面會自動更新進度...", "success")
+    return redirect(url_for('job_page', job_id=job_id))
+
+@app.route('/jobs/<job_id>')
+def job_page(job_id):
+    """背景工作的進度頁面；工作完成後顯示結果。"""
+    job = job_queue.get_job(job_id)
+    if job is None:
+        return render_template('index.html', error=f"找不到背景工作 '{job_id}'。")
+
+    if job['status'] == job_queue.FAILED:
+        return render_template('index.html', error=f"背景工作執行失敗: {job['error']}")
+
+    if job['status'] != job_queue.DONE:
+        return render_template('index.html', job_id=job_id)
+
+    if job['kind'] == SHAREHOLDER_UPDATE:
+        symbol_table.get_symbol_table()
+        return render_template('index.html', job_message=job['result']['message'])
+
+    if 'table' not in job['result']:
+        return render_template('index.html', job_message=job['result'].get('message'))
+
+    table = job['result']['table']
+    filtered_stocks = pd.DataFrame(table['data'], columns=table['columns'])
+    if filtered_stocks.empty:
+        return render_template('index.html', job_message="根據篩選條件，目前沒有找到任何符合的股票。")
+
+    concentration_table_html = filtered_stocks.to_html(
+        classes='table-style', 
+        index=False, 
+        border=0
+    )
+    return render_template('index.html', concentration_table=concentration_table_html,
+                           job_message=job['progress'].get('message'))
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """回傳背景工作狀態與逐檔進度 (供頁面輪詢)"""
+    job = job_queue.get_job(job_id)
+    if job is None:
+        return jsonify({'error': f"找不到背景工作 '{job_id}'"}), 404
+    return jsonify({key: job[key] for key in ('id', 'kind', 'status', 'progress', 'error',
+                                              'created_at', 'started_at', 'finished_at')})
+
+@app.route('/api/symbols')
+def symbol_search():
+    """股票代碼 / 名稱自動完成：?q=查詢字串&limit=筆數"""
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    return jsonify(symbol_table.get_symbol_table().search(request.args.get('q', ''), limit))
+
+@app.route('/api/shareholders/<stock_code>')
+def shareholder_history_api(stock_code):
+    """回傳大戶股權歷史資料：?start=YYYY-MM-DD&end=YYYY-MM-DD (皆可省略)"""
+    shareholder_data, error_msg = load_major_shareholders_data(
+        stock_code, request.args.get('start'), request.args.get('end'))
+    if error_msg:
+        return jsonify({'error': error_msg}), 404
+    return jsonify({
+        'code': shareholder_data['code'],
+        'name': shareholder_data['name'],
+        'dates': list(shareholder_data['dates']),
+        'values': [float(value) for value in shareholder_data['values']],
+    })
+
+@app.route('/api/concentration/history')
+def concentration_history_api():
+    """
+    以歷史快照執行跨日籌碼集中度篩選：
+    ?screen=filter_streak (連續符合 5日>10日>20日 條件) 或 rising (1日集中度連續上升)
+    &days=連續天數&min_volume=10日均量下限&start=YYYY-MM-DD&name=篩選條件名稱 (filter_streak 使用，預設為多頭排列)
+    """
+    screen = request.args.get('screen', 'filter_streak')
+    days = max(request.args.get('days', 3, type=int), 1)
+    start = request.args.get('start')
+    if screen == 'filter_streak':
+        try:
+            result = concentration_history.filter_streak(days, request.args.get('min_volume', 2000, type=float),
+                                                         start, request.args.get('name'))
+        except concentration_screens.ScreenError as e:
+            return jsonify({'error': str(e)}), 400
+    elif screen == 'rising':
+        result = concentration_history.rising_streak(days, start_date=start)
+    else:
+        return jsonify({'error': f"未知的篩選條件 '{screen}'"}), 400
+    return jsonify({
+        'screen': screen,
+        'days': days,
+        'snapshot_days': concentration_history.snapshot_days()[-days:],
+        'columns': list(result.columns),
+        'data': json.loads(result.to_json(orient='values', force_ascii=False)),
+    })
+
+@app.route('/api/screens', methods=['GET', 'POST'])
+def screens_api():
+    """
+    GET: 列出所有具名篩選條件與可用欄位
+    POST: 新增或覆寫篩選條件 (JSON: name, expression, params, description)，運算式不合法時回傳 400
+    """
+    if request.method == 'POST':
+        payload = request.get_json(silent=True) or {}
+        try:
+            screen = concentration_screens.save_screen(payload.get('name', ''), payload.get('expression', ''),
+                                                       payload.get('params'), payload.get('description', ''))
+        except concentration_screens.ScreenError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(screen.to_dict()), 201
+    return jsonify({
+        'columns': concentration_screens.SCHEMA,
+        'screens': [screen.to_dict() for screen in concentration_screens.get_screens().values()],
+    })
+
+@app.route('/api/technical/screen')
+def technical_screen_api():
+    """
+    全市場技術面篩選 (以本地全市場日K矩陣計算，結果依矩陣版本快取)：
+    ?stair=階梯訊號 I&deviation=乖離訊號 J&trend=多空訊號 K&kd=KD訊號 L
+    &events=事件 (逗號分隔，例如 stair_changed,kd_golden_cross)&sort=排序欄位&order=asc|desc
+    &limit=筆數&all=1 (包含最後一根日K不是最新交易日的股票)
+    """
+    events = [event for event in request.args.get('events', '').split(',') if event]
     try:
-        print("開始執行大戶股權資料更新...")
-        stock_holders_scraper.main()
-        stock_list_df = load_stock_list()
-        print("資料更新成功，DataFrame 已重新載入。")
-        flash("大戶股權資料已成功更新！", "success")
-    except Exception as e:
-        print(f"資料更新過程中發生嚴重錯誤: {e}")
-        flash(f"資料更新失敗，請查看終端機錯誤訊息: {e}", "error")
-    
-    return redirect(url_for('index'))
+        result, latest_day = technical_screener.screen(
+            stair=request.args.get('stair', type=int), deviation=request.args.get('deviation', type=int),
+            trend=request.args.get('trend', type=int), kd=request.args.get('kd', type=int), events=events,
+            sort=request.args.get('sort', '成交量'), ascending=request.args.get('order') == 'asc',
+            limit=request.args.get('limit', 100, type=int), include_stale=request.args.get('all') == '1')
+    except ValueError as e:
+        return jsonify({'error': str(e), 'events': technical_screener.EVENTS}), 400
+    if result is None:
+        return jsonify({'error': "尚未建立全市場日K矩陣，請先執行全市場日K匯入 (python price_ingest.py)。"}), 503
+    return jsonify({
+        'date': latest_day,
+        'count': len(result),
+        'columns': list(result.columns),
+        'data': json.loads(result.to_json(orient='values', force_ascii=False)),
+    })
+
+@app.route('/api/finmind_quota')
+def finmind_quota():
+    """回傳 FinMind 請求額度狀態 (剩餘額度、批次是否延後、排隊中的請求數)"""
+    return jsonify(get_scheduler().status())
 
 # 應用程式啟動點
 
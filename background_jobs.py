@@ -0,0 +1,187 @@
+import os
+import json
+import importlib
+
+import job_queue
+import symbol_table
+import shareholder_store
+import shareholder_history
+import revenue_store
+import price_ingest
+import price_store
+import concentration_history
+import stock_holders_scraper
+from indicator_state import IndicatorState
+from stock_analyzer import refresh_indicator_states
+from chart_pipeline import run_chart_pipeline
+from finmind_client import get_client
+
+# 背景工作的處理函式
+# app.py 以 job_queue.submit_job 排入工作；可由 app 行程內的工作者執行緒執行，
+# 也可另外以 `python background_jobs.py` 啟動專用的工作者行程。
+
+CONCENTRATION_PICK = 'concentration_pick'
+SHAREHOLDER_UPDATE = 'shareholder_update'
+REVENUE_WARM_UP = 'revenue_warm_up'
+PRICE_INGEST = 'price_ingest'
+INDICATOR_REFRESH = 'indicator_refresh'
+CONCENTRATION_CAPTURE = 'concentration_capture'
+
+concentration_analyzer = importlib.import_module("1日籌碼集中度")
+
+
+def run_concentration_pick(params: dict, report_progress) -> dict:
+    """執行籌碼集中度選股，並為結果批量生成圖表 (逐檔回報進度)"""
+    report_progress({'message': '正在獲取籌碼集中度資料...'})
+    stock_data = concentration_analyzer.fetch_stock_concentration_data()
+    if stock_data is None:
+        raise ValueError("無法獲取籌碼集中度資料，可能是來源網站暫時無法訪問或格式已變更。")
+
+    filtered_stocks = concentration_analyzer.filter_stock_data(stock_data, screen=params.get('screen'))
+    if filtered_stocks is None:
+        raise ValueError("資料篩選過程中發生錯誤，請查看終端機日誌。")
+
+    filtered_stocks['代碼'] = filtered_stocks['代碼'].astype(str)
+    stock_codes = filtered_stocks['代碼'].tolist()
+    progress = {
+        'message': f'共篩選出 {len(stock_codes)} 檔股票，正在生成圖表...',
+        'total': len(stock_codes),
+        'done': 0,
+        'stocks': {code: {} for code in stock_codes},
+    }
+    report_progress(progress)
+
+    def on_chart_done(stock_code, kind, error_msg):
+        progress['stocks'][stock_code][kind] = error_msg or 'ok'
+        progress['done'] = sum(len(charts) == 3 for charts in progress['stocks'].values())
+        report_progress(progress)
+
+    # 先以全市場查詢更新月營收與最近的日K，批量繪圖時不必逐檔向 FinMind 確認
+    try:
+        revenue_store.warm_up(get_client())
+    except Exception as e:
+        print(f"警告: 月營收整批預熱失敗，將逐檔查詢: {e}")
+    try:
+        queue_indicator_refresh(price_ingest.catch_up())
+    except Exception as e:
+        print(f"警告: 全市場日K匯入失敗，將逐檔查詢: {e}")
+
+    print("\n===== 開始為篩選出的股票批量生成圖表 =====")
+    run_chart_pipeline(stock_codes, progress=on_chart_done)
+    print("===== 所有圖表生成完畢 =====\n")
+
+    progress['message'] = '選股完成！所有符合條件的股票圖表均已生成完畢。'
+    report_progress(progress)
+    return {'table': json.loads(filtered_stocks.to_json(orient='split', index=False, force_ascii=False))}
+
+
+def run_concentration_capture(params: dict, report_progress) -> dict:
+    """取得當日的籌碼集中度排行並保存為歷史快照 (不需有人點選選股，跨日篩選的交易日才不會缺漏)"""
+    report_progress({'message': '正在保存籌碼集中度快照...'})
+    stock_data = concentration_analyzer.fetch_stock_concentration_data(force_refresh=True)
+    if stock_data is None:
+        raise ValueError("無法獲取籌碼集中度資料，可能是來源網站暫時無法訪問或格式已變更。")
+    return {'message': f'籌碼集中度快照已保存，共 {len(stock_data)} 檔。'}
+
+
+def queue_concentration_capture():
+    """
+    最近交易日尚未保存籌碼集中度快照時排入保存工作
+    :return: 工作 ID；已有快照時回傳 None
+    """
+    if price_store.latest_trading_day().isoformat() not in concentration_history.snapshot_days():
+        return job_queue.submit_job(CONCENTRATION_CAPTURE)
+    return None
+
+
+def run_shareholder_update(params: dict, report_progress) -> dict:
+    """執行爬蟲來更新大戶股權資料"""
+    report_progress({'message': '正在下載大戶股權資料...'})
+    csv_path = '大戶股權.csv'
+    before = os.path.getmtime(csv_path) if os.path.exists(csv_path) else None
+    stock_holders_scraper.main()
+    after = os.path.getmtime(csv_path) if os.path.exists(csv_path) else None
+    if after is None or after == before:
+        raise ValueError("大戶股權資料更新失敗，請查看終端機錯誤訊息。")
+    # 重新載入共用的大戶股權資料並合併進歷史資料庫，再以新的資料建立股票索引後整批替換
+    store = shareholder_store.reload(csv_path)
+    if store is not None:
+        shareholder_history.merge_store(store)
+    symbol_table.rebuild(csv_path)
+    return {'message': '大戶股權資料已成功更新！'}
+
+
+def run_revenue_warm_up(params: dict, report_progress) -> dict:
+    """以一次全市場查詢更新本月公告的月營收 (由每日的全市場日K匯入排入；force 為 True 時不論是否到期都執行)"""
+    report_progress({'message': '正在更新全市場月營收...'})
+    count = revenue_store.warm_up(get_client(), force=params.get('force', False))
+    return {'message': f'月營收已更新，共 {count} 筆。'}
+
+
+def queue_revenue_warm_up():
+    """
+    月營收整批預熱到期 (revenue_store.warm_up_due) 時排入預熱工作
+    :return: 工作 ID；不需預熱時回傳 None
+    """
+    if revenue_store.warm_up_due():
+        return job_queue.submit_job(REVENUE_WARM_UP)
+    return None
+
+
+def run_price_ingest(params: dict, report_progress) -> dict:
+    """匯入最近 days 天內尚未匯入的全市場日K (可中斷後重新執行)"""
+    def on_day_done(day, done, total):
+        report_progress({'message': f'正在匯入全市場日K ({day})...', 'done': done, 'total': total})
+
+    report_progress({'message': '正在匯入全市場日K...'})
+    result = price_ingest.ingest_pending(params.get('days', price_ingest.INGEST_BACKFILL_DAYS),
+                                         force=params.get('force', False), progress=on_day_done)
+    message = f"全市場日K匯入完成：{result['days']} 個日期，共 {result['rows']} 筆。"
+    if result['pending']:
+        message += f" 尚未發布: {', '.join(result['pending'])}"
+    queue_indicator_refresh(result)
+    # 每日收盤後的匯入同時負責排入月營收的整批預熱 (公告期間每天一次，期限過後再一次)
+    # 與當日的籌碼集中度快照 (來源網頁只提供當日排行，錯過就無法補齊)
+    queue_revenue_warm_up()
+    queue_concentration_capture()
+    return {'message': message}
+
+
+def queue_indicator_refresh(ingest_result: dict):
+    """
+    全市場日K匯入了新的日期後，排入增量指標狀態的更新工作 (觀察清單為空時不排入)
+    :param ingest_result: price_ingest.ingest_range 的結果
+    :return: 工作 ID；不需更新時回傳 None
+    """
+    if len(ingest_result['pending']) < ingest_result['days'] and IndicatorState.saved_ids():
+        return job_queue.submit_job(INDICATOR_REFRESH)
+    return None
+
+
+def run_indicator_refresh(params: dict, report_progress) -> dict:
+    """以增量指標狀態加入新的日K (未指定股票時更新所有已保存狀態的股票)"""
+    def on_stock_done(stock_id, done, total):
+        report_progress({'message': f'正在更新指標狀態 ({stock_id})...', 'done': done, 'total': total})
+
+    report_progress({'message': '正在更新增量指標狀態...'})
+    results = refresh_indicator_states(params.get('stock_ids'), progress=on_stock_done)
+    errors = {stock_id: result for stock_id, result in results.items() if isinstance(result, str)}
+    if results and len(errors) == len(results):
+        raise ValueError(f"所有股票的指標狀態更新失敗: {'; '.join(errors.values())}")
+    return {'message': f'指標狀態已更新 {len(results) - len(errors)} 檔。', 'errors': errors}
+
+
+job_queue.register_handler(CONCENTRATION_CAPTURE, run_concentration_capture)
+job_queue.register_handler(CONCENTRATION_PICK, run_concentration_pick)
+job_queue.register_handler(INDICATOR_REFRESH, run_indicator_refresh)
+job_queue.register_handler(PRICE_INGEST, run_price_ingest)
+job_queue.register_handler(REVENUE_WARM_UP, run_revenue_warm_up)
+job_queue.register_handler(SHAREHOLDER_UPDATE, run_shareholder_update)
+
+
+if __name__ == '__main__':
+    """啟動專用的背景工作者行程"""
+    from dotenv import load_dotenv
+    load_dotenv('Finmind.env')
+    print("背景工作者已啟動，等待工作中...")
+    job_queue.worker_loop()
@@ -0,0 +1,302 @@
+import os
+import sys
+import time
+import argparse
+import itertools
+import multiprocessing
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import price_matrix
+from indicator_engine import (rolling_mean, stochastic, macd, stair_signal, deviation_signal, trend_signal,
+                              kd_signal)
+
+# 技術訊號回測
+# 以全市場日K矩陣 (price_matrix) 回測以 I/J/K/L 訊號組成的進出場規則：
+# 每組指標參數 (SMA 週期、KD、MACD) 一次計算所有股票的 (交易日 × 股票) 指標矩陣，
+# 再對乖離門檻與進出場規則的每個組合以矩陣運算模擬持股，不逐檔、不逐日迴圈。
+# 不同的指標參數分配到行程池平行計算；各行程以 memmap 共用同一份日K矩陣。
+#
+# 交易規則：第 t 日收盤出現進場訊號即以收盤價買進，出現出場訊號即以收盤價賣出 (同日兩者皆有時不進場)，
+# 期末仍持有的部位以最後收盤價計算。組合報酬為每日 (前一日收盤的) 持股等權重的平均報酬，
+# 已扣除手續費與證交稅 (買進手續費計入買進隔日的報酬)。
+#
+# 使用方式：
+#   python backtester.py                                   # 預設參數、所有進出場規則
+#   python backtester.py --sma 5,20,60 --sma 10,20,60 --kd 9,3,3 --kd 5,3,3 --threshold 5 --threshold 8
+#   python backtester.py --entry stair_1 --exit trend_down --start 2025-06-01 --top 20
+
+# 回測行程數量，可由環境變數 BACKTEST_WORKERS 調整；設為 0 表示在目前行程執行
+BACKTEST_WORKERS = int(os.getenv('BACKTEST_WORKERS', str(os.cpu_count() or 1)))
+
+# 交易成本：買賣各收手續費 0.1425%，賣出另收證交稅 0.3%
+FEE_RATE = 0.001425
+TAX_RATE = 0.003
+
+DEFAULT_SMA = (5, 20, 60)
+DEFAULT_KD = (9, 3, 3)
+DEFAULT_MACD = (12, 26, 9)
+DEFAULT_THRESHOLD = 5
+
+
+def _previous(matrix: np.ndarray) -> np.ndarray:
+    """前一日的值 (第一日為 NaN)"""
+    result = np.full(matrix.shape, np.nan)
+    result[1:] = matrix[:-1]
+    return result
+
+
+# 進場規則 (s 為 compute_signal_matrices 的結果，*_prev 為前一日的值)
+ENTRY_RULES = {
+    'stair_1': ('階梯訊號轉為 1 (週-月 ≥ 週-季 ≥ 月-季)', lambda s: (s['I_value'] == 1) & (s['I_prev'] != 1)),
+    'stair_3': ('階梯訊號轉為 3 (週-季 ≥ 月-季 ≥ 週-月)', lambda s: (s['I_value'] == 3) & (s['I_prev'] != 3)),
+    'trend_up': ('多空訊號由空轉多', lambda s: (s['K_value'] == 3) & (s['K_prev'] == -3)),
+    'kd_oversold_cross': ('KD 超賣區 (K ≤ 20) 黃金交叉',
+                          lambda s: (s['k_prev'] <= s['d_prev']) & (s['k'] > s['d']) & (s['k_prev'] <= 20)),
+    'deviation_rebound': ('收盤價由月線負乖離門檻以下回升', lambda s: (s['J_prev'] == -4) & (s['J_value'] != -4)),
+    'macd_turn_positive': ('MACD 柱狀體由負轉正', lambda s: (s['hist_prev'] <= 0) & (s['macd_hist'] > 0)),
+}
+
+# 出場規則
+EXIT_RULES = {
+    'stair_negative': ('階梯訊號轉為負值', lambda s: s['I_value'] < 0),
+    'trend_down': ('多空訊號轉空', lambda s: s['K_value'] == -3),
+    'kd_overbought': ('KD 進入超買區 (K ≥ 80)', lambda s: s['L_value'] == 100),
+    'deviation_high': ('收盤價高於月線正乖離門檻', lambda s: s['J_value'] == 4),
+    'macd_turn_negative': ('MACD 柱狀體轉負', lambda s: s['macd_hist'] < 0),
+}
+
+_prices = None  # ((矩陣版本, 起始日期, 股票), (日期, 靠右對齊的欄位, 列索引, 股票代碼))
+
+
+def load_universe(start_date: date = None, codes: list = None) -> tuple:
+    """
+    讀取回測用的靠右對齊日K (每個行程依矩陣版本保留一份)
+    :param start_date: 回測起始日期，None 表示矩陣的第一天
+    :param codes: 限定的股票代碼，None 表示全市場
+    :return: (日期 DatetimeIndex, {欄位: 靠右對齊的 (交易日 × 股票) 陣列}, 列索引 order, 股票代碼)
+    :raises ValueError: 尚未建立全市場日K矩陣
+    """
+    global _prices
+    matrix = price_matrix.get_matrix()
+    if matrix is None:
+        raise ValueError("尚未建立全市場日K矩陣，請先執行全市場日K匯入 (python price_ingest.py)。")
+    key = (matrix.version, start_date, tuple(codes) if codes else None)
+    if _prices is None or _prices[0] != key:
+        dates, aligned, order = matrix.aligned_window(start_date or matrix.dates[0].date())
+        selected = np.arange(len(matrix.codes)) if not codes else matrix.codes.get_indexer(codes)
+        selected = selected[selected >= 0]
+        aligned = {field: values[:, selected] for field, values in aligned.items()}
+        _prices = (key, (dates, aligned, order[:, selected], list(matrix.codes[selected])))
+    return _prices[1]
+
+
+def compute_signal_matrices(aligned: dict, sma: tuple = DEFAULT_SMA, kd: tuple = DEFAULT_KD,
+                            macd_params: tuple = DEFAULT_MACD) -> dict:
+    """
+    以指定參數計算回測需要的指標與 I/K/L 訊號矩陣 (預設參數與 compute_indicators / compute_signals 相同)
+    乖離訊號 J 與門檻有關，由 deviation_matrices 另外計算。
+    :param aligned: 靠右對齊的日K {'Close', 'High', 'Low', ...}
+    :param sma: (週線, 月線, 季線) 週期
+    :param kd: (K 週期, K 緩衝期, D 週期)
+    :param macd_params: (快線, 慢線, 信號線) 週期
+    """
+    close, high, low = aligned['Close'], aligned['High'], aligned['Low']
+    short, mid, long = (rolling_mean(close, period) for period in sma)
+    k, d = stochastic(high, low, close, *kd)
+    _, _, hist = macd(close, *macd_params)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dev_short_mid = (short - mid) / mid * 100
+        dev_mid_long = (mid - long) / long * 100
+        dev_short_long = (short - long) / long * 100
+        dev_close_mid = (close - mid) / mid * 100
+        signals = {
+            'I_value': stair_signal(dev_short_mid, dev_mid_long, dev_short_long),
+            'K_value': trend_signal(dev_short_long),
+            'L_value': kd_signal(k),
+        }
+    signals.update({'k': k, 'd': d, 'macd_hist': hist, 'dev_close_mid': dev_close_mid,
+                    'ready': ~np.isnan(long) & ~np.isnan(close)})
+    signals.update({'I_prev': _previous(signals['I_value']), 'K_prev': _previous(signals['K_value']),
+                    'k_prev': _previous(k), 'd_prev': _previous(d), 'hist_prev': _previous(hist)})
+    return signals
+
+
+def deviation_matrices(signals: dict, threshold: float) -> dict:
+    """加入指定門檻的乖離訊號 J (與 deviation_signal 相同) 及前一日的值"""
+    with np.errstate(invalid='ignore'):
+        j = deviation_signal(signals['dev_close_mid'], threshold)
+    return dict(signals, J_value=j, J_prev=_previous(j))
+
+
+def positions(entry: np.ndarray, exit_: np.ndarray) -> np.ndarray:
+    """
+    由進出場訊號推算每日收盤後是否持有 (向前填補最後一次訊號，不逐日迴圈)
+    :return: (交易日 × 股票) 布林矩陣
+    """
+    state = np.where(exit_, 0, np.where(entry, 1, -1)).astype(np.int8)
+    rows = np.arange(len(state), dtype=np.int32)[:, None]
+    last = np.maximum.accumulate(np.where(state >= 0, rows, 0), axis=0)
+    return np.take_along_axis(state, last, axis=0) == 1
+
+
+def daily_returns(close: np.ndarray) -> np.ndarray:
+    """每日報酬 (第 t 列為第 t-1 日收盤至第 t 日收盤；沒有資料時為 0)"""
+    returns = np.zeros(close.shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        np.divide(close[1:], close[:-1], out=returns[1:])
+    returns[1:] -= 1
+    returns[np.isnan(returns)] = 0
+    return returns
+
+
+def evaluate(close: np.ndarray, returns: np.ndarray, held: np.ndarray, order: np.ndarray, days: int) -> dict:
+    """
+    計算持股矩陣的績效
+    :param close: 靠右對齊的收盤價
+    :param returns: daily_returns(close)
+    :param held: positions 的結果 (與 close 對齊)
+    :param order: 靠右對齊的列索引 (每個位置原本的日期)，用來把每日報酬放回原本的日期計算組合績效
+    :param days: 原本的交易日數
+    :return: 交易次數、勝率、平均每筆報酬、平均持有天數、組合總報酬、最大回撤與平均持股數
+    """
+    # 每筆交易：進場為持有由 0 變 1 的收盤，出場為由 1 變 0 的收盤 (期末未出場以最後收盤計算)
+    changes = np.diff(held.view(np.int8), axis=0, prepend=0, append=0)
+    entry_cols, entry_rows = np.nonzero(changes.T == 1)
+    _, exit_rows = np.nonzero(changes.T == -1)
+    exit_prices = close[np.minimum(exit_rows, len(close) - 1), entry_cols]
+    trade_returns = exit_prices * (1 - FEE_RATE - TAX_RATE) / (close[entry_rows, entry_cols] * (1 + FEE_RATE)) - 1
+
+    # 每檔股票的每日報酬：第 t 日的報酬只屬於前一日收盤已持有的股票 (第 t 日收盤才買進的股票當日沒有報酬)。
+    # 買進手續費計入持有第一天 (買進隔日) 的報酬，賣出的手續費與證交稅計入賣出當日的報酬，
+    # 單一部位各日報酬連乘即等於該筆交易的報酬。依原本的日期加總後除以前一日收盤的持股數 (等權重)。
+    previous = np.zeros(held.shape, dtype=bool)
+    previous[1:] = held[:-1]
+    entered = np.zeros(held.shape, dtype=bool)
+    entered[1:] = held[:-1] & ~previous[:-1]
+    sold = previous & ~held
+    growth = np.where(previous, 1 + returns, 1.0)
+    growth[entered] /= 1 + FEE_RATE
+    growth[sold] *= 1 - FEE_RATE - TAX_RATE
+    stock_returns = growth - 1
+    totals = np.bincount(order.ravel(), weights=stock_returns.ravel(), minlength=days)
+    holdings = np.bincount(order[previous], minlength=days)
+    portfolio = totals / np.maximum(holdings, 1)
+    equity = np.cumprod(1 + portfolio)
+
+    return {
+        'trades': len(trade_returns),
+        'hit_rate': float(np.mean(trade_returns > 0)) if len(trade_returns) else np.nan,
+        'avg_trade_return': float(np.mean(trade_returns)) if len(trade_returns) else np.nan,
+        'avg_holding_days': float(np.mean(exit_rows - entry_rows)) if len(entry_rows) else np.nan,
+        'total_return': float(equity[-1] - 1) if len(equity) else 0.0,
+        'max_drawdown': float(np.min(equity / np.maximum.accumulate(equity) - 1)) if len(equity) else 0.0,
+        'avg_holdings': float(np.mean(holdings)) if len(holdings) else 0.0,
+    }
+
+
+def run_indicator_set(sma: tuple, kd: tuple, macd_params: tuple, thresholds: list, entries: list, exits: list,
+                      start_date: date = None, codes: list = None) -> list:
+    """
+    一組指標參數的所有乖離門檻與進出場規則組合 (行程池的一個工作；指標矩陣只計算一次)
+    :return: 每個組合一個 dict (參數與 evaluate 的結果)
+    """
+    dates, aligned, order, _ = load_universe(start_date, codes)
+    order = np.ascontiguousarray(order)
+    base = compute_signal_matrices(aligned, sma, kd, macd_params)
+    close = aligned['Close']
+    returns = daily_returns(close)
+    results = []
+    for threshold in thresholds:
+        signals = deviation_matrices(base, threshold)
+        with np.errstate(invalid='ignore'):
+            entry_masks = {name: ENTRY_RULES[name][1](signals) & signals['ready'] for name in entries}
+            exit_masks = {name: EXIT_RULES[name][1](signals) | ~signals['ready'] for name in exits}
+        for entry, exit_ in itertools.product(entries, exits):
+            held = positions(entry_masks[entry], exit_masks[exit_])
+            results.append({
+                'sma': ','.join(map(str, sma)), 'kd': ','.join(map(str, kd)),
+                'macd': ','.join(map(str, macd_params)), 'threshold': threshold,
+                'entry': entry, 'exit': exit_,
+                **evaluate(close, returns, held, order, len(dates)),
+            })
+    return results
+
+
+def run_sweep(sma_grid: list = None, kd_grid: list = None, macd_grid: list = None, thresholds: list = None,
+              entries: list = None, exits: list = None, start_date: date = None, codes: list = None,
+              workers: int = BACKTEST_WORKERS) -> pd.DataFrame:
+    """
+    回測參數格點的所有組合
+    每組 (SMA, KD, MACD) 參數是行程池的一個工作，其中的乖離門檻與進出場規則在同一份指標矩陣上計算。
+    :param sma_grid: [(週線, 月線, 季線), ...]
+    :param kd_grid: [(K 週期, K 緩衝期, D 週期), ...]
+    :param macd_grid: [(快線, 慢線, 信號線), ...]
+    :param thresholds: 乖離訊號門檻 (百分比)
+    :param entries: 進場規則名稱 (ENTRY_RULES)，None 表示全部
+    :param exits: 出場規則名稱 (EXIT_RULES)，None 表示全部
+    :param workers: 行程數量；0 表示在目前行程執行
+    :return: 每個組合一列，依組合總報酬排序
+    :raises ValueError: 未知的規則或尚未建立全市場日K矩陣
+    """
+    entries = list(entries or ENTRY_RULES)
+    exits = list(exits or EXIT_RULES)
+    unknown = [name for name in entries if name not in ENTRY_RULES] + [name for name in exits if name not in EXIT_RULES]
+    if unknown:
+        raise ValueError(f"未知的規則: {', '.join(unknown)}")
+    if price_matrix.get_matrix() is None:
+        raise ValueError("尚未建立全市場日K矩陣，請先執行全市場日K匯入 (python price_ingest.py)。")
+    tasks = [(tuple(sma), tuple(kd), tuple(macd_params), list(thresholds or [DEFAULT_THRESHOLD]), entries, exits,
+              start_date, codes)
+             for sma, kd, macd_params in itertools.product(sma_grid or [DEFAULT_SMA], kd_grid or [DEFAULT_KD],
+                                                           macd_grid or [DEFAULT_MACD])]
+
+    if workers <= 0 or len(tasks) == 1:
+        results = [run_indicator_set(*task) for task in tasks]
+    else:
+        # 使用 spawn 避免在多執行緒的 Flask 行程中 fork，並與 Windows 行為一致
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = list(pool.map(run_indicator_set, *zip(*tasks)))
+
+    table = pd.DataFrame([row for rows in results for row in rows])
+    return table.sort_values('total_return', ascending=False, ignore_index=True)
+
+
+def _periods(text: str) -> tuple:
+    return tuple(int(value) for value in text.split(','))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='技術訊號回測與參數掃描')
+    parser.add_argument('--sma', type=_periods, action='append', help='週線,月線,季線 週期 (可重複指定)')
+    parser.add_argument('--kd', type=_periods, action='append', help='K週期,K緩衝期,D週期 (可重複指定)')
+    parser.add_argument('--macd', type=_periods, action='append', help='快線,慢線,信號線 週期 (可重複指定)')
+    parser.add_argument('--threshold', type=float, action='append', help='乖離訊號門檻 (可重複指定)')
+    parser.add_argument('--entry', action='append', choices=list(ENTRY_RULES), help='進場規則 (預設全部)')
+    parser.add_argument('--exit', action='append', choices=list(EXIT_RULES), help='出場規則 (預設全部)')
+    parser.add_argument('--start', type=date.fromisoformat, help='回測起始日期 (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=BACKTEST_WORKERS, help='行程數量 (0 表示不使用行程池)')
+    parser.add_argument('--top', type=int, default=30, help='列出的組合數')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    try:
+        table = run_sweep(args.sma, args.kd, args.macd, args.threshold, args.entry, args.exit, args.start,
+                          workers=args.workers)
+    except ValueError as e:
+        print(e)
+        return 1
+    elapsed = time.perf_counter() - started
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(table.head(args.top).to_string(float_format=lambda value: f'{value:.4f}'))
+    print(f"共 {len(table)} 個組合，耗時 {elapsed:.1f} 秒。")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from stock_holders_scraper import StockHoldersScraper
+
+# 大戶股權表格解析效能比較
+# 以同一份 HTML 比較 lxml iterparse 單次走訪 (parse_table_stream) 與原本的
+# BeautifulSoup + pandas.read_html 解析 (process_table_read_html)：確認兩者結果相同，
+# 並列出執行時間與 tracemalloc 記錄的記憶體峰值。
+#
+# 使用方式：
+#   python benchmark_stock_holders_parser.py --record      # 從網站抓取並保存一份 HTML 作為測試資料
+#   python benchmark_stock_holders_parser.py               # 以保存的 HTML 執行比較
+# 測試資料不存在時，以 --rows 指定的列數產生相同版面的表格。
+
+FIXTURE_PATH = 'stock_holders_fixture.html'
+
+
+def build_fixture(rows: int = 3000, seed: int = 0) -> str:
+    """產生與 StockHoldersContinue.aspx 相同版面的 HTML (每列 18 欄以上，第 4 欄為代碼名稱)"""
+    rng = np.random.default_rng(seed)
+    weeks = pd.date_range(end=pd.Timestamp.today().normalize(), periods=12, freq='7D')[::-1]
+    week_labels = [f"{week.year}<br>{week.strftime('%m%d')}" if i == 0 else week.strftime('%m%d')
+                   for i, week in enumerate(weeks)]
+    header = ['排行', '', '圖', '代碼名稱', '收盤價', '漲跌'] + week_labels + ['週增減', '備註']
+
+    parts = [
+        '<html><head><meta charset="utf-8"><title>大戶持股</title></head><body>',
+        '<div id="menu"><table class="menu"><tr><td>選單</td></tr></table></div>',
+        '<table id="details" class="display dataTable no-footer"><thead><tr>',
+        ''.join(f'<th>{label}</th>' for label in header),
+        '</tr></thead><tbody>',
+    ]
+    ratios = rng.uniform(10, 95, size=(rows, len(weeks))).round(2)
+    for row in range(rows):
+        code = 1101 + row
+        cells = [
+            str(row + 1),
+            '<input type="checkbox">',
+            f'<a href="chart.aspx?id={code}"><img src="c.gif"></a>',
+            f'<a href="StockHolders.aspx?stock={code}">{code} 股票{row}</a>',
+            f'{rng.uniform(10, 1500):,.2f}',
+            f'{rng.uniform(-5, 5):.2f}',
+        ]
+        cells += ['-' if rng.random() < 0.01 else f'{value:.2f}' for value in ratios[row]]
+        cells += [f'{rng.uniform(-2, 2):.2f}', '']
+        parts.append('<tr>' + ''.join(f'<td>{cell}</td>' for cell in cells) + '</tr>')
+    parts.append('</tbody></table><div id="footer">資料來源</div></body></html>')
+    return ''.join(parts)
+
+
+def measure(parse, html_content: str, repeat: int) -> tuple:
+    """
+    :return: (解析結果, 最佳執行時間 (秒), 記憶體峰值 (bytes))
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = parse(html_content)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    parse(html_content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return df, best, peak
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='大戶股權表格解析效能比較')
+    parser.add_argument('--fixture', default=FIXTURE_PATH, help='HTML 測試資料路徑')
+    parser.add_argument('--record', action='store_true', help='從網站抓取並保存測試資料')
+    parser.add_argument('--rows', type=int, default=3000, help='測試資料不存在時產生的列數')
+    parser.add_argument('--repeat', type=int, default=5, help='計時重複次數 (取最佳值)')
+    args = parser.parse_args()
+
+    scraper = StockHoldersScraper()
+    if args.record:
+        html_content = scraper.fetch_data()
+        if not html_content:
+            print("從網站獲取資料失敗")
+            return 1
+        with open(args.fixture, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+        print(f"測試資料已保存為 '{args.fixture}'")
+
+    if os.path.exists(args.fixture):
+        with open(args.fixture, encoding='utf-8') as f:
+            html_content = f.read()
+        source = args.fixture
+    else:
+        html_content = build_fixture(args.rows)
+        source = f'產生的表格 ({args.rows} 列)'
+    print(f"測試資料: {source}，{len(html_content) / 1024:.0f} KB")
+
+    stream_df, stream_time, stream_peak = measure(scraper.parse_table_stream, html_content, args.repeat)
+    legacy_df, legacy_time, legacy_peak = measure(scraper.process_table_read_html, html_content, args.repeat)
+    if stream_df is None or legacy_df is None:
+        print("解析失敗")
+        return 1
+
+    # Code/Name 缺值時 read_html 為 NaN、iterparse 為 None，比較前統一
+    pd.testing.assert_frame_equal(stream_df.fillna(np.nan).infer_objects(), legacy_df.reset_index(drop=True),
+                                  check_dtype=False)
+    print(f"兩種解析結果相同: {len(stream_df)} 列 × {stream_df.shape[1]} 欄")
+
+    print(f"{'':<26}{'時間 (ms)':>12}{'記憶體峰值 (MB)':>18}")
+    print(f"{'BeautifulSoup + read_html':<26}{legacy_time * 1000:>12.1f}{legacy_peak / 2 ** 20:>18.1f}")
+    print(f"{'lxml iterparse':<26}{stream_time * 1000:>12.1f}{stream_peak / 2 ** 20:>18.1f}")
+    print(f"加速 {legacy_time / stream_time:.1f} 倍，記憶體峰值降低 {1 - stream_peak / legacy_peak:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
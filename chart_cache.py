@@ -0,0 +1,206 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import price_store
+import revenue_store
+
+# 圖表快取
+# 每張圖以 (股票代碼, 圖表類型, 資料版本, 繪圖參數) 的雜湊作為版本鍵；資料版本在此股票的新日K或新月營收
+# 寫入本地資料庫 (或大戶股權.csv 更新) 時改變，舊圖自然失效，因此重複瀏覽免費、圖表也不會過期。
+# 第一層是行程內有容量上限的 LRU (PNG bytes)，請求路徑上不需任何檔案 I/O；
+# 第二層是可選的磁碟快取 (static/charts)，讓重新啟動或多個行程可共用已繪製的圖，
+# 超過容量或檔案數上限時依最近使用時間淘汰最舊的圖檔。唯讀或暫時性的檔案系統可將其停用。
+
+CACHE_DIR = os.path.join('static', 'charts')
+
+# 行程內 LRU 的容量上限，可由環境變數 CHART_MEMORY_MAX_BYTES 調整
+CHART_MEMORY_MAX_BYTES = int(os.getenv('CHART_MEMORY_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# 是否同時寫入磁碟快取，可由環境變數 CHART_CACHE_WRITE_DISK 調整 (設為 0 表示停用)
+CHART_CACHE_WRITE_DISK = os.getenv('CHART_CACHE_WRITE_DISK', '1') != '0'
+
+# 磁碟快取容量上限，可由環境變數 CHART_CACHE_MAX_BYTES / CHART_CACHE_MAX_FILES 調整
+CHART_CACHE_MAX_BYTES = int(os.getenv('CHART_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+CHART_CACHE_MAX_FILES = int(os.getenv('CHART_CACHE_MAX_FILES', '2000'))
+
+SHAREHOLDERS_CSV = '大戶股權.csv'
+
+# 各類圖表的繪圖參數；變更繪圖方式時調高 version，舊圖會因雜湊改變而失效
+RENDER_PARAMS = {
+    'tech': {'days': 300, 'mode': os.getenv('CHART_RENDER_MODE', 'fast'), 'version': 2},
+    'revenue': {'years': 3, 'version': 1},
+    'shareholders': {'version': 1},
+}
+
+_memory = OrderedDict()  # 版本鍵 -> PNG bytes
+_memory_bytes = 0
+_memory_lock = threading.Lock()
+_render_locks = {}
+_render_locks_guard = threading.Lock()
+_evict_lock = threading.Lock()
+
+
+def data_version(kind: str, stock_code: str) -> str:
+    """
+    圖表所依據資料的版本
+    技術分析圖以此股票本地最後一筆日K為準，月營收圖以已保存的最新營收月份為準
+    (沒有新資料的假日或延遲發布時不會重新繪圖)；大戶股權以 CSV 的更新時間為準。
+    """
+    if kind == 'shareholders':
+        try:
+            return str(int(os.path.getmtime(SHAREHOLDERS_CSV)))
+        except OSError:
+            return 'missing'
+    if kind == 'revenue':
+        return revenue_store.data_version(str(stock_code))
+    return price_store.data_version(str(stock_code))
+
+
+def chart_key(kind: str, stock_code: str) -> str:
+    """
+    目前資料版本的圖表鍵 (同時作為磁碟檔名主幹與 HTTP ETag)
+    格式為 '<圖表類型>_<股票代碼>_<(股票代碼, 圖表類型, 資料版本, 繪圖參數) 的雜湊>'
+    """
+    payload = json.dumps({
+        'code': str(stock_code),
+        'kind': kind,
+        'data': data_version(kind, stock_code),
+        'params': RENDER_PARAMS[kind],
+    }, sort_keys=True)
+    return f"{kind}_{stock_code}_{hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]}"
+
+
+def _memory_get(key: str):
+    with _memory_lock:
+        png = _memory.get(key)
+        if png is not None:
+            _memory.move_to_end(key)
+        return png
+
+
+def _memory_put(key: str, png: bytes) -> None:
+    global _memory_bytes
+    with _memory_lock:
+        if key in _memory:
+            _memory_bytes -= len(_memory.pop(key))
+        _memory[key] = png
+        _memory_bytes += len(png)
+        while _memory_bytes > CHART_MEMORY_MAX_BYTES and len(_memory) > 1:
+            _, evicted = _memory.popitem(last=False)
+            _memory_bytes -= len(evicted)
+
+
+def _read_disk(key: str):
+    """讀取磁碟快取中的圖檔 (更新修改時間作為最近使用時間)，不存在時回傳 None"""
+    path = os.path.join(CACHE_DIR, f'{key}.png')
+    try:
+        with open(path, 'rb') as f:
+            png = f.read()
+        os.utime(path)
+    except OSError:
+        return None
+    return png
+
+
+def _write_disk(key: str, png: bytes) -> None:
+    """先寫入暫存檔再原子替換，刪除同一股票同類型的舊版本並執行容量淘汰"""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = os.path.join(CACHE_DIR, f'{key}.png')
+        tmp_path = f'{path[:-len(".png")]}.{os.getpid()}-{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(png)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"警告: 無法寫入圖表快取 ({key}): {e}")
+        return
+
+    prefix = key[:key.rindex('_') + 1]
+    for name in os.listdir(CACHE_DIR):
+        if name.startswith(prefix) and name != f'{key}.png' and name.endswith('.png'):
+            _remove(os.path.join(CACHE_DIR, name))
+    evict()
+
+
+def store(kind: str, stock_code: str, png: bytes) -> str:
+    """
+    將已繪製的圖存入快取 (行程內 LRU，並視設定寫入磁碟)
+    :return: 圖表鍵
+    """
+    key = chart_key(kind, stock_code)
+    _memory_put(key, png)
+    if CHART_CACHE_WRITE_DISK:
+        _write_disk(key, png)
+    return key
+
+
+def get_png(kind: str, stock_code: str, render) -> tuple:
+    """
+    取得目前資料版本的圖；快取未命中時呼叫 render 繪製
+    同一張圖同時只會繪製一次，其他請求等待並沿用結果。
+    :param render: render() -> (PNG bytes, 錯誤訊息)
+    :return: (PNG bytes, 圖表鍵, 錯誤訊息)；成功時錯誤訊息為 None
+    """
+    key = chart_key(kind, stock_code)
+    png = _memory_get(key)
+    if png is not None:
+        return png, key, None
+
+    with _render_locks_guard:
+        lock = _render_locks.setdefault(key, threading.Lock())
+    with lock:
+        try:
+            png = _memory_get(key)
+            if png is None and CHART_CACHE_WRITE_DISK:
+                png = _read_disk(key)
+                if png is not None:
+                    _memory_put(key, png)
+            if png is None:
+                png, error_msg = render()
+                if error_msg:
+                    return None, key, error_msg
+                store(kind, stock_code, png)
+        finally:
+            with _render_locks_guard:
+                _render_locks.pop(key, None)
+    return png, key, None
+
+
+def evict(max_bytes: int = None, max_files: int = None) -> int:
+    """
+    依最近使用時間淘汰磁碟快取中的圖檔，直到快取大小與檔案數都在上限內
+    :return: 刪除的檔案數
+    """
+    max_bytes = CHART_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    max_files = CHART_CACHE_MAX_FILES if max_files is None else max_files
+    with _evict_lock:
+        try:
+            entries = [
+                (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                for entry in os.scandir(CACHE_DIR)
+                if entry.is_file() and entry.name.endswith('.png')
+            ]
+        except OSError:
+            return 0
+
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        removed = 0
+        while entries and (total_bytes > max_bytes or len(entries) > max_files):
+            _, size, path = entries.pop(0)
+            _remove(path)
+            total_bytes -= size
+            removed += 1
+    if removed:
+        print(f"圖表快取超過上限，已淘汰 {removed} 張最久未使用的圖檔。")
+    return removed
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,36 @@
+from functools import lru_cache
+
+from matplotlib.font_manager import fontManager
+
+# 中文字型設定
+# 依序挑選系統上實際存在的中文字型 (Windows、macOS、Linux 常見字型)，每個行程只解析一次；
+# 避免指定不存在的字型，讓 matplotlib 每次繪圖都重新搜尋並輸出 findfont 警告。
+
+CJK_FONT_CANDIDATES = [
+    'Microsoft JhengHei',
+    'Heiti TC',
+    'PingFang TC',
+    'Noto Sans CJK TC',
+    'Noto Sans TC',
+    'Taipei Sans TC Beta',
+    'WenQuanYi Zen Hei',
+    'AR PL UMing TW',
+    'Arial Unicode MS',
+]
+
+
+@lru_cache(maxsize=None)
+def cjk_font_families() -> tuple:
+    """回傳系統上可用的中文字型 (依偏好排序)，最後附上 matplotlib 內建的 DejaVu Sans 作為備援"""
+    available = {font.name for font in fontManager.ttflist}
+    found = [name for name in CJK_FONT_CANDIDATES if name in available]
+    if not found:
+        print("警告: 系統上找不到中文字型，圖表中的中文可能無法正確顯示。")
+    return tuple(found) + ('DejaVu Sans',)
+
+
+def apply_cjk_fonts(rc) -> None:
+    """將可用的中文字型套用到 rcParams (或 mplfinance 樣式的 rc 字典)"""
+    rc['font.family'] = 'sans-serif'
+    rc['font.sans-serif'] = list(cjk_font_families())
+    rc['axes.unicode_minus'] = False  # 解決負號顯示問題
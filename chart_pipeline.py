@@ -0,0 +1,120 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from stock_analyzer import fetch_analyzer, compute_batch_indicators
+from stock_information_plot import fetch_revenue_data, load_major_shareholders_data
+from render_pool import submit_render
+import chart_cache
+
+# 批次圖表產生流程
+# 第一階段：以有上限的執行緒池並行抓取所有股票的日K、月營收與大戶股權資料 (I/O 密集)。
+# 第二階段：把「繪圖規格 + 資料」交給常駐的繪圖行程池 (CPU 密集，可用滿所有核心)；
+#           營收圖與大戶股權圖在資料到齊時立即送出，技術分析圖等日K全數到齊後一次計算指標再送出。
+# 繪圖行程直接回傳 PNG bytes，存入圖表快取 (chart_cache)，之後查詢同一檔股票時可直接沿用。
+
+# 同時進行的資料抓取數量上限，可由環境變數 FETCH_CONCURRENCY 調整
+FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', '8'))
+
+
+def _tech_spec(analyzer) -> dict:
+    return {
+        'price_data': analyzer.price_data,
+        'indicators': analyzer.indicators,
+        'title': f'{analyzer.stock_name} ({analyzer.stock_id})',
+    }
+
+
+def render_chart_png(kind: str, stock_code: str, days: int = 300) -> tuple:
+    """
+    抓取單一股票的資料並在繪圖行程中繪製成 PNG (不寫入檔案)
+    :param kind: 'tech'、'revenue' 或 'shareholders'
+    :return: (PNG bytes, 錯誤訊息)；成功時錯誤訊息為 None
+    """
+    if kind == 'tech':
+        try:
+            analyzer = fetch_analyzer(stock_code, days)
+            compute_batch_indicators([analyzer])
+        except Exception as e:
+            return None, f"分析過程發生錯誤 ({stock_code}): {str(e)}"
+        spec = _tech_spec(analyzer)
+    else:
+        loader = fetch_revenue_data if kind == 'revenue' else load_major_shareholders_data
+        data, error_msg = loader(stock_code)
+        if error_msg:
+            return None, error_msg
+        spec = {'stock_code': stock_code, 'data': data}
+    return submit_render(kind, spec, in_memory=True).result()
+
+
+def run_chart_pipeline(stock_codes: list, max_workers: int = FETCH_CONCURRENCY, days: int = 300,
+                       progress=None) -> dict:
+    """
+    為多檔股票產生技術分析圖、月營收趨勢圖與大戶股權變化圖。
+    :param stock_codes: 股票代碼列表
+    :param max_workers: 同時進行的資料抓取數量上限
+    :param days: 技術分析圖的資料天數
+    :param progress: 每完成一張圖時呼叫的函式 progress(stock_code, kind, error_message)
+    :return: {股票代碼: {'tech': 錯誤訊息或 None, 'revenue': ..., 'shareholders': ...}}
+    """
+    results = {code: {} for code in stock_codes}
+
+    def record(stock_code, kind, error_msg):
+        results[stock_code][kind] = error_msg
+        if error_msg:
+            print(f"     [失敗] {stock_code} {kind} 圖表生成失敗: {error_msg}")
+        else:
+            print(f"     [成功] {stock_code} {kind} 圖表已存入圖表快取")
+        if progress:
+            progress(stock_code, kind, error_msg)
+
+    analyzers = []
+    render_futures = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for code in stock_codes:
+            futures[executor.submit(fetch_analyzer, code, days)] = (code, 'tech')
+            futures[executor.submit(fetch_revenue_data, code)] = (code, 'revenue')
+            futures[executor.submit(load_major_shareholders_data, code)] = (code, 'shareholders')
+
+        for future in as_completed(futures):
+            code, kind = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                if kind == 'tech':
+                    record(code, kind, f"分析過程發生錯誤 ({code}): {str(e)}")
+                else:
+                    record(code, kind, f"錯誤: 抓取資料時發生未預期錯誤: {e}")
+                continue
+
+            if kind == 'tech':
+                analyzers.append(result)
+                continue
+            data, error_msg = result
+            if error_msg:
+                record(code, kind, error_msg)
+                continue
+            spec = {'stock_code': code, 'data': data}
+            render_futures[submit_render(kind, spec, in_memory=True)] = (code, kind)
+
+    # 依輸入順序排列，讓向量化計算的結果穩定
+    analyzers.sort(key=lambda analyzer: stock_codes.index(analyzer.stock_id))
+    compute_batch_indicators(analyzers)
+    for analyzer in analyzers:
+        render_futures[submit_render('tech', _tech_spec(analyzer), in_memory=True)] = (analyzer.stock_id, 'tech')
+
+    for future in as_completed(render_futures):
+        code, kind = render_futures[future]
+        try:
+            png, error_msg = future.result()
+        except Exception as e:
+            if kind == 'tech':
+                record(code, kind, f"分析過程發生錯誤 ({code}): {str(e)}")
+            else:
+                record(code, kind, f"錯誤: 繪圖時發生未預期錯誤: {e}")
+            continue
+        if not error_msg:
+            chart_cache.store(kind, code, png)
+        record(code, kind, error_msg)
+
+    return results
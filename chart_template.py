@@ -0,0 +1,192 @@
+import threading
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection, PolyCollection
+
+from chart_fonts import apply_cjk_fonts
+
+# 技術分析圖的快速繪圖模式
+# mplfinance 每次繪圖都會重建樣式、18 個 addplot 與 7 個面板的整張圖。
+# 此模組在每個行程中只建立一次圖表範本 (字型、面板配置、線條與集合物件)，
+# 之後每檔股票只更新線條與集合的資料、重設座標範圍後輸出 PNG，
+# 批次繪圖時每張圖的成本只剩資料更新與點陣化。
+
+# 面板比例與 plot_analysis_chart 的 panel_ratios 相同：股價、成交量、KD、乖離率、信號、MACD、WMA
+PANEL_RATIOS = (40, 15, 15, 15, 15, 15, 15)
+
+# 與 mplfinance 輸出相同的尺寸 (figscale=2.0)
+FIGURE_SIZE = (16, 11.5)
+
+# (面板, 指標, 顏色, 線寬, 圖例)
+LINES = [
+    (0, 'sma5', 'blue', 1, '週線'),
+    (0, 'sma20', 'orange', 1, '月線'),
+    (0, 'sma60', 'red', 1, '季線'),
+    (2, 'k', 'red', 1, 'K值'),
+    (2, 'd', 'green', 1, 'D值'),
+    (3, 'dev_5_20', 'red', 1, '週-月'),
+    (3, 'dev_20_60', 'green', 1, '月-季'),
+    (3, 'dev_5_60', 'orange', 1, '週-季'),
+    (4, 'K_value', 'orange', 2, '多空信號'),
+    (5, 'macd', 'blue', 1, 'MACD'),
+    (5, 'macd_signal', 'red', 1, 'Signal'),
+    (6, 'wma5', 'red', 1.5, '5WMA'),
+    (6, 'wma10', 'green', 1.5, '10WMA'),
+]
+
+# (面板, 指標, 顏色, 圖例)
+SCATTERS = [
+    (2, 'L_value', 'blue', 'KD信號'),
+    (4, 'J_value', 'blue', '乖離信號'),
+]
+
+# (面板, 指標, 顏色, 寬度, 圖例)；macd_hist 依正負拆成紅綠兩組
+BARS = [
+    (4, 'I_value', 'red', 1.0, '階梯信號'),
+    (5, 'macd_hist_pos', 'red', 0.7, 'Histogram (+)'),
+    (5, 'macd_hist_neg', 'green', 0.7, 'Histogram (-)'),
+]
+
+UP_COLOR = 'red'
+DOWN_COLOR = 'green'
+
+
+def _bar_verts(x: np.ndarray, bottom: np.ndarray, top: np.ndarray, width: float) -> np.ndarray:
+    """以 (n, 4, 2) 的頂點陣列表示 n 根長條，NaN 的長條高度為 0"""
+    bottom = np.nan_to_num(np.broadcast_to(bottom, x.shape).astype(float))
+    top = np.nan_to_num(np.asarray(top, dtype=float))
+    left, right = x - width / 2, x + width / 2
+    return np.stack([
+        np.column_stack([left, bottom]),
+        np.column_stack([left, top]),
+        np.column_stack([right, top]),
+        np.column_stack([right, bottom]),
+    ], axis=1)
+
+
+class TechChartTemplate:
+    """可重複使用的技術分析圖：建立一次，每檔股票只更新資料"""
+
+    def __init__(self) -> None:
+        rc = {
+            'axes.facecolor': '#fafafa',
+            'axes.edgecolor': '#d0d0d0',
+            'axes.grid': True,
+            'grid.color': '#e0e0e0',
+            'axes.labelsize': 12,
+            'xtick.labelsize': 10,
+            'ytick.labelsize': 10,
+        }
+        apply_cjk_fonts(rc)
+        with plt.rc_context(rc):
+            self.fig = plt.figure(figsize=FIGURE_SIZE)
+            grid = self.fig.add_gridspec(len(PANEL_RATIOS), 1, height_ratios=PANEL_RATIOS, hspace=0.05,
+                                         left=0.06, right=0.94, top=0.95, bottom=0.1)
+            self.axes = [self.fig.add_subplot(grid[0])]
+            self.axes += [self.fig.add_subplot(grid[i], sharex=self.axes[0]) for i in range(1, len(PANEL_RATIOS))]
+            for ax in self.axes:
+                ax.yaxis.tick_right()
+                ax.tick_params(axis='x', labelbottom=False)
+            self.axes[-1].tick_params(axis='x', labelbottom=True, rotation=90)
+            self.axes[0].set_ylabel('Price')
+            self.axes[1].set_ylabel('Volume')
+            self.title = self.fig.suptitle('', fontsize=14, fontweight='bold')
+
+            self.wicks = LineCollection([], linewidths=1)
+            self.bodies = PolyCollection([], linewidths=0)
+            self.volume = PolyCollection([], linewidths=0)
+            self.axes[0].add_collection(self.wicks)
+            self.axes[0].add_collection(self.bodies)
+            self.axes[1].add_collection(self.volume)
+
+            self.lines = {}
+            for panel, key, color, width, label in LINES:
+                self.lines[key], = self.axes[panel].plot([], [], color=color, linewidth=width, label=label)
+            self.scatters = {}
+            for panel, key, color, label in SCATTERS:
+                self.scatters[key] = self.axes[panel].scatter([], [], color=color, s=20, label=label, zorder=3)
+            self.bars = {}
+            for panel, key, color, width, label in BARS:
+                self.bars[key] = PolyCollection([], facecolors=color, linewidths=0, label=label)
+                self.axes[panel].add_collection(self.bars[key])
+
+            for panel in sorted({item[0] for item in LINES + SCATTERS + BARS}):
+                self.axes[panel].legend(loc='upper left', fontsize=9)
+        self._lock = threading.Lock()
+
+    def render(self, price_data, indicators: dict, title: str, save_path) -> None:
+        """
+        以新資料更新範本並輸出 PNG
+        :param price_data: 已剔除指標暖身期的 OHLCV DataFrame
+        :param indicators: 與 price_data 對齊的指標與訊號 (numpy 陣列)
+        :param save_path: 圖片儲存路徑或可寫入的檔案物件
+        """
+        with self._lock:
+            self._update(price_data, indicators, title)
+            self.fig.savefig(save_path)
+
+    def _update(self, price_data, indicators: dict, title: str) -> None:
+        n = len(price_data)
+        x = np.arange(n, dtype=float)
+        open_, high, low, close, volume = (price_data[name].values.astype(float)
+                                           for name in ['Open', 'High', 'Low', 'Close', 'Volume'])
+        colors = np.where(close >= open_, UP_COLOR, DOWN_COLOR)
+
+        self.title.set_text(title)
+        self.wicks.set_segments(np.stack([np.column_stack([x, low]), np.column_stack([x, high])], axis=1))
+        self.wicks.set_color(colors)
+        self.bodies.set_verts(_bar_verts(x, open_, close, 0.6))
+        self.bodies.set_facecolor(colors)
+        self.volume.set_verts(_bar_verts(x, 0, volume, 0.6))
+        self.volume.set_facecolor(colors)
+
+        series = dict(indicators)
+        hist = np.asarray(series['macd_hist'], dtype=float)
+        series['macd_hist_pos'] = np.where(hist > 0, hist, np.nan)
+        series['macd_hist_neg'] = np.where(hist <= 0, hist, np.nan)
+
+        panel_values = {0: [high, low], 1: [volume, np.zeros(1)]}
+        for panel, key, *_ in LINES:
+            values = np.asarray(series[key], dtype=float)
+            self.lines[key].set_data(x, values)
+            panel_values.setdefault(panel, []).append(values)
+        for panel, key, *_ in SCATTERS:
+            values = np.asarray(series[key], dtype=float)
+            valid = ~np.isnan(values)
+            self.scatters[key].set_offsets(np.column_stack([x[valid], values[valid]]))
+            panel_values.setdefault(panel, []).append(values)
+        for panel, key, _, width, _ in BARS:
+            values = np.asarray(series[key], dtype=float)
+            self.bars[key].set_verts(_bar_verts(x, 0, values, width))
+            panel_values.setdefault(panel, []).extend([values, np.zeros(1)])
+
+        # 集合物件不參與 autoscale，依各面板資料自行設定 Y 軸範圍
+        for panel, values in panel_values.items():
+            values = np.concatenate(values)
+            values = values[np.isfinite(values)]
+            low_y, high_y = (values.min(), values.max()) if values.size else (0.0, 1.0)
+            pad = (high_y - low_y) * 0.05 or 1.0
+            self.axes[panel].set_ylim(low_y - pad, high_y + pad)
+        self.axes[0].set_xlim(-1, n)
+
+        dates = price_data.index
+        ticks = np.arange(0, n, max(1, n // 6))
+        self.axes[-1].set_xticks(ticks)
+        self.axes[-1].set_xticklabels([dates[i].strftime('%b %d') for i in ticks])
+
+
+_template = None
+_template_lock = threading.Lock()
+
+
+def get_template() -> TechChartTemplate:
+    """取得目前行程共用的技術分析圖範本 (第一次呼叫時建立)"""
+    global _template
+    if _template is None:
+        with _template_lock:
+            if _template is None:
+                _template = TechChartTemplate()
+    return _template
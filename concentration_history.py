@@ -0,0 +1,223 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import concentration_screens
+import price_store
+
+# 籌碼集中度歷史快照 (SQLite)
+# 來源網頁只提供當日排行，每次取得新的快照後以 (日期, 代碼) 為主鍵保存，同一日重複寫入以最新為準。
+# 除了選股時取得的快照，每日收盤後的全市場日K匯入也會排入保存工作 (background_jobs.CONCENTRATION_CAPTURE)，
+# 沒有人選股的交易日也有快照。
+# 篩選時一次讀出日期區間內的所有快照，轉為各欄位的 (交易日 × 股票) 矩陣後以向量化運算判斷
+# 連續多日的條件；沒有快照的交易日整列為 NaN (視為不符合)，連續天數因此以交易日計算。
+# 矩陣在資料未變更前保留在記憶體中，重複篩選只需矩陣運算。
+
+DB_PATH = 'concentration.db'
+
+# 資料表欄位 -> 來源 DataFrame 的欄位
+METRIC_COLUMNS = {
+    'c1': '1日集中度',
+    'c5': '5日集中度',
+    'c10': '10日集中度',
+    'c20': '20日集中度',
+    'c60': '60日集中度',
+    'c120': '120日集中度',
+    'volume10': '10日均量',
+}
+METRICS = list(METRIC_COLUMNS.values())
+
+_panel = None  # (資料版本, 起始日期, ConcentrationPanel)
+_panel_lock = threading.Lock()
+
+
+@contextmanager
+def _connect(db_path: str = DB_PATH):
+    """建立資料庫連線並確保資料表存在，離開時提交並關閉連線"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS snapshots (
+            date TEXT NOT NULL,
+            code TEXT NOT NULL,
+            name TEXT,
+            rank INTEGER,
+            {', '.join(f'{column} REAL' for column in METRIC_COLUMNS)},
+            PRIMARY KEY (date, code)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS snapshot_days (
+            date TEXT PRIMARY KEY,
+            row_count INTEGER NOT NULL,
+            saved_at TEXT NOT NULL
+        )
+    ''')
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def save_snapshot(day, df: pd.DataFrame, db_path: str = DB_PATH) -> int:
+    """
+    保存一個交易日的籌碼集中度排行 (同一日重複保存時整批取代)
+    :param day: 資料日期 (date 或 'YYYY-MM-DD')
+    :param df: fetch_stock_concentration_data 的結果
+    :return: 寫入的筆數
+    """
+    day = str(day)
+    ranks = pd.to_numeric(df['編號'], errors='coerce') if '編號' in df.columns else pd.Series(np.nan, index=df.index)
+    names = df['股票名稱'] if '股票名稱' in df.columns else pd.Series('', index=df.index)
+    metrics = [pd.to_numeric(df[column], errors='coerce') if column in df.columns else pd.Series(np.nan, index=df.index)
+               for column in METRICS]
+    rows = [
+        (day, str(code), str(name), None if np.isnan(rank) else int(rank),
+         *(None if np.isnan(value) else float(value) for value in values))
+        for code, name, rank, *values in zip(df['代碼'], names, ranks, *metrics)
+    ]
+    with _connect(db_path) as conn:
+        conn.execute('DELETE FROM snapshots WHERE date = ?', (day,))
+        conn.executemany(f'''
+            INSERT OR REPLACE INTO snapshots (date, code, name, rank, {', '.join(METRIC_COLUMNS)})
+            VALUES ({', '.join('?' * (4 + len(METRIC_COLUMNS)))})
+        ''', rows)
+        conn.execute('INSERT OR REPLACE INTO snapshot_days VALUES (?, ?, ?)',
+                     (day, len(rows), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    return len(rows)
+
+
+def snapshot_days(db_path: str = DB_PATH) -> list:
+    """已保存快照的日期 (由舊到新)"""
+    with _connect(db_path) as conn:
+        return [row[0] for row in conn.execute('SELECT date FROM snapshot_days ORDER BY date')]
+
+
+def _data_version(conn) -> tuple:
+    return conn.execute('SELECT COUNT(*), MAX(saved_at) FROM snapshot_days').fetchone()
+
+
+def trading_days(first_day, last_day, db_path: str = price_store.DB_PATH) -> pd.DatetimeIndex:
+    """first_day ~ last_day 之間的交易日 (平日，扣除全市場日K匯入確認沒有交易的日期)"""
+    days = pd.bdate_range(first_day, last_day)
+    if len(days) == 0:
+        return days
+    holidays = price_store.market_holidays(days[0].date(), days[-1].date(), db_path)
+    return days[~days.isin(pd.DatetimeIndex(sorted(holidays)))] if holidays else days
+
+
+class ConcentrationPanel:
+    """日期區間內的快照，每個欄位為 (交易日 × 股票) 的矩陣；某日沒有快照或沒有該股票時為 NaN"""
+
+    def __init__(self, data: pd.DataFrame, dates=None) -> None:
+        """
+        :param data: snapshots 資料表的列 (date, code, name, 各欄位)
+        :param dates: 矩陣的列 (交易日)；會再加入有快照的日期。None 時只使用有快照的日期
+        """
+        snapshot_dates = pd.DatetimeIndex(pd.to_datetime(data['date'].unique()))
+        self.dates = snapshot_dates.union(pd.DatetimeIndex([] if dates is None else dates)).sort_values()
+        self.codes = sorted(data['code'].unique())
+        self.names = data.drop_duplicates('code', keep='last').set_index('code')['name'].to_dict()
+        dates = pd.to_datetime(data['date'])
+        day_index = self.dates.get_indexer(dates)
+        code_index = pd.Index(self.codes).get_indexer(data['code'])
+        self.matrices = {}
+        for column, metric in METRIC_COLUMNS.items():
+            matrix = np.full((len(self.dates), len(self.codes)), np.nan)
+            matrix[day_index, code_index] = data[column].to_numpy(dtype=float)
+            self.matrices[metric] = matrix
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def frame(self, metric: str) -> pd.DataFrame:
+        """單一欄位的 (日期 × 股票) DataFrame"""
+        return pd.DataFrame(self.matrices[metric], index=self.dates, columns=self.codes)
+
+    def daily_filter(self, min_volume: float = 2000, screen: str = None, params: dict = None) -> np.ndarray:
+        """
+        每日是否符合篩選條件 (concentration_screens)；預設條件與 filter_stock_data 相同
+        :return: (日期 × 股票) 布林矩陣
+        """
+        return concentration_screens.get_screen(screen).evaluate(
+            self.matrices, dict({'min_volume': min_volume}, **(params or {})))
+
+    def rising(self, metric: str = '1日集中度') -> np.ndarray:
+        """每日的欄位值是否高於前一交易日 (第一日與前一交易日沒有快照時為 False)"""
+        values = self.matrices[metric]
+        rising = np.zeros(values.shape, dtype=bool)
+        with np.errstate(invalid='ignore'):
+            rising[1:] = values[1:] > values[:-1]
+        return rising
+
+    @staticmethod
+    def streak(mask: np.ndarray) -> np.ndarray:
+        """
+        每檔股票到最新一列為止連續符合條件的天數 (列為交易日，沒有快照的交易日為 False)
+        以最後一次不符合的位置計算，不需逐日迴圈。
+        """
+        days = mask.shape[0]
+        positions = np.arange(1, days + 1)[:, None]
+        last_false = np.max(np.where(mask, 0, positions), axis=0, initial=0)
+        return days - last_false
+
+    def screen(self, mask: np.ndarray, min_days: int) -> pd.DataFrame:
+        """
+        依連續天數篩選股票
+        :return: 連續天數 >= min_days 的股票 (依連續天數與最新 1日集中度 排序)；沒有快照時為空表格
+        """
+        if len(self.dates) == 0:
+            return pd.DataFrame(columns=['代碼', '股票名稱', '連續天數', *METRICS])
+        streak = self.streak(mask)
+        selected = np.flatnonzero(streak >= min_days)
+        latest = {metric: matrix[-1, selected] for metric, matrix in self.matrices.items()}
+        result = pd.DataFrame({
+            '代碼': [self.codes[i] for i in selected],
+            '股票名稱': [self.names.get(self.codes[i], '') for i in selected],
+            '連續天數': streak[selected],
+            **latest,
+        })
+        return result.sort_values(['連續天數', '1日集中度'], ascending=False, ignore_index=True)
+
+
+def load_panel(start_date: str = None, end_date: str = None, db_path: str = DB_PATH) -> ConcentrationPanel:
+    """
+    讀取日期區間內的快照矩陣 (列為第一個到最後一個快照日之間的所有交易日)；
+    未指定結束日期時重複使用記憶體中的矩陣，直到有新的快照寫入
+    :param start_date: 起始日期 ('YYYY-MM-DD')，None 表示不限
+    :param end_date: 結束日期 ('YYYY-MM-DD')，None 表示不限
+    """
+    global _panel
+    with _connect(db_path) as conn:
+        version = (db_path, _data_version(conn))
+        cached = _panel
+        if end_date is None and cached is not None and cached[:2] == (version, start_date):
+            return cached[2]
+        data = pd.read_sql_query(
+            f"SELECT date, code, name, {', '.join(METRIC_COLUMNS)} FROM snapshots WHERE date >= ? AND date <= ?",
+            conn, params=(start_date or '0000-00-00', end_date or '9999-99-99'))
+    dates = pd.to_datetime(data['date'])
+    panel = ConcentrationPanel(data, trading_days(dates.min(), dates.max()) if len(data) else None)
+    if end_date is None:
+        with _panel_lock:
+            _panel = (version, start_date, panel)
+    return panel
+
+
+def filter_streak(days: int = 3, min_volume: float = 2000, start_date: str = None, screen: str = None,
+                  db_path: str = DB_PATH) -> pd.DataFrame:
+    """連續 days 個交易日都符合篩選條件 (預設為 filter_stock_data 的條件) 的股票"""
+    panel = load_panel(start_date, db_path=db_path)
+    return panel.screen(panel.daily_filter(min_volume, screen), days)
+
+
+def rising_streak(days: int = 3, metric: str = '1日集中度', start_date: str = None,
+                  db_path: str = DB_PATH) -> pd.DataFrame:
+    """metric 連續 days 個交易日上升的股票 (與前一交易日相比)"""
+    panel = load_panel(start_date, db_path=db_path)
+    return panel.screen(panel.rising(metric), days)
@@ -0,0 +1,305 @@
+import os
+import ast
+import json
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+# 籌碼集中度的具名篩選條件
+# 每個條件是一段以欄位名稱組成的運算式 (欄位名稱以反引號包住，例如 `5日集中度` > `10日集中度`)，
+# 可附帶參數預設值 (例如 min_volume)。運算式先以 ast 檢查只使用允許的欄位、參數與運算子，
+# 再編譯成一次性的程式碼物件；執行時各欄位只轉成一次 numpy 陣列，所有條件共用同一份陣列，
+# 10 個條件的成本與單次走訪資料相近。
+# 內建條件定義於 DEFAULT_SCREENS；使用者自訂的條件保存在 SCREENS_PATH (JSON)，同名時覆寫內建條件。
+
+SCREENS_PATH = 'screens.json'
+
+# 可在運算式中使用的欄位 (與 fetch_stock_concentration_data 的數值欄位相同)
+SCHEMA = ['1日集中度', '5日集中度', '10日集中度', '20日集中度', '60日集中度', '120日集中度', '10日均量']
+
+DEFAULT_SCREEN = '集中度多頭排列'
+DEFAULT_SCREENS = {
+    '集中度多頭排列': {
+        'description': '5日 > 10日 > 20日集中度，5日與10日集中度為正，且 10日均量 > min_volume',
+        'expression': '`5日集中度` > `10日集中度` > `20日集中度` and `5日集中度` > 0 and `10日集中度` > 0 '
+                      'and `10日均量` > min_volume',
+        'params': {'min_volume': 2000},
+    },
+    '短線籌碼湧入': {
+        'description': '1日集中度 > threshold 且 5日集中度為正，10日均量 > min_volume',
+        'expression': '`1日集中度` > threshold and `5日集中度` > 0 and `10日均量` > min_volume',
+        'params': {'threshold': 10, 'min_volume': 2000},
+    },
+    '長期籌碼集中': {
+        'description': '20日、60日、120日集中度皆為正，且 10日均量 > min_volume',
+        'expression': '`20日集中度` > 0 and `60日集中度` > 0 and `120日集中度` > 0 and `10日均量` > min_volume',
+        'params': {'min_volume': 2000},
+    },
+}
+
+ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Compare, ast.Gt, ast.GtE, ast.Lt, ast.LtE,
+    ast.Eq, ast.NotEq, ast.Name, ast.Load, ast.Constant, ast.Call,
+)
+ALLOWED_FUNCTIONS = {'abs': np.abs}
+COLUMN_PATTERN = re.compile(r'`([^`]+)`')
+PARAM_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class ScreenError(ValueError):
+    """篩選條件不合法 (未知欄位、參數或不允許的運算)"""
+
+
+def _result_type(node, columns: list) -> str:
+    """
+    檢查運算式的型別並回傳 'bool' 或 'number'
+    and / or / not 的運算元必須是比較或其他布林子運算式，比較與四則運算的運算元必須是數值，
+    避免 `1日集中度` and `5日集中度` > 0 這類在逐元素改寫後語意不同的運算式。
+    :param columns: 欄位佔位名稱 _c<i> 對應的欄位 (錯誤訊息中還原為原本的寫法)
+    :raises ScreenError: 型別不符
+    """
+    def source(part):
+        return re.sub(r'\b_c(\d+)\b', lambda m: f'`{columns[int(m.group(1))]}`', ast.unparse(part))
+
+    if isinstance(node, ast.Expression):
+        return _result_type(node.body, columns)
+    if isinstance(node, ast.BoolOp):
+        for value in node.values:
+            if _result_type(value, columns) != 'bool':
+                raise ScreenError(f"and / or 的運算元必須是比較條件: {source(value)}")
+        return 'bool'
+    if isinstance(node, ast.UnaryOp):
+        expected = 'bool' if isinstance(node.op, ast.Not) else 'number'
+        if _result_type(node.operand, columns) != expected:
+            raise ScreenError(f"{'not 的運算元必須是比較條件' if expected == 'bool' else '正負號只能用於數值'}: "
+                              f"{source(node.operand)}")
+        return expected
+    if isinstance(node, ast.Compare):
+        operands = [node.left, *node.comparators]
+    elif isinstance(node, ast.BinOp):
+        operands = [node.left, node.right]
+    elif isinstance(node, ast.Call):
+        operands = node.args
+    else:
+        return 'number'  # 欄位、參數與數字常數
+    for operand in operands:
+        if _result_type(operand, columns) != 'number':
+            raise ScreenError(f"比較與四則運算的運算元必須是數值: {source(operand)}")
+    return 'bool' if isinstance(node, ast.Compare) else 'number'
+
+
+class _Vectorize(ast.NodeTransformer):
+    """把 and / or / not 與連續比較改寫成逐元素的 & / | / ~ 運算"""
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        result = node.values[0]
+        for value in node.values[1:]:
+            result = ast.BinOp(left=result, op=op, right=value)
+        return result
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return ast.UnaryOp(op=ast.Invert(), operand=node.operand)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        operands = [node.left] + node.comparators
+        pairs = [ast.Compare(left=operands[i], ops=[op], comparators=[operands[i + 1]])
+                 for i, op in enumerate(node.ops)]
+        return self.visit_BoolOp(ast.BoolOp(op=ast.And(), values=pairs))
+
+
+class Screen:
+    """已驗證並編譯的篩選條件"""
+
+    def __init__(self, name: str, expression: str, params: dict = None, description: str = '') -> None:
+        """
+        :param name: 條件名稱
+        :param expression: 運算式；欄位以反引號包住，可使用 and / or / not、比較、四則運算與 abs()
+        :param params: 參數預設值 {名稱: 數值}
+        :raises ScreenError: 運算式不合法
+        """
+        self.name = name
+        self.expression = expression
+        self.params = dict(params or {})
+        self.description = description
+        self.columns = []
+        self._code = self._compile()
+
+    def _compile(self):
+        for key, value in self.params.items():
+            if not PARAM_PATTERN.match(key) or key.startswith('_'):
+                raise ScreenError(f"參數名稱 '{key}' 不合法")
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ScreenError(f"參數 '{key}' 必須是數字")
+
+        def placeholder(match):
+            column = match.group(1)
+            if column not in SCHEMA:
+                raise ScreenError(f"未知的欄位 '{column}'，可用欄位: {', '.join(SCHEMA)}")
+            if column not in self.columns:
+                self.columns.append(column)
+            return f'_c{self.columns.index(column)}'
+
+        source = COLUMN_PATTERN.sub(placeholder, self.expression)
+        try:
+            tree = ast.parse(source.strip(), mode='eval')
+        except SyntaxError as e:
+            raise ScreenError(f"運算式語法錯誤: {e.msg}") from None
+
+        for node in ast.walk(tree):
+            if not isinstance(node, ALLOWED_NODES):
+                raise ScreenError(f"運算式不允許使用 {type(node).__name__}")
+            if isinstance(node, ast.Constant) and (isinstance(node.value, bool)
+                                                   or not isinstance(node.value, (int, float))):
+                raise ScreenError(f"運算式只能使用數字常數: {node.value!r}")
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in ALLOWED_FUNCTIONS \
+                        or node.keywords or len(node.args) != 1:
+                    raise ScreenError("運算式只能呼叫 abs(x)")
+            if isinstance(node, ast.Name) and not (
+                    re.fullmatch(r'_c\d+', node.id) or node.id in self.params or node.id in ALLOWED_FUNCTIONS):
+                raise ScreenError(f"未知的名稱 '{node.id}' (欄位需以反引號包住，參數需提供預設值)")
+        if not self.columns:
+            raise ScreenError("運算式至少需使用一個欄位")
+        if _result_type(tree, self.columns) != 'bool':
+            raise ScreenError("運算式的結果必須是條件 (比較或以 and / or / not 組合的比較)")
+
+        tree = ast.fix_missing_locations(_Vectorize().visit(tree))
+        return compile(tree, f'<screen {self.name}>', 'eval')
+
+    def evaluate(self, arrays: dict, params: dict = None) -> np.ndarray:
+        """
+        :param arrays: {欄位: numpy 陣列} (由 column_arrays 建立，可供多個條件共用；也可為 (日期 × 股票) 矩陣)
+        :param params: 覆寫參數預設值
+        :return: 布林陣列；缺值的比較結果為 False
+        :raises ScreenError: 缺少欄位或執行時發生錯誤 (例如參數不是數字、陣列形狀不一致)
+        """
+        namespace = dict(ALLOWED_FUNCTIONS)
+        namespace.update(self.params)
+        namespace.update({key: value for key, value in (params or {}).items() if key in self.params})
+        missing = [column for column in self.columns if column not in arrays]
+        if missing:
+            raise ScreenError(f"資料缺少欄位: {', '.join(missing)}")
+        namespace.update({f'_c{i}': arrays[column] for i, column in enumerate(self.columns)})
+        try:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mask = eval(self._code, {'__builtins__': {}}, namespace)
+            return np.broadcast_to(np.asarray(mask, dtype=bool), arrays[self.columns[0]].shape)
+        except Exception as e:
+            raise ScreenError(f"執行篩選條件 '{self.name}' 時發生錯誤: {type(e).__name__} - {e}") from e
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'description': self.description,
+                'expression': self.expression, 'params': self.params}
+
+
+def column_arrays(df: pd.DataFrame) -> dict:
+    """把資料表中的篩選欄位各轉成一次 float 陣列"""
+    return {column: pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+            for column in SCHEMA if column in df.columns}
+
+
+_screens = None  # (SCREENS_PATH 的修改時間, {名稱: Screen})
+_screens_lock = threading.Lock()
+
+
+def _load(path: str) -> dict:
+    screens = {name: Screen(name, **definition) for name, definition in DEFAULT_SCREENS.items()}
+    try:
+        with open(path, encoding='utf-8') as f:
+            user_screens = json.load(f)
+    except FileNotFoundError:
+        return screens
+    except (OSError, ValueError) as e:
+        print(f"讀取 '{path}' 時發生錯誤: {e}")
+        return screens
+    for name, definition in user_screens.items():
+        try:
+            screens[name] = Screen(name, definition['expression'], definition.get('params'),
+                                   definition.get('description', ''))
+        except (KeyError, TypeError, ScreenError) as e:
+            print(f"警告: 略過不合法的篩選條件 '{name}': {e}")
+    return screens
+
+
+def _mtime(path: str):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def get_screens(path: str = SCREENS_PATH) -> dict:
+    """
+    取得所有已編譯的篩選條件 {名稱: Screen}
+    第一次呼叫或 SCREENS_PATH 被其他行程更新後重新載入並編譯。
+    """
+    global _screens
+    mtime = _mtime(path)
+    cached = _screens
+    if cached is None or cached[0] != mtime:
+        with _screens_lock:
+            cached = (mtime, _load(path))
+            _screens = cached
+    return cached[1]
+
+
+def get_screen(name: str = None) -> Screen:
+    """
+    :param name: 條件名稱，None 表示預設條件
+    :raises ScreenError: 找不到條件
+    """
+    screen = get_screens().get(name or DEFAULT_SCREEN)
+    if screen is None:
+        raise ScreenError(f"找不到篩選條件 '{name}'")
+    return screen
+
+
+def save_screen(name: str, expression: str, params: dict = None, description: str = '',
+                path: str = SCREENS_PATH) -> Screen:
+    """
+    驗證並保存使用者自訂的篩選條件 (同名時覆寫)
+    :raises ScreenError: 名稱或運算式不合法
+    """
+    global _screens
+    name = str(name).strip()
+    if not name:
+        raise ScreenError("請輸入篩選條件名稱")
+    screen = Screen(name, expression, params, description)
+    with _screens_lock:
+        try:
+            with open(path, encoding='utf-8') as f:
+                user_screens = json.load(f)
+        except FileNotFoundError:
+            user_screens = {}
+        definition = screen.to_dict()
+        definition.pop('name')
+        user_screens[name] = definition
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(user_screens, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        _screens = (_mtime(path), _load(path))
+    return screen
+
+
+def run_screens(df: pd.DataFrame, names: list = None, params: dict = None) -> dict:
+    """
+    在同一份資料上執行多個篩選條件 (欄位陣列只建立一次)
+    :param names: 條件名稱，None 表示全部
+    :param params: 覆寫參數 (只套用到有該參數的條件)
+    :return: {條件名稱: 布林陣列}
+    """
+    arrays = column_arrays(df)
+    screens = get_screens() if names is None else {name: get_screen(name) for name in names}
+    return {name: screen.evaluate(arrays, params) for name, screen in screens.items()}
@@ -0,0 +1,118 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from finmind_scheduler import get_scheduler, current_priority, INTERACTIVE, BATCH
+
+# 共用的 FinMind API 用戶端
+# 以單一 keep-alive Session 重複使用連線 (省去每次請求的 TCP+TLS 握手)，
+# 並在 429/5xx 時以指數退避自動重試。
+
+FINMIND_URL = "https://api.finmindtrade.com/api/v4/data"
+
+# 連線池大小，可由環境變數 FINMIND_POOL_SIZE 調整
+DEFAULT_POOL_SIZE = int(os.getenv('FINMIND_POOL_SIZE', '10'))
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# 等待請求額度的最長秒數：互動查詢應盡快回報，批次作業可以等待額度回補
+QUOTA_WAIT_SECONDS = {INTERACTIVE: 30, BATCH: 600}
+
+
+class FinMindClient:
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, max_retries: int = 3,
+                 backoff_factor: float = 1.0, timeout: int = 20, base_url: str = FINMIND_URL,
+                 scheduler=None) -> None:
+        """
+        初始化 FinMind 用戶端
+        :param pool_size: 連線池大小 (同時保持的 keep-alive 連線數)
+        :param max_retries: 遇到 429/5xx 或連線錯誤時的最大重試次數
+        :param backoff_factor: 指數退避的基數 (秒)，第 n 次重試等待 backoff_factor * 2^(n-1) 秒
+        :param timeout: 單次請求逾時秒數
+        :param base_url: API 位址 (測試時可指向本地假伺服器)
+        :param scheduler: 控管請求額度的 RequestScheduler，預設為行程內共用的排程器
+        """
+        self.base_url = base_url
+        self.scheduler = scheduler or get_scheduler()
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=['GET'],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @staticmethod
+    def _headers() -> dict:
+        """每次請求時讀取 FINMIND_API_TOKEN，讓 load_dotenv 的時機不影響驗證"""
+        token = os.getenv('FINMIND_API_TOKEN')
+        return {"Authorization": f"Bearer {token}"} if token else {}
+
+    def get_data(self, dataset: str, data_id: str = None, start_date: str = None, end_date: str = None) -> list:
+        """
+        查詢 FinMind 資料集
+        :return: API 回傳的 data 列表 (可能為空)
+        :raises requests.exceptions.RequestException: 連線失敗或重試後仍為錯誤狀態碼
+        :raises ValueError: FinMind API 回傳錯誤訊息，或等待逾時仍無請求額度 (QuotaExceededError)
+        """
+        params = {"dataset": dataset}
+        if data_id:
+            params["data_id"] = data_id
+        if start_date:
+            params["start_date"] = str(start_date)
+        if end_date:
+            params["end_date"] = str(end_date)
+
+        priority = current_priority()
+        self.scheduler.acquire(priority, timeout=QUOTA_WAIT_SECONDS[priority])
+        response = self.session.get(self.base_url, params=params, headers=self._headers(), timeout=self.timeout)
+        response.raise_for_status()
+
+        raw_data = response.json()
+        if raw_data.get("status") != 200 and raw_data.get("msg") != "success":
+            error_message = raw_data.get('msg') or raw_data.get('error_message', 'FinMind API 回傳錯誤，但未提供詳細訊息。')
+            raise ValueError(f"FinMind API 錯誤 (代碼: {raw_data.get('status', 'N/A')}): {error_message}")
+        return raw_data.get('data') or []
+
+    def price(self, stock_id: str, start_date: str, end_date: str = None) -> list:
+        """日K資料 (TaiwanStockPrice)"""
+        return self.get_data("TaiwanStockPrice", stock_id, start_date, end_date)
+
+    def price_all(self, trading_date: str) -> list:
+        """單一交易日全市場的日K (TaiwanStockPrice，不指定股票)"""
+        return self.get_data("TaiwanStockPrice", None, trading_date, trading_date)
+
+    def month_revenue(self, stock_id: str, start_date: str, end_date: str = None) -> list:
+        """月營收資料 (TaiwanStockMonthRevenue)"""
+        return self.get_data("TaiwanStockMonthRevenue", stock_id, start_date, end_date)
+
+    def month_revenue_all(self, start_date: str, end_date: str = None) -> list:
+        """全市場的月營收 (TaiwanStockMonthRevenue，不指定股票)，以公告日期篩選"""
+        return self.get_data("TaiwanStockMonthRevenue", None, start_date, end_date)
+
+    def stock_info(self) -> list:
+        """上市櫃股票清單 (TaiwanStockInfo)"""
+        return self.get_data("TaiwanStockInfo")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> FinMindClient:
+    """取得行程內共用的 FinMindClient (延遲建立)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not os.getenv('FINMIND_API_TOKEN'):
+                    print("警告: 未設定 FINMIND_API_TOKEN 環境變數，將嘗試匿名存取 FinMind API。部分資料可能受限。")
+                _client = FinMindClient()
+    return _client
@@ -0,0 +1,197 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import requests
+
+# FinMind 請求排程器
+# 以 token bucket 控管每小時請求配額，並定期向 FinMind 讀取實際剩餘額度校正。
+# 等待中的請求依優先度排隊：互動查詢 (INTERACTIVE) 永遠排在批次作業 (BATCH) 之前，
+# 批次作業在剩餘額度低於保留量時會自行延後，把額度留給互動查詢。
+# 剩餘額度的同步在背景執行緒中進行，查詢緩慢時不會阻擋取得額度的請求。
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BATCH: 'batch'}
+
+QUOTA_URL = "https://api.web.finmindtrade.com/v2/user_info"
+# 查詢剩餘額度的逾時秒數，可由環境變數 FINMIND_QUOTA_TIMEOUT 調整
+QUOTA_TIMEOUT = float(os.getenv('FINMIND_QUOTA_TIMEOUT', '2'))
+
+
+def default_hourly_limit() -> int:
+    """有 token 時每小時 600 次，匿名為 300 次"""
+    return 600 if os.getenv('FINMIND_API_TOKEN') else 300
+
+
+_current_priority = ContextVar('finmind_priority', default=BATCH)
+
+
+@contextmanager
+def request_priority(priority: int):
+    """在 with 區塊內發出的 FinMind 請求皆使用指定的優先度"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority() -> int:
+    return _current_priority.get()
+
+
+class QuotaExceededError(ValueError):
+    """在等待時間內無法取得 FinMind 請求額度"""
+
+
+class RequestScheduler:
+    def __init__(self, hourly_limit: int = None, batch_reserve: float = 0.2,
+                 quota_url: str = QUOTA_URL, sync_interval: float = 60) -> None:
+        """
+        :param hourly_limit: 每小時請求上限，預設依是否設定 token 而定 (同步到實際配額後會以 FinMind 回傳的值為準)
+        :param batch_reserve: 保留給互動查詢的額度比例，剩餘額度低於此比例時批次請求會延後
+        :param quota_url: 查詢剩餘額度的 API 位址 (設為 None 則不同步)
+        :param sync_interval: 同步剩餘額度的最短間隔秒數
+        """
+        self.hourly_limit = hourly_limit or default_hourly_limit()
+        self.batch_reserve = batch_reserve
+        self.quota_url = quota_url
+        self.sync_interval = sync_interval
+        self.tokens = float(self.hourly_limit)
+        self.used_remote = None
+        self._last_refill = time.monotonic()
+        self._last_sync = 0.0
+        self._syncing = False
+        self._waiters = []  # (優先度, 序號)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    @property
+    def refill_rate(self) -> float:
+        """每秒回補的額度"""
+        return self.hourly_limit / 3600
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.hourly_limit, self.tokens + (now - self._last_refill) * self.refill_rate)
+        self._last_refill = now
+
+    def _can_take(self, priority: int) -> bool:
+        if self.tokens < 1:
+            return False
+        if priority == INTERACTIVE:
+            return True
+        return self.tokens - 1 >= self.hourly_limit * self.batch_reserve
+
+    def sync_quota(self) -> None:
+        """向 FinMind 讀取目前已使用次數與上限，校正本地額度"""
+        if not self.quota_url:
+            return
+        self._last_sync = time.monotonic()
+        token = os.getenv('FINMIND_API_TOKEN')
+        if not token:
+            return
+        try:
+            response = requests.get(self.quota_url, params={'token': token}, timeout=QUOTA_TIMEOUT)
+            response.raise_for_status()
+            info = response.json()
+            limit = int(info['api_request_limit'])
+            used = int(info['user_count'])
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            print(f"警告: 無法取得 FinMind 剩餘額度，沿用本地估計值: {e}")
+            return
+        with self._cond:
+            self.hourly_limit = limit
+            self.used_remote = used
+            self.tokens = float(max(0, limit - used))
+            self._last_refill = time.monotonic()
+            self._cond.notify_all()
+
+    def _sync_in_background(self) -> None:
+        """距上次同步超過 sync_interval 時，在背景執行緒中同步剩餘額度 (同一時間只有一個同步)"""
+        with self._cond:
+            if self._syncing or time.monotonic() - self._last_sync < self.sync_interval:
+                return
+            self._syncing = True
+            self._last_sync = time.monotonic()
+
+        def run():
+            try:
+                self.sync_quota()
+            finally:
+                with self._cond:
+                    self._syncing = False
+
+        threading.Thread(target=run, name='finmind-quota-sync', daemon=True).start()
+
+    def acquire(self, priority: int = None, timeout: float = None) -> None:
+        """
+        取得一次請求額度，必要時依優先度排隊等待
+        :param priority: INTERACTIVE 或 BATCH，預設為目前 request_priority 區塊的優先度
+        :param timeout: 最長等待秒數，None 表示一直等待
+        :raises QuotaExceededError: 等待逾時仍無法取得額度
+        """
+        if priority is None:
+            priority = current_priority()
+        if self.quota_url:
+            self._sync_in_background()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    self._refill()
+                    if self._waiters[0] == entry and self._can_take(priority):
+                        self.tokens -= 1
+                        return
+                    # 等到下一個額度回補或有人離開佇列
+                    wait = max(0.05, (1 - (self.tokens % 1)) / self.refill_rate)
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise QuotaExceededError(
+                                f"FinMind 請求額度不足 (剩餘約 {int(self.tokens)} 次)，請稍後再試。")
+                        wait = min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def status(self) -> dict:
+        """目前的額度狀態，供 /api/finmind_quota 顯示"""
+        with self._cond:
+            self._refill()
+            waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _ in self._waiters:
+                waiting[PRIORITY_NAMES[priority]] += 1
+            return {
+                'hourly_limit': self.hourly_limit,
+                'remaining': int(self.tokens),
+                'batch_reserve': int(self.hourly_limit * self.batch_reserve),
+                'batch_deferred': not self._can_take(BATCH),
+                'used_remote': self.used_remote,
+                'waiting': waiting,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """取得行程內共用的 RequestScheduler (延遲建立)"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RequestScheduler()
+    return _scheduler
+
@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 向量化技術指標引擎
+# 所有函式皆以 (天數 × 股票數) 的價格矩陣為輸入，第 0 軸為時間 (由舊到新)，
+# 一次計算所有股票的指標，不使用 Python 層級的逐筆迴圈。
+# 股票資料長度不一時，請以 stack_price_series 靠右對齊 (前段補 NaN)。
+
+INDICATOR_KEYS = [
+    'sma5', 'sma20', 'sma60', 'k', 'd',
+    'dev_5_20', 'dev_20_60', 'dev_5_60', 'dev_1_20',
+    'macd', 'macd_signal', 'macd_hist', 'wma5', 'wma10',
+]
+SIGNAL_KEYS = ['I_value', 'J_value', 'K_value', 'L_value']
+
+
+def _as_matrix(values) -> np.ndarray:
+    """將一維價格序列轉為單欄矩陣，二維矩陣則維持原樣"""
+    matrix = np.asarray(values, dtype=float)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(-1, 1)
+    return matrix
+
+
+def stack_price_series(series_list) -> np.ndarray:
+    """
+    將多檔股票長度不一的價格序列靠右對齊堆疊成 (天數 × 股票數) 矩陣
+    每檔股票最後一筆資料都位於最後一列，不足的前段以 NaN 補齊。
+    :param series_list: 價格序列 (list / ndarray / Series) 的列表
+    :return: 價格矩陣
+    """
+    lengths = [len(values) for values in series_list]
+    matrix = np.full((max(lengths, default=0), len(series_list)), np.nan)
+    for col, (values, length) in enumerate(zip(series_list, lengths)):
+        if length:
+            matrix[-length:, col] = np.asarray(values, dtype=float)
+    return matrix
+
+
+def _rolling(matrix, period: int, reduce) -> np.ndarray:
+    """
+    以 sliding_window_view 對每個 period 筆的視窗做彙總 (一次處理所有股票，不逐欄呼叫 pandas rolling)
+    與 pandas rolling(window=period) 相同：前 period-1 筆與視窗內含 NaN 時結果為 NaN。
+    只用於沒有捨入誤差的最大值、最小值。
+    """
+    matrix = _as_matrix(matrix)
+    result = np.full(matrix.shape, np.nan)
+    if len(matrix) < period:
+        return result
+    result[period - 1:] = reduce(sliding_window_view(matrix, period, axis=0), axis=-1)
+    return result
+
+
+def rolling_mean(matrix, period: int) -> np.ndarray:
+    """
+    計算簡單移動平均線 (SMA)
+    保留 pandas rolling 的累加算法：平盤時均線是否「相等」會影響階梯訊號，改用其他加總順序會有捨入差異。
+    """
+    return pd.DataFrame(_as_matrix(matrix)).rolling(window=period).mean().to_numpy()
+
+
+def ema(matrix, span: int) -> np.ndarray:
+    """計算指數移動平均線 (EMA, adjust=False)"""
+    return pd.DataFrame(_as_matrix(matrix)).ewm(span=span, adjust=False).mean().to_numpy()
+
+
+def weighted_moving_average(matrix, period: int) -> np.ndarray:
+    """
+    計算加權移動平均線 (WMA)
+    WMA(N) = {(當期收盤價 x N) + [前期收盤價 x (N – 1)] + …… + 第N期收盤價 x 1} / (N * (N + 1) / 2)
+    """
+    matrix = _as_matrix(matrix)
+    result = np.full(matrix.shape, np.nan)
+    if len(matrix) < period:
+        return result
+
+    # 視窗內由舊到新的權重為 1, 2, ..., N
+    weights = np.arange(1, period + 1, dtype=float)
+    windows = sliding_window_view(matrix, period, axis=0)  # (天數-N+1, 股票數, N)
+    result[period - 1:] = windows @ weights / weights.sum()
+    return result
+
+
+def stochastic(high, low, close, k_period: int = 9, k_slowing: int = 3, d_period: int = 3):
+    """
+    計算 KD 指標
+    k_period: 計算%K的周期
+    k_slowing: %K緩衝期
+    d_period: 計算%D的周期
+    """
+    min_low = _rolling(low, k_period, np.min)
+    max_high = _rolling(high, k_period, np.max)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        raw_k = 100 * ((_as_matrix(close) - min_low) / (max_high - min_low))
+
+    k = rolling_mean(raw_k, k_slowing)
+    d = rolling_mean(k, d_period)
+    return k, d
+
+
+def macd(close, fast_period: int = 12, slow_period: int = 26, signal_period: int = 9):
+    """
+    計算 MACD 指標
+    fast_period: 快線週期
+    slow_period: 慢線週期
+    signal_period: 信號線週期
+    """
+    macd_line = ema(close, fast_period) - ema(close, slow_period)
+    signal = ema(macd_line, signal_period)
+    return macd_line, signal, macd_line - signal
+
+
+def compute_indicators(close, high, low) -> dict:
+    """
+    一次計算所有股票的技術指標
+    :param close: 收盤價矩陣 (天數 × 股票數)
+    :param high: 最高價矩陣
+    :param low: 最低價矩陣
+    :return: 以指標名稱為鍵、(天數 × 股票數) 矩陣為值的字典
+    """
+    close = _as_matrix(close)
+    high = _as_matrix(high)
+    low = _as_matrix(low)
+
+    indicators = {}
+
+    # 簡單移動平均線 (SMA)
+    indicators['sma5'] = rolling_mean(close, 5)
+    indicators['sma20'] = rolling_mean(close, 20)
+    indicators['sma60'] = rolling_mean(close, 60)
+
+    # KD 指標
+    indicators['k'], indicators['d'] = stochastic(high, low, close)
+
+    # 均線間的乖離百分比
+    indicators['dev_5_20'] = (indicators['sma5'] - indicators['sma20']) / indicators['sma20'] * 100
+    indicators['dev_20_60'] = (indicators['sma20'] - indicators['sma60']) / indicators['sma60'] * 100
+    indicators['dev_5_60'] = (indicators['sma5'] - indicators['sma60']) / indicators['sma60'] * 100
+    indicators['dev_1_20'] = (close - indicators['sma20']) / indicators['sma20'] * 100
+
+    # MACD 指標
+    indicators['macd'], indicators['macd_signal'], indicators['macd_hist'] = macd(close)
+
+    # 週線指標 (5WMA 和 10WMA)
+    indicators['wma5'] = weighted_moving_average(close, 5)
+    indicators['wma10'] = weighted_moving_average(close, 10)
+
+    return indicators
+
+
+def stair_signal(dev_5_20, dev_20_60, dev_5_60) -> np.ndarray:
+    """根據均線乖離計算階梯型態訊號 (任一值為 NaN 時視為 -3)"""
+    with np.errstate(invalid='ignore'):
+        conditions = [
+            (dev_5_20 >= dev_5_60) & (dev_5_60 >= dev_20_60),
+            (dev_5_60 >= dev_5_20) & (dev_5_20 >= dev_20_60),
+            (dev_5_60 >= dev_20_60) & (dev_20_60 >= dev_5_20),
+            (dev_20_60 >= dev_5_60) & (dev_5_60 >= dev_5_20),
+            (dev_20_60 >= dev_5_20) & (dev_5_20 >= dev_5_60),
+        ]
+    return np.select(conditions, [1, 2, 3, -1, -2], default=-3)
+
+
+def deviation_signal(dev_1_20, threshold: float = 5) -> np.ndarray:
+    """根據收盤價與月線乖離計算乖離訊號"""
+    return np.where(dev_1_20 >= threshold, 4.0, np.where(dev_1_20 <= -threshold, -4.0, np.nan))
+
+
+def trend_signal(dev_5_60) -> np.ndarray:
+    """趨勢訊號：若 dev_5_60 為正則為多頭 (3)，否則空頭 (-3)"""
+    return np.where(dev_5_60 >= 0, 3, -3)
+
+
+def kd_signal(k) -> np.ndarray:
+    """KD 訊號：K 值大於等於80視為超買 (100)；低於等於20則為超賣 (0)；中間則不顯示"""
+    return np.where(k >= 80, 100.0, np.where(k <= 20, 0.0, np.nan))
+
+
+def compute_signals(indicators: dict) -> dict:
+    """
+    根據 compute_indicators 的結果計算 I/J/K/L 交易訊號
+    輸入可為矩陣或單一股票的一維陣列，輸出形狀與輸入相同。
+    """
+    with np.errstate(invalid='ignore'):
+        return {
+            'I_value': stair_signal(indicators['dev_5_20'], indicators['dev_20_60'], indicators['dev_5_60']),
+            'J_value': deviation_signal(indicators['dev_1_20']),
+            'K_value': trend_signal(indicators['dev_5_60']),
+            'L_value': kd_signal(indicators['k']),
+        }
+
+
+def column(results: dict, col: int, length: int = None) -> dict:
+    """
+    從矩陣結果中取出單一股票的一維陣列
+    :param results: compute_indicators / compute_signals 的結果
+    :param col: 股票所在欄位
+    :param length: 該股票的實際資料筆數 (靠右對齊時用來去除前段補齊的 NaN)
+    """
+    start = 0 if length is None else -length
+    return {key: values[start:, col] for key, values in results.items()}
+
@@ -0,0 +1,284 @@
+import os
+import json
+import math
+from collections import deque
+
+import numpy as np
+
+from indicator_engine import stair_signal, deviation_signal, trend_signal, kd_signal
+
+# 增量 (串流) 技術指標狀態
+# 每檔股票保存滾動和、EMA 延續值與 KD 用的單調佇列，新增一根日K只需 O(1) 更新。
+# 滾動平均逐步重現 pandas rolling().mean() 的 Kahan 累加 (與 indicator_engine.rolling_mean 相同的運算順序)，
+# 平盤時均線相等的判斷與完整重算一致，階梯訊號等離散訊號不會因捨入差異而改變。
+
+STATE_FOLDER = 'indicator_state'
+
+# 狀態檔格式版本；格式改變後舊的狀態檔視為損毀，由 refresh_indicator_states 重新建立
+STATE_VERSION = 2
+
+
+class _RollingMean:
+    """
+    固定視窗的滾動平均，逐步重現 pandas rolling(window=period).mean()：
+    加入與移出各自以 Kahan 補償累加，視窗內全為同一數值時直接回傳該值，±inf 視為 NaN。
+    """
+
+    def __init__(self, period: int, data: dict = None) -> None:
+        data = data or {}
+        self.period = period
+        self.window = deque(data.get('window', []), maxlen=period)
+        self.total = data.get('total', 0.0)
+        self.add_compensation = data.get('add_compensation', 0.0)
+        self.remove_compensation = data.get('remove_compensation', 0.0)
+        self.count = data.get('count', 0)  # 視窗內非 NaN 的筆數
+        self.negative_count = data.get('negative_count', 0)
+        self.same_count = data.get('same_count', 0)  # 連續相同數值的筆數 (與 pandas 相同，移出時不遞減)
+        self.previous = data.get('previous', np.nan)
+
+    def to_dict(self) -> dict:
+        return {
+            'window': list(self.window),
+            'total': self.total,
+            'add_compensation': self.add_compensation,
+            'remove_compensation': self.remove_compensation,
+            'count': self.count,
+            'negative_count': self.negative_count,
+            'same_count': self.same_count,
+            'previous': self.previous,
+        }
+
+    def _add(self, value: float) -> None:
+        if math.isnan(value):
+            return
+        self.count += 1
+        y = value - self.add_compensation
+        t = self.total + y
+        self.add_compensation = t - self.total - y
+        self.total = t
+        if math.copysign(1.0, value) < 0:
+            self.negative_count += 1
+        self.same_count = self.same_count + 1 if value == self.previous else 1
+        self.previous = value
+
+    def _remove(self, value: float) -> None:
+        if math.isnan(value):
+            return
+        self.count -= 1
+        y = -value - self.remove_compensation
+        t = self.total + y
+        self.remove_compensation = t - self.total - y
+        self.total = t
+        if math.copysign(1.0, value) < 0:
+            self.negative_count -= 1
+
+    def push(self, value: float) -> float:
+        value = float(value)
+        if math.isinf(value):
+            value = np.nan
+        if len(self.window) == self.period:
+            self._remove(self.window[0])
+        self.window.append(value)
+        self._add(value)
+
+        if self.count < self.period:
+            return np.nan
+        if self.same_count >= self.count:
+            return self.previous
+        mean = self.total / self.count
+        if self.negative_count == 0 and mean < 0:
+            return 0.0
+        if self.negative_count == self.count and mean > 0:
+            return 0.0
+        return mean
+
+
+class _RollingExtreme:
+    """以單調佇列維護固定視窗的最小值或最大值"""
+
+    def __init__(self, period: int, use_max: bool, items=None, count: int = 0) -> None:
+        self.period = period
+        self.use_max = use_max
+        self.items = deque(tuple(item) for item in (items or []))  # (序號, 數值)
+        self.count = count
+
+    def push(self, value: float) -> float:
+        index = self.count
+        self.count += 1
+        if self.use_max:
+            while self.items and self.items[-1][1] <= value:
+                self.items.pop()
+        else:
+            while self.items and self.items[-1][1] >= value:
+                self.items.pop()
+        self.items.append((index, value))
+        while self.items[0][0] <= index - self.period:
+            self.items.popleft()
+        if self.count < self.period:
+            return np.nan
+        return self.items[0][1]
+
+
+class IndicatorState:
+    """單一股票的增量技術指標狀態"""
+
+    def __init__(self, stock_id: str) -> None:
+        self.stock_id = stock_id
+        self.last_date = None
+        self.sma = {period: _RollingMean(period) for period in (5, 20, 60)}
+        self.wma = {period: deque(maxlen=period) for period in (5, 10)}  # 保存最近 N 筆收盤價
+        self.min_low = _RollingExtreme(9, use_max=False)
+        self.max_high = _RollingExtreme(9, use_max=True)
+        self.raw_k = _RollingMean(3)
+        self.k = _RollingMean(3)
+        self.ema = {'fast': None, 'slow': None, 'signal': None}
+        self.latest = {}
+
+    @staticmethod
+    def _ema_step(previous, value, span):
+        """EMA (adjust=False) 的單步更新"""
+        if previous is None or math.isnan(previous):
+            return value
+        alpha = 2 / (span + 1)
+        return (1 - alpha) * previous + alpha * value
+
+    def _wma_step(self, period: int, close: float) -> float:
+        """WMA：視窗固定為 N 筆，每次以同一組權重精確加總 (與 indicator_engine.weighted_moving_average 相同)"""
+        window = self.wma[period]
+        window.append(close)
+        if len(window) < period:
+            return np.nan
+        weights = np.arange(1, period + 1, dtype=float)
+        return float(np.asarray(window) @ weights / weights.sum())
+
+    def update(self, bar_date, high: float, low: float, close: float) -> dict:
+        """
+        加入一根新的日K並更新所有指標與訊號
+        :param bar_date: 日K日期 (早於或等於 last_date 的資料會被忽略)
+        :return: 最新一筆的指標與訊號
+        """
+        bar_date = str(bar_date)[:10]
+        if self.last_date is not None and bar_date <= self.last_date:
+            return self.latest
+
+        high, low, close = float(high), float(low), float(close)
+        latest = {}
+
+        # 簡單移動平均線 (SMA)
+        for period, window in self.sma.items():
+            latest[f'sma{period}'] = window.push(close)
+
+        # KD 指標
+        min_low = self.min_low.push(low)
+        max_high = self.max_high.push(high)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            raw_k = float(100 * (np.float64(close) - min_low) / (np.float64(max_high) - min_low))
+        latest['k'] = self.raw_k.push(raw_k)
+        latest['d'] = self.k.push(latest['k'])
+
+        # 均線間的乖離百分比
+        latest['dev_5_20'] = (latest['sma5'] - latest['sma20']) / latest['sma20'] * 100
+        latest['dev_20_60'] = (latest['sma20'] - latest['sma60']) / latest['sma60'] * 100
+        latest['dev_5_60'] = (latest['sma5'] - latest['sma60']) / latest['sma60'] * 100
+        latest['dev_1_20'] = (close - latest['sma20']) / latest['sma20'] * 100
+
+        # MACD 指標
+        self.ema['fast'] = self._ema_step(self.ema['fast'], close, 12)
+        self.ema['slow'] = self._ema_step(self.ema['slow'], close, 26)
+        latest['macd'] = self.ema['fast'] - self.ema['slow']
+        self.ema['signal'] = self._ema_step(self.ema['signal'], latest['macd'], 9)
+        latest['macd_signal'] = self.ema['signal']
+        latest['macd_hist'] = latest['macd'] - latest['macd_signal']
+
+        # 週線指標 (5WMA 和 10WMA)
+        for period in self.wma:
+            latest[f'wma{period}'] = self._wma_step(period, close)
+
+        # 交易訊號
+        with np.errstate(invalid='ignore'):
+            latest['I_value'] = int(stair_signal(latest['dev_5_20'], latest['dev_20_60'], latest['dev_5_60']))
+            latest['J_value'] = float(deviation_signal(latest['dev_1_20']))
+            latest['K_value'] = int(trend_signal(latest['dev_5_60']))
+            latest['L_value'] = float(kd_signal(latest['k']))
+
+        self.last_date = bar_date
+        self.latest = latest
+        return latest
+
+    @classmethod
+    def from_price_data(cls, stock_id: str, price_data) -> 'IndicatorState':
+        """以完整歷史日K (index 為日期，含 High/Low/Close 欄位) 建立狀態"""
+        state = cls(stock_id)
+        for bar_date, high, low, close in zip(price_data.index, price_data['High'].values,
+                                              price_data['Low'].values, price_data['Close'].values):
+            state.update(bar_date, high, low, close)
+        return state
+
+    def to_dict(self) -> dict:
+        """轉為可寫入 JSON 的字典"""
+        return {
+            'version': STATE_VERSION,
+            'stock_id': self.stock_id,
+            'last_date': self.last_date,
+            'sma': {str(p): w.to_dict() for p, w in self.sma.items()},
+            'wma': {str(p): list(w) for p, w in self.wma.items()},
+            'min_low': {'items': list(self.min_low.items), 'count': self.min_low.count},
+            'max_high': {'items': list(self.max_high.items), 'count': self.max_high.count},
+            'raw_k': self.raw_k.to_dict(),
+            'k': self.k.to_dict(),
+            'ema': self.ema,
+            'latest': self.latest,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'IndicatorState':
+        """由 to_dict 的結果還原狀態"""
+        if data.get('version') != STATE_VERSION:
+            raise ValueError(f"狀態檔格式版本 {data.get('version')} 與目前版本 {STATE_VERSION} 不同")
+        state = cls(data['stock_id'])
+        state.last_date = data['last_date']
+        state.sma = {int(p): _RollingMean(int(p), values) for p, values in data['sma'].items()}
+        state.wma = {int(p): deque(values, maxlen=int(p)) for p, values in data['wma'].items()}
+        state.min_low = _RollingExtreme(9, False, data['min_low']['items'], data['min_low']['count'])
+        state.max_high = _RollingExtreme(9, True, data['max_high']['items'], data['max_high']['count'])
+        state.raw_k = _RollingMean(3, data['raw_k'])
+        state.k = _RollingMean(3, data['k'])
+        state.ema = data['ema']
+        state.latest = data['latest']
+        return state
+
+    def save(self, folder: str = STATE_FOLDER) -> None:
+        """將狀態寫入 <folder>/<stock_id>.json (先寫暫存檔再取代，避免寫到一半的檔案)"""
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        path = os.path.join(folder, f'{self.stock_id}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def exists(stock_id: str, folder: str = STATE_FOLDER) -> bool:
+        """是否已保存此股票的狀態"""
+        return os.path.exists(os.path.join(folder, f'{stock_id}.json'))
+
+    @staticmethod
+    def saved_ids(folder: str = STATE_FOLDER) -> list:
+        """已保存狀態的股票代碼 (即增量更新的觀察清單)"""
+        if not os.path.isdir(folder):
+            return []
+        return sorted(name[:-len('.json')] for name in os.listdir(folder) if name.endswith('.json'))
+
+    @classmethod
+    def load(cls, stock_id: str, folder: str = STATE_FOLDER):
+        """讀取已保存的狀態，不存在或損毀時回傳 None"""
+        path = os.path.join(folder, f'{stock_id}.json')
+        try:
+            with open(path, encoding='utf-8') as f:
+                return cls.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError) as e:
+            print(f"讀取 {stock_id} 的指標狀態時發生錯誤，將重新建立: {e}")
+            return None
+
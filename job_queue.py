@@ -0,0 +1,182 @@
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+
+# 持久化背景工作佇列 (SQLite)
+# 長時間的工作 (籌碼集中度選股、大戶股權更新) 以工作 ID 排入佇列後立即回應，
+# 由專用的背景工作者取出執行並回報進度；行程重啟後未完成的工作會重新排入佇列。
+
+DB_PATH = 'jobs.db'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# 執行中的工作超過此秒數沒有心跳，視為工作者已中止並重新排入佇列
+STALE_SECONDS = 900
+# 工作執行期間另以執行緒定期寫入心跳的間隔秒數 (處理函式長時間沒有回報進度時也不會被重新排入)
+HEARTBEAT_SECONDS = 60
+
+_handlers = {}
+
+
+@contextmanager
+def _connect(db_path: str = DB_PATH):
+    """建立資料庫連線並確保資料表存在，離開時提交並關閉連線"""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            params TEXT,
+            progress TEXT,
+            result TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            heartbeat_at REAL,
+            finished_at TEXT
+        )
+    ''')
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _now() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def register_handler(kind: str, handler) -> None:
+    """
+    註冊工作類型的處理函式
+    :param handler: handler(params, report_progress) -> result，result 需可轉為 JSON
+    """
+    _handlers[kind] = handler
+
+
+def submit_job(kind: str, params: dict = None, db_path: str = DB_PATH) -> str:
+    """將工作排入佇列並回傳工作 ID"""
+    job_id = uuid.uuid4().hex
+    with _connect(db_path) as conn:
+        conn.execute(
+            'INSERT INTO jobs (id, kind, status, params, progress, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (job_id, kind, QUEUED, json.dumps(params or {}), json.dumps({}), _now()))
+    return job_id
+
+
+def get_job(job_id: str, db_path: str = DB_PATH):
+    """查詢工作狀態，找不到時回傳 None"""
+    with _connect(db_path) as conn:
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    for key in ('params', 'progress', 'result'):
+        job[key] = json.loads(job[key]) if job[key] else None
+    return job
+
+
+def update_progress(job_id: str, progress: dict, db_path: str = DB_PATH) -> None:
+    """寫入工作進度 (同時作為工作者仍在執行的心跳)"""
+    with _connect(db_path) as conn:
+        conn.execute('UPDATE jobs SET progress = ?, heartbeat_at = ? WHERE id = ?',
+                     (json.dumps(progress, ensure_ascii=False), time.time(), job_id))
+
+
+def _heartbeat(job_id: str, stop_event: threading.Event, db_path: str = DB_PATH) -> None:
+    """工作執行期間定期更新心跳，直到 stop_event 被設定"""
+    while not stop_event.wait(HEARTBEAT_SECONDS):
+        try:
+            with _connect(db_path) as conn:
+                conn.execute('UPDATE jobs SET heartbeat_at = ? WHERE id = ?', (time.time(), job_id))
+        except sqlite3.Error as e:
+            print(f"更新背景工作 {job_id} 的心跳時發生錯誤: {e}")
+
+
+def _claim_next(db_path: str = DB_PATH):
+    """以寫入鎖取出最早排入的工作並標記為執行中，沒有工作時回傳 None"""
+    with _connect(db_path) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # 重新排入已中止的工作者留下的工作
+            conn.execute('UPDATE jobs SET status = ? WHERE status = ? AND heartbeat_at < ?',
+                         (QUEUED, RUNNING, time.time() - STALE_SECONDS))
+            row = conn.execute('SELECT id, kind, params FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1',
+                               (QUEUED,)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE jobs SET status = ?, started_at = ?, heartbeat_at = ? WHERE id = ?',
+                             (RUNNING, _now(), time.time(), row['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    return None if row is None else (row['id'], row['kind'], json.loads(row['params'] or '{}'))
+
+
+def _finish(job_id: str, status: str, result=None, error: str = None, db_path: str = DB_PATH) -> None:
+    with _connect(db_path) as conn:
+        conn.execute('UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?',
+                     (status, json.dumps(result, ensure_ascii=False), error, _now(), job_id))
+
+
+def run_next_job(db_path: str = DB_PATH) -> bool:
+    """取出並執行一個工作，沒有工作時回傳 False"""
+    claimed = _claim_next(db_path)
+    if claimed is None:
+        return False
+
+    job_id, kind, params = claimed
+    handler = _handlers.get(kind)
+    if handler is None:
+        _finish(job_id, FAILED, error=f"錯誤: 未註冊的工作類型 '{kind}'", db_path=db_path)
+        return True
+
+    print(f"開始執行背景工作 {kind} ({job_id})...")
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, stop_heartbeat, db_path),
+                     name=f'job-heartbeat-{job_id}', daemon=True).start()
+    try:
+        result = handler(params, lambda progress: update_progress(job_id, progress, db_path))
+        _finish(job_id, DONE, result=result, db_path=db_path)
+        print(f"背景工作 {kind} ({job_id}) 完成。")
+    except Exception as e:
+        traceback.print_exc()
+        _finish(job_id, FAILED, error=str(e), db_path=db_path)
+        print(f"背景工作 {kind} ({job_id}) 失敗: {e}")
+    finally:
+        stop_heartbeat.set()
+    return True
+
+
+def worker_loop(poll_interval: float = 1.0, stop_event: threading.Event = None, db_path: str = DB_PATH) -> None:
+    """持續取出並執行工作，直到 stop_event 被設定"""
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        try:
+            if not run_next_job(db_path):
+                stop_event.wait(poll_interval)
+        except sqlite3.Error as e:
+            print(f"背景工作佇列發生資料庫錯誤: {e}")
+            stop_event.wait(poll_interval)
+
+
+def start_workers(count: int = 1, db_path: str = DB_PATH) -> list:
+    """在目前行程啟動背景工作者執行緒 (daemon)"""
+    threads = []
+    for i in range(count):
+        thread = threading.Thread(target=worker_loop, kwargs={'db_path': db_path},
+                                  name=f'job-worker-{i}', daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
@@ -0,0 +1,152 @@
+import os
+import argparse
+from datetime import date, timedelta
+
+import pandas as pd
+
+import price_store
+import price_matrix
+from finmind_client import get_client
+from finmind_scheduler import request_priority, BATCH
+
+# 全市場日K匯入
+# 每個交易日以一次不指定股票的 TaiwanStockPrice 查詢 (以日期為鍵) 取得所有上市櫃股票的日K，
+# 寫入本地日K資料庫並延伸各股票已確認的範圍 (price_store.save_market_day)。
+# 連續匯入涵蓋分析期間後，技術分析圖與選股都只讀取本地資料，不再逐檔向 FinMind 請求。
+# 匯入新的交易日後重建全市場日K矩陣 (price_matrix)，供分析器與全市場篩選以 memmap 讀取。
+# 每個日期完成後記錄於 market_days：重複執行不會重複請求 (冪等)，中斷後重新執行會從未完成的日期繼續。
+# 沒有資料的平日只有在之後的日期已取得日K時才記錄為假日 (FinMind 尚未發布或暫時回傳空結果的日期
+# 不會被當成假日而延伸各股票已確認的範圍)，否則留待下次重新確認。
+#
+# 使用方式 (可排入每日收盤後的排程)：
+#   python price_ingest.py                # 補齊最近 INGEST_BACKFILL_DAYS 天內尚未匯入的交易日
+#   python price_ingest.py --days 30      # 只檢查最近 30 天
+#   python price_ingest.py --force        # 重新匯入已完成的日期
+#   python price_ingest.py --queue        # 排入背景工作，由 app 的工作者執行
+# 匯入新的交易日後會排入 background_jobs.INDICATOR_REFRESH，更新觀察清單的增量指標狀態；
+# 網頁上的「全市場日K更新」(/update_prices) 排入相同的工作。
+
+# 匯入的回溯天數 (日曆天)，需涵蓋技術分析的資料期間，可由環境變數 INGEST_BACKFILL_DAYS 調整
+INGEST_BACKFILL_DAYS = int(os.getenv('INGEST_BACKFILL_DAYS', '420'))
+
+
+def market_rows(data_list: list) -> list:
+    """
+    將 FinMind TaiwanStockPrice 的資料轉為 [(stock_id, Open, High, Low, Close, Volume), ...]
+    欄位對應與 TaiwanStockAnalyzer._fetch_from_finmind 相同。
+    """
+    if not data_list:
+        return []
+    data = pd.DataFrame(data_list)
+    required_finmind_cols = ['stock_id', 'open', 'max', 'min', 'close', 'Trading_Volume']
+    missing_cols = [col for col in required_finmind_cols if col not in data.columns]
+    if missing_cols:
+        raise ValueError(f"FinMind API 回傳的資料缺少必要欄位: {', '.join(missing_cols)}")
+    values = data[required_finmind_cols[1:]].apply(pd.to_numeric, errors='coerce').astype(object)
+    values = values.where(values.notna(), None)
+    return [(str(stock_id), *row) for stock_id, row in zip(data['stock_id'], values.itertuples(index=False))]
+
+
+def _save_day(day: date, rows: list) -> int:
+    count = price_store.save_market_day(day, rows)
+    print(f"{day} 全市場日K已匯入 {count} 筆。" if count else f"{day} 沒有交易資料 (假日)。")
+    return count
+
+
+def ingest_day(day: date, client=None, force: bool = False):
+    """
+    匯入單一日期的全市場日K
+    :param force: 重新匯入已完成的日期
+    :return: 寫入的筆數；已完成時回傳 0；沒有資料且之後的日期也還沒有日K時回傳 None
+             (可能是 FinMind 尚未發布，不記錄為假日，下次重新確認)
+    """
+    if not force and day in price_store.ingested_days(day, day):
+        return 0
+    rows = market_rows((client or get_client()).price_all(day.isoformat()))
+    if not rows and not price_store.has_market_rows_after(day):
+        print(f"{day} 的全市場日K尚未發布。")
+        return None
+    return _save_day(day, rows)
+
+
+def ingest_range(start_date: date, end_date: date = None, client=None, force: bool = False,
+                 progress=None) -> dict:
+    """
+    依日期先後匯入區間內尚未完成的平日 (週末不請求)
+    沒有資料的日期先保留，等到之後的日期取得日K時才依序記錄為假日，再寫入該日期，
+    讓連續匯入的區間與各股票已確認的範圍依日期先後延伸；區間結束時仍未確認的日期視為尚未發布。
+    完成後若有新的日期 (或尚未建立矩陣) 則重建全市場日K矩陣。
+    :param progress: 每完成一個日期時呼叫的函式 progress(day, done, total)
+    :return: {'days': 請求的日期數, 'rows': 寫入的筆數, 'pending': 尚未發布的日期}
+    """
+    end_date = end_date or price_store.latest_trading_day()
+    done = set() if force else price_store.ingested_days(start_date, end_date)
+    days = [day.date() for day in pd.bdate_range(start_date, end_date) if day.date() not in done]
+    summary = {'days': len(days), 'rows': 0, 'pending': []}
+    client = client or get_client()
+    unconfirmed = []  # 沒有資料、尚無法確認是否為假日的日期
+    with request_priority(BATCH):
+        for index, day in enumerate(days, start=1):
+            rows = market_rows(client.price_all(day.isoformat()))
+            if rows:
+                for holiday in unconfirmed:
+                    _save_day(holiday, [])
+                unconfirmed = []
+                summary['rows'] += _save_day(day, rows)
+            elif price_store.has_market_rows_after(day):
+                _save_day(day, [])  # 先前的匯入已取得之後日期的日K
+            else:
+                unconfirmed.append(day)
+            if progress:
+                progress(day, index, len(days))
+    for day in unconfirmed:
+        print(f"{day} 的全市場日K尚未發布。")
+    summary['pending'] = [day.isoformat() for day in unconfirmed]
+    if len(days) > len(summary['pending']) or price_matrix.get_matrix() is None:
+        price_matrix.build()
+    return summary
+
+
+def ingest_pending(backfill_days: int = INGEST_BACKFILL_DAYS, client=None, force: bool = False,
+                   progress=None) -> dict:
+    """補齊最近 backfill_days 天內尚未匯入的交易日"""
+    end_date = price_store.latest_trading_day()
+    return ingest_range(end_date - timedelta(days=backfill_days), end_date, client, force, progress)
+
+
+def catch_up(client=None) -> dict:
+    """
+    只補齊最後一次匯入之後的交易日 (尚未做過全市場匯入時不執行，避免在互動流程中觸發完整回溯)
+    :return: 同 ingest_range；不需執行時 days 為 0
+    """
+    end_date = price_store.latest_trading_day()
+    done = price_store.ingested_days(end_date - timedelta(days=INGEST_BACKFILL_DAYS), end_date)
+    if not done:
+        return {'days': 0, 'rows': 0, 'pending': []}
+    return ingest_range(max(done) + timedelta(days=1), end_date, client)
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv('Finmind.env')
+
+    parser = argparse.ArgumentParser(description='全市場日K匯入')
+    parser.add_argument('--days', type=int, default=INGEST_BACKFILL_DAYS, help='回溯的日曆天數')
+    parser.add_argument('--force', action='store_true', help='重新匯入已完成的日期')
+    parser.add_argument('--queue', action='store_true',
+                        help='排入背景工作由 app 或 background_jobs.py 的工作者執行 (適合排程每日收盤後執行)')
+    args = parser.parse_args()
+
+    # 與網頁「全市場日K更新」相同的工作：匯入後重建日K矩陣，並排入增量指標狀態的更新
+    import job_queue
+    import background_jobs
+
+    params = {'days': args.days, 'force': args.force}
+    if args.queue:
+        print(f"已排入全市場日K匯入工作: {job_queue.submit_job(background_jobs.PRICE_INGEST, params)}")
+    else:
+        def on_progress(progress):
+            if 'done' in progress:
+                print(f"[{progress['done']}/{progress['total']}] {progress['message']}")
+
+        print(background_jobs.run_price_ingest(params, on_progress)['message'])
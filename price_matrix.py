@@ -0,0 +1,213 @@
+import os
+import json
+import glob
+import time
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import price_store
+
+# 全市場日K矩陣 (記憶體映射)
+# 將本地日K資料庫中所有股票的 OHLCV 依欄位各存成一個 (交易日 × 股票) 的 float64 .npy 檔，
+# 另以 index.json 記錄日期、股票代碼、各股票最後一筆日K的日期，以及建立時各股票已向 FinMind 確認的範圍。
+# 讀取時以唯讀 memmap 開啟：多個 gunicorn worker 共用作業系統的同一份分頁，不必各自保存 DataFrame；
+# 單一股票 (一欄) 或單一日期 (一列) 都是不複製資料的 numpy view，可直接交給向量化指標引擎。
+# 分析器以 index.json 中的確認範圍判斷矩陣是否已涵蓋到最近交易日，涵蓋時不查詢資料庫，
+# 直接以此股票各欄位的 view 建立 DataFrame。
+# 全市場匯入 (price_ingest) 寫入新的交易日後重建矩陣；重建時先寫入新版本的檔案，
+# 再以 os.replace 切換 index.json，讀取端偵測到 index.json 更新後改用新版本。
+#
+# 使用方式：
+#   python price_matrix.py            # 由本地日K資料庫重建矩陣
+
+# 矩陣檔案所在的資料夾，可由環境變數 PRICE_MATRIX_DIR 調整
+MATRIX_DIR = os.getenv('PRICE_MATRIX_DIR', 'price_matrix')
+
+# 矩陣涵蓋的日曆天數 (需涵蓋技術分析的資料期間)，可由環境變數 PRICE_MATRIX_DAYS 調整
+PRICE_MATRIX_DAYS = int(os.getenv('PRICE_MATRIX_DAYS', '420'))
+
+INDEX_FILE = 'index.json'
+FIELDS = price_store.PRICE_COLUMNS
+
+_matrix = None  # ((資料夾, index.json 的修改時間), PriceMatrix)
+_matrix_lock = threading.Lock()
+
+
+class PriceMatrix:
+    """唯讀的全市場日K矩陣，每個欄位為 (交易日 × 股票) 的 memmap；缺少資料的位置為 NaN"""
+
+    def __init__(self, folder: str = MATRIX_DIR) -> None:
+        """
+        :param folder: 矩陣檔案所在的資料夾
+        :raises FileNotFoundError: 尚未建立矩陣
+        """
+        with open(os.path.join(folder, INDEX_FILE), encoding='utf-8') as f:
+            index = json.load(f)
+        self.version = index['version']
+        self.start_date = date.fromisoformat(index['start_date'])
+        self.dates = pd.DatetimeIndex(pd.to_datetime(index['dates']))
+        self.codes = pd.Index(index['codes'])
+        self.last_dates = dict(zip(index['codes'], index['last_dates']))
+        self.coverage = index['coverage']  # {代碼: [已確認的起始日, 已確認到的日期]} (建立矩陣時的 coverage)
+        self.fields = {field: np.load(os.path.join(folder, filename), mmap_mode='r')
+                       for field, filename in index['files'].items()}
+
+    @property
+    def shape(self) -> tuple:
+        return len(self.dates), len(self.codes)
+
+    def __contains__(self, stock_id: str) -> bool:
+        return stock_id in self.last_dates
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        """單一欄位的 (交易日 × 股票) 矩陣 (memmap，不複製)"""
+        return self.fields[field]
+
+    def stock(self, stock_id: str) -> dict:
+        """
+        單一股票各欄位的時間序列 {欄位: 一維 view}，不複製資料 (跨列的 strided view)
+        :raises KeyError: 矩陣中沒有此股票
+        """
+        col = self.codes.get_loc(stock_id)
+        return {field: matrix[:, col] for field, matrix in self.fields.items()}
+
+    def day(self, day) -> dict:
+        """
+        單一交易日所有股票的資料 {欄位: 一維 view}，不複製資料 (連續的記憶體)
+        :raises KeyError: 矩陣中沒有此日期
+        """
+        row = self.dates.get_loc(pd.Timestamp(day))
+        return {field: matrix[row] for field, matrix in self.fields.items()}
+
+    def window(self, start_date: date) -> tuple:
+        """
+        start_date 之後的列 (由舊到新)
+        :return: (日期 DatetimeIndex, {欄位: (交易日 × 股票) view})
+        """
+        row = self.dates.searchsorted(pd.Timestamp(start_date))
+        return self.dates[row:], {field: matrix[row:] for field, matrix in self.fields.items()}
+
+    def aligned_window(self, start_date: date) -> tuple:
+        """
+        start_date 之後的列，每檔股票有收盤價的日K依原順序移到底部 (與 stack_price_series 相同的靠右對齊)
+        分析器會剔除沒有收盤價的日期，停牌期間因此不會拉長移動平均的視窗。
+        :return: (日期 DatetimeIndex, {欄位: 靠右對齊的 (交易日 × 股票) 陣列 (複本)}, 列索引 order)；
+                 aligned[欄位][i, j] 對應原本的 fields[欄位][order[i, j], j]
+        """
+        dates, fields = self.window(start_date)
+        order = np.argsort(~np.isnan(fields['Close']), axis=0, kind='stable')
+        aligned = {field: np.take_along_axis(np.asarray(values), order, axis=0) for field, values in fields.items()}
+        return dates, aligned, order
+
+    def is_fresh(self, stock_id: str, start_date: date) -> bool:
+        """
+        矩陣是否可取代資料庫查詢 (與 price_store.missing_start 回傳 None 的條件相同)：
+        矩陣涵蓋 start_date，且建立矩陣時此股票已確認到最近交易日。
+        之後才逐檔補抓的日K只會寫入尚未確認到最近交易日的股票，因此不會遺漏。
+        """
+        coverage = self.coverage.get(stock_id)
+        return (coverage is not None and start_date >= self.start_date
+                and start_date >= date.fromisoformat(coverage[0])
+                and date.fromisoformat(coverage[1]) >= price_store.latest_trading_day())
+
+    def prices(self, stock_id: str, start_date: date) -> pd.DataFrame:
+        """
+        與 price_store.load_prices 相同格式、只含此股票有收盤價之日期的 DataFrame
+        各欄位直接使用矩陣的唯讀 view，不複製資料；期間內有停牌等缺漏時才複製有日K的列。
+        :raises KeyError: 矩陣中沒有此股票
+        """
+        row = self.dates.searchsorted(pd.Timestamp(start_date))
+        col = self.codes.get_loc(stock_id)
+        data = pd.DataFrame({field: matrix[row:, col] for field, matrix in self.fields.items()},
+                            index=self.dates[row:].rename('Date'), copy=False)
+        traded = ~np.isnan(data['Close'].to_numpy())
+        return data if traded.all() else data[traded]
+
+
+def _write_index(folder: str, index: dict) -> None:
+    tmp_path = os.path.join(folder, f'{INDEX_FILE}.{os.getpid()}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(folder, INDEX_FILE))
+
+
+def build(days: int = PRICE_MATRIX_DAYS, folder: str = MATRIX_DIR, db_path: str = price_store.DB_PATH) -> tuple:
+    """
+    由本地日K資料庫重建矩陣 (最近 days 天內有日K的所有股票)
+    新版本的檔案寫入完成後才切換 index.json，讀取中的行程不受影響；舊版本的檔案隨後刪除
+    (已開啟的 memmap 在 Linux 上仍可繼續使用)。
+    :return: 矩陣形狀 (交易日數, 股票數)
+    """
+    start_date = price_store.latest_trading_day() - timedelta(days=days)
+    with price_store._connect(db_path) as conn:
+        data = pd.read_sql_query(
+            'SELECT stock_id, date, open, high, low, close, volume FROM prices WHERE date >= ?',
+            conn, params=(start_date.isoformat(),))
+    dates = np.sort(data['date'].unique())
+    codes = np.sort(data['stock_id'].unique())
+    day_index = np.searchsorted(dates, data['date'].to_numpy())
+    code_index = np.searchsorted(codes, data['stock_id'].to_numpy())
+    last_dates = data.groupby('stock_id')['date'].max()
+    with price_store._connect(db_path) as conn:
+        coverage = {stock_id: [start, checked] for stock_id, start, checked in conn.execute(
+            'SELECT stock_id, start_date, checked_through FROM coverage')}
+
+    os.makedirs(folder, exist_ok=True)
+    version = str(time.time_ns())
+    files = {}
+    for field, source in zip(FIELDS, ['open', 'high', 'low', 'close', 'volume']):
+        filename = f'{field}.{version}.npy'
+        matrix = np.lib.format.open_memmap(os.path.join(folder, filename), mode='w+',
+                                           dtype=np.float64, shape=(len(dates), len(codes)))
+        matrix[:] = np.nan
+        matrix[day_index, code_index] = data[source].to_numpy(dtype=float)
+        matrix.flush()
+        del matrix
+        files[field] = filename
+
+    _write_index(folder, {
+        'version': version,
+        'start_date': start_date.isoformat(),
+        'dates': dates.tolist(),
+        'codes': codes.tolist(),
+        'last_dates': last_dates.reindex(codes).tolist(),
+        'coverage': {code: coverage[code] for code in codes if code in coverage},
+        'files': files,
+    })
+    for path in glob.glob(os.path.join(folder, '*.npy')):
+        if os.path.basename(path) not in files.values():
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # 仍被其他行程開啟 (Windows)，下次重建時再刪除
+    return len(dates), len(codes)
+
+
+def get_matrix(folder: str = MATRIX_DIR):
+    """
+    取得目前版本的矩陣 (每個行程開啟一次，index.json 更新後重新開啟)
+    :return: PriceMatrix；尚未建立時回傳 None
+    """
+    global _matrix
+    try:
+        mtime = os.path.getmtime(os.path.join(folder, INDEX_FILE))
+    except OSError:
+        return None
+    cached = _matrix
+    if cached is None or cached[0] != (folder, mtime):
+        with _matrix_lock:
+            try:
+                cached = ((folder, mtime), PriceMatrix(folder))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"開啟日K矩陣時發生錯誤: {e}")
+                return None
+            _matrix = cached
+    return cached[1]
+
+
+if __name__ == '__main__':
+    rows, cols = build()
+    print(f"日K矩陣已重建：{rows} 個交易日 × {cols} 檔股票，儲存於 '{MATRIX_DIR}'。")
@@ -0,0 +1,241 @@
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta, timezone
+
+import pandas as pd
+
+# 本地日K資料庫 (SQLite)
+# 以 (stock_id, date) 為主鍵保存 OHLCV，並記錄每檔股票已向 FinMind 確認過的日期範圍，
+# 讓 fetch_data 只需請求最後一筆之後的新資料，週末、假日與盤中也不會重複請求。
+# 全市場匯入 (price_ingest) 以交易日為單位寫入所有股票的日K，並記錄於 market_days；
+# 連續匯入的區間會延伸各股票已確認的範圍，之後查詢個股不需再向 FinMind 請求。
+# 個股查詢另記錄最後查詢時的最近交易日 (last_checks)：假日或停牌時 FinMind 回傳空結果，
+# 同一個交易日內不再重複請求；已記錄於 market_days 的假日也視為已確認。
+
+DB_PATH = 'stock_prices.db'
+
+# 台灣時間 (無日光節約時間)
+TAIPEI_TZ = timezone(timedelta(hours=8))
+# 收盤後 FinMind 日K資料可取得的時間
+DATA_READY_TIME = time(15, 0)
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+@contextmanager
+def _connect(db_path: str = DB_PATH):
+    """建立資料庫連線並確保資料表存在，離開時提交並關閉連線"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS prices (
+            stock_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            open REAL, high REAL, low REAL, close REAL, volume REAL,
+            PRIMARY KEY (stock_id, date)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS coverage (
+            stock_id TEXT PRIMARY KEY,
+            start_date TEXT NOT NULL,
+            checked_through TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS last_checks (
+            stock_id TEXT PRIMARY KEY,
+            trading_day TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS market_days (
+            date TEXT PRIMARY KEY,
+            row_count INTEGER NOT NULL,
+            ingested_at TEXT NOT NULL
+        )
+    ''')
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def previous_weekday(day: date) -> date:
+    """前一個平日 (週一的前一個平日為週五)"""
+    day -= timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+def latest_trading_day(now: datetime = None) -> date:
+    """
+    回傳目前應已有日K資料的最近交易日
+    收盤資料尚未就緒前視為前一交易日，並跳過週末。
+    國定假日無法事先得知；個股查詢只確認到實際回傳的最後一個日期，假日則由全市場匯入記錄於 market_days。
+    """
+    now = now or datetime.now(TAIPEI_TZ)
+    day = now.date()
+    if now.time() < DATA_READY_TIME:
+        day -= timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+def _covered_through(conn, checked_through: date, latest: date) -> date:
+    """已確認範圍之後緊接的假日 (全市場匯入記錄沒有交易的平日) 也視為已確認"""
+    holidays = {row[0] for row in conn.execute(
+        'SELECT date FROM market_days WHERE date > ? AND date <= ? AND row_count = 0',
+        (checked_through.isoformat(), latest.isoformat()))}
+    day = checked_through
+    while day < latest:
+        following = day + timedelta(days=1)
+        while following.weekday() >= 5:
+            following += timedelta(days=1)
+        if following.isoformat() not in holidays:
+            break
+        day = following
+    return day
+
+
+def missing_start(stock_id: str, start_date: date, db_path: str = DB_PATH):
+    """
+    計算需要向 FinMind 請求的起始日期
+    若已確認到最近交易日 (其後的假日視為已確認)，或本交易日已查詢過 (假日、停牌回傳空結果) 則不需請求；
+    否則從最後一筆已存日K的隔天開始請求，FinMind 延遲發布的資料會在下一個交易日或全市場匯入時補齊。
+    :return: 需要請求的起始日期；若本地資料已涵蓋到最近交易日則回傳 None。
+    """
+    latest = latest_trading_day()
+    with _connect(db_path) as conn:
+        row = conn.execute('SELECT start_date, checked_through FROM coverage WHERE stock_id = ?',
+                           (stock_id,)).fetchone()
+        last_stored = conn.execute('SELECT MAX(date) FROM prices WHERE stock_id = ?',
+                                   (stock_id,)).fetchone()[0]
+        checked = conn.execute('SELECT trading_day FROM last_checks WHERE stock_id = ?', (stock_id,)).fetchone()
+        if row is None or start_date < date.fromisoformat(row[0]):
+            return start_date
+        if _covered_through(conn, date.fromisoformat(row[1]), latest) >= latest:
+            return None
+    if checked is not None and checked[0] >= latest.isoformat():
+        return None
+    if last_stored is None:
+        return start_date
+    return max(start_date, date.fromisoformat(last_stored) + timedelta(days=1))
+
+
+def save_prices(stock_id: str, price_data: pd.DataFrame, start_date: date, db_path: str = DB_PATH) -> None:
+    """
+    寫入日K (重複的日期會覆蓋) 並更新已確認的日期範圍
+    只確認到實際回傳的最後一個日期：FinMind 延遲發布時沒有回傳最近交易日的資料，
+    不能將其記為已確認，否則資料發布後也不會再請求。
+    另記錄本次查詢時的最近交易日，同一個交易日內不再重複請求 (見 missing_start)。
+    :param price_data: 以日期為 index、含 Open/High/Low/Close/Volume 欄位的 DataFrame (可為空)
+    :param start_date: 本次請求的起始日期
+    """
+    rows = [
+        (stock_id, index.strftime('%Y-%m-%d'), *[None if pd.isna(v) else float(v) for v in values])
+        for index, values in zip(price_data.index, price_data[PRICE_COLUMNS].values)
+    ]
+    if rows:
+        checked_through = max(row[1] for row in rows)
+    else:
+        # 沒有回傳任何日K：不延伸已確認的範圍 (起始日前一天即為空的確認範圍)
+        checked_through = (start_date - timedelta(days=1)).isoformat()
+    with _connect(db_path) as conn:
+        conn.executemany('INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        conn.execute('''
+            INSERT INTO coverage (stock_id, start_date, checked_through) VALUES (?, ?, ?)
+            ON CONFLICT(stock_id) DO UPDATE SET
+                start_date = MIN(start_date, excluded.start_date),
+                checked_through = MAX(checked_through, excluded.checked_through)
+        ''', (stock_id, start_date.isoformat(), checked_through))
+        conn.execute('INSERT OR REPLACE INTO last_checks VALUES (?, ?)',
+                     (stock_id, latest_trading_day().isoformat()))
+
+
+def load_prices(stock_id: str, start_date: date, db_path: str = DB_PATH) -> pd.DataFrame:
+    """讀取指定日期之後的日K，回傳以 Date 為 index 的 DataFrame"""
+    with _connect(db_path) as conn:
+        data = pd.read_sql_query(
+            'SELECT date, open, high, low, close, volume FROM prices '
+            'WHERE stock_id = ? AND date >= ? ORDER BY date',
+            conn, params=(stock_id, start_date.isoformat()))
+    data.columns = ['Date'] + PRICE_COLUMNS
+    data['Date'] = pd.to_datetime(data['Date'])
+    return data.set_index('Date')
+
+
+def data_version(stock_id: str, db_path: str = DB_PATH) -> str:
+    """
+    此股票本地日K的版本 (供圖表快取使用)：最後一筆日K的日期，只在新的日K寫入後才改變
+    尚未確認到最近交易日時附加最近交易日，讓新的交易日第一次瀏覽時重新繪圖並補抓日K；
+    FinMind 延遲發布的日K則在全市場匯入寫入後改變版本。
+    """
+    with _connect(db_path) as conn:
+        last_stored = conn.execute('SELECT MAX(date) FROM prices WHERE stock_id = ?', (stock_id,)).fetchone()[0]
+        row = conn.execute('SELECT checked_through FROM coverage WHERE stock_id = ?', (stock_id,)).fetchone()
+    latest = latest_trading_day().isoformat()
+    if row is not None and row[0] >= latest:
+        return last_stored or 'empty'
+    return f"{last_stored or 'missing'}~{latest}"
+
+
+def ingested_days(start_date: date, end_date: date, db_path: str = DB_PATH) -> set:
+    """已完成全市場匯入的日期 (含沒有交易的假日)"""
+    with _connect(db_path) as conn:
+        rows = conn.execute('SELECT date FROM market_days WHERE date >= ? AND date <= ?',
+                            (start_date.isoformat(), end_date.isoformat())).fetchall()
+    return {date.fromisoformat(row[0]) for row in rows}
+
+
+def has_market_rows_after(day: date, db_path: str = DB_PATH) -> bool:
+    """day 之後是否已有匯入到日K的交易日 (表示 FinMind 已發布到 day 之後的資料)"""
+    with _connect(db_path) as conn:
+        return conn.execute('SELECT 1 FROM market_days WHERE date > ? AND row_count > 0 LIMIT 1',
+                            (day.isoformat(),)).fetchone() is not None
+
+
+def market_holidays(start_date: date, end_date: date, db_path: str = DB_PATH) -> set:
+    """全市場匯入確認沒有交易的平日 (國定假日、颱風假)"""
+    with _connect(db_path) as conn:
+        rows = conn.execute('SELECT date FROM market_days WHERE date >= ? AND date <= ? AND row_count = 0',
+                            (start_date.isoformat(), end_date.isoformat())).fetchall()
+    return {date.fromisoformat(row[0]) for row in rows}
+
+
+def _run_start(conn, day: date) -> date:
+    """以 day 結尾、每個平日都已匯入的連續區間的起始日"""
+    done = {row[0] for row in conn.execute('SELECT date FROM market_days WHERE date <= ?', (day.isoformat(),))}
+    start = day
+    while previous_weekday(start).isoformat() in done:
+        start = previous_weekday(start)
+    return start
+
+
+def save_market_day(day: date, rows: list, db_path: str = DB_PATH) -> int:
+    """
+    寫入一個交易日的全市場日K並延伸已確認的範圍 (重複執行結果相同)
+    以 day 結尾的連續匯入區間 [S, day] 內每個平日都有全市場資料，因此：
+      - 已確認到 S 的前一個平日 (含) 之後的股票，延伸確認到 day
+      - 尚無紀錄的股票，以 [S, day] 作為已確認範圍
+    :param rows: [(stock_id, Open, High, Low, Close, Volume), ...]；假日為空列表
+    :return: 寫入的筆數
+    """
+    with _connect(db_path) as conn:
+        conn.executemany('INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         [(stock_id, day.isoformat(), *values) for stock_id, *values in rows])
+        conn.execute('INSERT OR REPLACE INTO market_days VALUES (?, ?, ?)',
+                     (day.isoformat(), len(rows), datetime.now(TAIPEI_TZ).strftime('%Y-%m-%d %H:%M:%S')))
+        run_start = _run_start(conn, day)
+        conn.execute('''
+            UPDATE coverage SET
+                checked_through = MAX(checked_through, ?),
+                start_date = MIN(start_date, ?)
+            WHERE checked_through >= ?
+        ''', (day.isoformat(), run_start.isoformat(), previous_weekday(run_start).isoformat()))
+        conn.executemany('INSERT OR IGNORE INTO coverage (stock_id, start_date, checked_through) VALUES (?, ?, ?)',
+                         [(stock_id, run_start.isoformat(), day.isoformat()) for stock_id, *_ in rows])
+    return len(rows)
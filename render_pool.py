@@ -0,0 +1,113 @@
+import io
+import os
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+# 繪圖行程池
+# 圖表繪製是 CPU 密集工作，在請求執行緒中執行會受 GIL 限制。
+# 此模組維持一組常駐的繪圖行程，每個行程啟動時只匯入一次 matplotlib / mplfinance、
+# 套用字型與樣式並預先解析字型，之後每個工作只需傳入「繪圖規格 + 資料」即可輸出 PNG。
+
+# 繪圖行程數量，可由環境變數 RENDER_WORKERS 調整；設為 0 表示停用行程池、直接在目前行程繪圖
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', str(os.cpu_count() or 1)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _warm_worker() -> None:
+    """繪圖行程的初始化：匯入繪圖模組並畫一張小圖，讓字型查找結果進入快取"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import stock_analyzer  # 套用技術分析圖的字型設定
+    import stock_information_plot  # noqa: F401 (套用營收圖與大戶股權圖的字型設定)
+
+    fig, ax = plt.subplots(figsize=(1, 1))
+    ax.set_title('預熱')
+    fig.canvas.draw()
+    plt.close(fig)
+
+    if stock_analyzer.CHART_RENDER_MODE == 'fast':
+        # 預先建立技術分析圖範本，之後每個工作只需更新資料
+        import chart_template
+        chart_template.get_template()
+
+
+def _ping(_=None) -> int:
+    return os.getpid()
+
+
+def render_job(kind: str, spec: dict):
+    """
+    在繪圖行程中執行的工作
+    :param kind: 'tech'、'revenue' 或 'shareholders'
+    :param spec: 繪圖所需的資料與輸出路徑
+    :return: 成功時回傳 None，失敗時回傳錯誤訊息
+    """
+    if kind == 'tech':
+        from stock_analyzer import plot_analysis_chart
+        plot_analysis_chart(spec['price_data'], spec['indicators'], spec['title'], spec['save_path'])
+        return None
+    if kind == 'revenue':
+        from stock_information_plot import plot_stock_revenue_trend
+        return plot_stock_revenue_trend(spec['stock_code'], spec['save_path'], revenue_data=spec['data'])
+    if kind == 'shareholders':
+        from stock_information_plot import plot_stock_major_shareholders
+        return plot_stock_major_shareholders(spec['stock_code'], spec['save_path'], shareholder_data=spec['data'])
+    return f"錯誤: 不支援的圖表類型 '{kind}'"
+
+
+def render_png_job(kind: str, spec: dict) -> tuple:
+    """
+    在繪圖行程中把圖表繪製到記憶體 (不寫入檔案)
+    :return: (PNG bytes, 錯誤訊息)；成功時錯誤訊息為 None，失敗時 PNG bytes 為 None
+    """
+    buffer = io.BytesIO()
+    error_msg = render_job(kind, dict(spec, save_path=buffer))
+    if error_msg:
+        return None, error_msg
+    return buffer.getvalue(), None
+
+
+def get_render_pool():
+    """
+    取得共用的繪圖行程池 (第一次呼叫時建立並讓所有行程完成預熱)
+    :return: ProcessPoolExecutor；RENDER_WORKERS 為 0 時回傳 None
+    """
+    global _pool
+    if RENDER_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # 使用 spawn 避免在多執行緒的 Flask 行程中 fork，並與 Windows 行為一致
+                pool = ProcessPoolExecutor(
+                    max_workers=RENDER_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_warm_worker,
+                )
+                print(f"啟動 {RENDER_WORKERS} 個繪圖行程並預熱中...")
+                list(pool.map(_ping, range(RENDER_WORKERS)))
+                _pool = pool
+    return _pool
+
+
+def submit_render(kind: str, spec: dict, in_memory: bool = False):
+    """
+    送出繪圖工作
+    :param in_memory: True 時忽略 spec 的 save_path，Future 結果為 render_png_job 的 (PNG bytes, 錯誤訊息)
+    :return: concurrent.futures.Future；停用行程池時回傳已完成的 Future
+    """
+    job = render_png_job if in_memory else render_job
+    pool = get_render_pool()
+    if pool is not None:
+        return pool.submit(job, kind, spec)
+
+    future = Future()
+    try:
+        future.set_result(job(kind, spec))
+    except Exception as e:
+        future.set_exception(e)
+    return future
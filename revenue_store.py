@@ -0,0 +1,204 @@
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from price_store import TAIPEI_TZ
+
+# 本地月營收資料庫 (SQLite)
+# 以 (stock_id, 營收年, 營收月) 為主鍵保存 TaiwanStockMonthRevenue，並記錄每檔股票最後確認的日期。
+# 上市櫃公司須於每月 PUBLICATION_DAY 日前公告上月營收，因此：
+#   - 已有上個月的營收：到下個月之前都不需再請求
+#   - 公告期間 (每月 1 日 ~ PUBLICATION_DAY 日) 尚未公告：每天最多確認一次
+#   - 公告期限已過仍未公告 (延遲或停止公告)：期限後確認過一次即不再請求
+# 另有整批預熱 (warm_up)：以一次不指定股票的查詢取得全市場最近一個月的營收，
+# 公告期間每天執行一次、期限過後再執行一次，已有本地資料的股票就不必逐檔確認。
+# 預熱由每日的全市場日K匯入工作排入 (background_jobs.REVENUE_WARM_UP)，籌碼集中度選股批量繪圖前也會先執行一次。
+
+DB_PATH = 'stock_revenue.db'
+
+# 月營收公告期限 (每月 10 日)
+PUBLICATION_DAY = 10
+
+
+@contextmanager
+def _connect(db_path: str = DB_PATH):
+    """建立資料庫連線並確保資料表存在，離開時提交並關閉連線"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS revenue (
+            stock_id TEXT NOT NULL,
+            revenue_year INTEGER NOT NULL,
+            revenue_month INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            revenue REAL,
+            PRIMARY KEY (stock_id, revenue_year, revenue_month)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS revenue_coverage (
+            stock_id TEXT PRIMARY KEY,
+            start_date TEXT NOT NULL,
+            checked_on TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS revenue_warmups (
+            checked_on TEXT PRIMARY KEY,
+            row_count INTEGER NOT NULL
+        )
+    ''')
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def today() -> date:
+    return datetime.now(TAIPEI_TZ).date()
+
+
+def _previous_month(day: date) -> tuple:
+    """day 的上一個月 (營收年, 營收月)"""
+    first = day.replace(day=1) - timedelta(days=1)
+    return first.year, first.month
+
+
+def in_publication_window(day: date = None) -> bool:
+    """是否在上月營收的公告期間內 (每月 1 日 ~ PUBLICATION_DAY 日)"""
+    return (day or today()).day <= PUBLICATION_DAY
+
+
+def is_fresh(latest_period, checked_on: date, day: date = None) -> bool:
+    """
+    本地資料是否不需向 FinMind 確認
+    :param latest_period: 已保存的最新營收月份 (營收年, 營收月)，沒有資料時為 None
+    :param checked_on: 最後確認日期
+    """
+    day = day or today()
+    if latest_period is not None and tuple(latest_period) >= _previous_month(day):
+        return True
+    if in_publication_window(day):
+        return checked_on >= day
+    return checked_on > day.replace(day=PUBLICATION_DAY)
+
+
+def missing_start(stock_id: str, start_date: date, db_path: str = DB_PATH):
+    """
+    計算需要向 FinMind 請求的起始日期
+    :return: 需要請求的起始日期 (從最後一筆已存營收的公告日隔天開始)；本地資料仍有效時回傳 None
+    """
+    with _connect(db_path) as conn:
+        row = conn.execute('SELECT start_date, checked_on FROM revenue_coverage WHERE stock_id = ?',
+                           (stock_id,)).fetchone()
+        latest = conn.execute('''
+            SELECT revenue_year, revenue_month, date FROM revenue WHERE stock_id = ?
+            ORDER BY revenue_year DESC, revenue_month DESC LIMIT 1
+        ''', (stock_id,)).fetchone()
+    if row is None or start_date < date.fromisoformat(row[0]):
+        return start_date
+    if is_fresh(latest[:2] if latest else None, date.fromisoformat(row[1])):
+        return None
+    if latest is None:
+        return start_date
+    return max(start_date, date.fromisoformat(latest[2]) + timedelta(days=1))
+
+
+def data_version(stock_id: str, db_path: str = DB_PATH) -> str:
+    """
+    此股票本地月營收的版本 (供圖表快取使用)：已保存的最新營收月份，只在新的月份寫入後才改變
+    尚需向 FinMind 確認時附加今天的日期，讓公告期間內每天第一次瀏覽時重新確認。
+    """
+    with _connect(db_path) as conn:
+        row = conn.execute('SELECT checked_on FROM revenue_coverage WHERE stock_id = ?', (stock_id,)).fetchone()
+        latest = conn.execute('SELECT revenue_year, revenue_month FROM revenue WHERE stock_id = ? '
+                              'ORDER BY revenue_year DESC, revenue_month DESC LIMIT 1', (stock_id,)).fetchone()
+    version = f'{latest[0]}-{latest[1]:02d}' if latest else 'missing'
+    if row is not None and is_fresh(latest, date.fromisoformat(row[0])):
+        return version
+    return f'{version}~{today().isoformat()}'
+
+
+def _rows(data_list: list) -> list:
+    return [
+        (str(item['stock_id']), int(item['revenue_year']), int(item['revenue_month']),
+         str(item['date'])[:10], None if item.get('revenue') is None else float(item['revenue']))
+        for item in data_list
+        if item.get('stock_id') is not None and item.get('revenue_year') is not None
+    ]
+
+
+def save_revenue(stock_id: str, data_list: list, start_date: date, db_path: str = DB_PATH) -> None:
+    """
+    寫入單一股票的月營收 (重複的月份會覆蓋) 並更新已確認的範圍
+    :param data_list: FinMind API 回傳的 data 列表 (可為空)
+    :param start_date: 本次請求的起始日期
+    """
+    with _connect(db_path) as conn:
+        conn.executemany('INSERT OR REPLACE INTO revenue VALUES (?, ?, ?, ?, ?)', _rows(data_list))
+        conn.execute('''
+            INSERT INTO revenue_coverage (stock_id, start_date, checked_on) VALUES (?, ?, ?)
+            ON CONFLICT(stock_id) DO UPDATE SET
+                start_date = MIN(start_date, excluded.start_date),
+                checked_on = MAX(checked_on, excluded.checked_on)
+        ''', (stock_id, start_date.isoformat(), today().isoformat()))
+
+
+def load_revenue(stock_id: str, start_date: date, db_path: str = DB_PATH) -> list:
+    """讀取公告日在 start_date 之後的月營收，格式與 FinMind API 的 data 列表相同"""
+    with _connect(db_path) as conn:
+        rows = conn.execute('''
+            SELECT date, stock_id, revenue, revenue_year, revenue_month FROM revenue
+            WHERE stock_id = ? AND date >= ? ORDER BY date
+        ''', (stock_id, start_date.isoformat())).fetchall()
+    return [dict(zip(('date', 'stock_id', 'revenue', 'revenue_year', 'revenue_month'), row)) for row in rows]
+
+
+def warm_up_due(day: date = None, db_path: str = DB_PATH) -> bool:
+    """
+    是否需要整批預熱：公告期間內每天一次；公告期限過後再執行一次，
+    讓仍未公告的股票在下個月之前都不必逐檔確認
+    """
+    day = day or today()
+    since = day if in_publication_window(day) else day.replace(day=PUBLICATION_DAY + 1)
+    with _connect(db_path) as conn:
+        return conn.execute('SELECT 1 FROM revenue_warmups WHERE checked_on >= ?',
+                            (since.isoformat(),)).fetchone() is None
+
+
+def save_market_revenue(data_list: list, db_path: str = DB_PATH) -> int:
+    """
+    寫入全市場的月營收 (整批預熱的結果)
+    只有回應中出現的股票視為今天確認過；回應中沒有的股票 (尚未公告，或 FinMind 暫時回傳不完整的結果)
+    仍會逐檔確認。回應為空時不寫入任何紀錄，下次仍會重新預熱。
+    尚無資料的股票仍會在第一次查詢時補齊完整區間。
+    :return: 寫入的筆數
+    """
+    rows = _rows(data_list)
+    if not rows:
+        return 0
+    checked_on = today().isoformat()
+    stock_ids = sorted({row[0] for row in rows})
+    with _connect(db_path) as conn:
+        conn.executemany('INSERT OR REPLACE INTO revenue VALUES (?, ?, ?, ?, ?)', rows)
+        conn.executemany('UPDATE revenue_coverage SET checked_on = MAX(checked_on, ?) WHERE stock_id = ?',
+                         [(checked_on, stock_id) for stock_id in stock_ids])
+        conn.execute('INSERT OR REPLACE INTO revenue_warmups VALUES (?, ?)', (checked_on, len(rows)))
+    return len(rows)
+
+
+def warm_up(client, force: bool = False, db_path: str = DB_PATH) -> int:
+    """
+    以一次不指定股票的 TaiwanStockMonthRevenue 查詢取得全市場本月公告的營收
+    :param client: FinMindClient
+    :param force: 即使目前不需要 (warm_up_due) 也執行
+    :return: 寫入的筆數；不需執行時回傳 0
+    """
+    day = today()
+    if not force and not warm_up_due(day, db_path):
+        return 0
+    data_list = client.month_revenue_all(day.replace(day=1).isoformat())
+    count = save_market_revenue(data_list, db_path)
+    print(f"月營收整批預熱完成，共 {count} 筆。" if count else "全市場月營收查詢沒有回傳資料，稍後重新預熱。")
+    return count
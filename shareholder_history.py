@@ -0,0 +1,198 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# 大戶股權歷史資料庫 (SQLite，只增不刪)
+# 網站每次只提供最近約 12 週的資料，大戶股權.csv 每週會被整份覆蓋。
+# 每次抓取後把各週資料合併進此資料庫，以 (週, 代碼) 去除重複 (同一週以最新抓取的值為準)，
+# 累積多年的週資料，圖表與篩選可查詢任意日期區間而不必重新抓取。
+# holdings 以 (week, code) 為主鍵的 WITHOUT ROWID 表，資料依週聚集存放 (依週分區)；
+# 另以 (code, week) 索引支援單一股票的區間查詢。
+# 圖表預設顯示的完整歷史另以 (股票 × 週) 矩陣保留在記憶體中，只在 大戶股權.csv 更新 (合併新的週資料) 後重新讀取。
+
+DB_PATH = 'shareholders.db'
+
+# 已合併過的 大戶股權.csv 版本 (修改時間)，避免同一份資料重複合併
+_merged_mtimes = set()
+_merge_lock = threading.Lock()
+
+_history = None  # ((資料庫, 版本), 此版本是否已合併, ShareholderHistory)
+_history_lock = threading.Lock()
+
+
+@contextmanager
+def _connect(db_path: str = DB_PATH):
+    """建立資料庫連線並確保資料表存在，離開時提交並關閉連線"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS holdings (
+            week TEXT NOT NULL,
+            code TEXT NOT NULL,
+            ratio REAL NOT NULL,
+            PRIMARY KEY (week, code)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS holdings_code_week ON holdings (code, week)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stocks (
+            code TEXT PRIMARY KEY,
+            name TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS merges (
+            source_mtime REAL PRIMARY KEY,
+            merged_at TEXT NOT NULL,
+            row_count INTEGER NOT NULL
+        )
+    ''')
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def merge_snapshot(codes: list, names: list, weeks: list, values: np.ndarray,
+                   source_mtime: float = None, db_path: str = DB_PATH) -> int:
+    """
+    把一次抓取的結果合併進歷史資料庫
+    :param codes: 股票代碼
+    :param names: 股票名稱
+    :param weeks: 週資料日期字串 ('YYYY-MM-DD')
+    :param values: (股票數 × 週數) 的大戶持股比例，NaN 表示缺值 (不寫入)
+    :param source_mtime: 來源 CSV 的修改時間 (記錄已合併的版本)
+    :return: 寫入的筆數
+    """
+    rows_idx, cols_idx = np.nonzero(~np.isnan(values))
+    rows = [(weeks[c], codes[r], float(values[r, c])) for r, c in zip(rows_idx, cols_idx)]
+    with _connect(db_path) as conn:
+        conn.executemany('INSERT OR REPLACE INTO holdings (week, code, ratio) VALUES (?, ?, ?)', rows)
+        conn.executemany('INSERT OR REPLACE INTO stocks (code, name) VALUES (?, ?)', list(zip(codes, names)))
+        if source_mtime is not None:
+            conn.execute('INSERT OR REPLACE INTO merges VALUES (?, ?, ?)',
+                         (source_mtime, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), len(rows)))
+    return len(rows)
+
+
+def merge_store(store, db_path: str = DB_PATH) -> int:
+    """
+    把目前的大戶股權資料 (shareholder_store.ShareholderStore) 合併進歷史資料庫 (同一版本只合併一次)
+    :return: 寫入的筆數；已合併過時回傳 0
+    """
+    with _merge_lock:
+        if store.mtime in _merged_mtimes:
+            return 0
+        with _connect(db_path) as conn:
+            merged = conn.execute('SELECT 1 FROM merges WHERE source_mtime = ?', (store.mtime,)).fetchone()
+        count = 0
+        if merged is None:
+            count = merge_snapshot(store.codes, store.names, list(store.date_labels), store.values,
+                                   source_mtime=store.mtime, db_path=db_path)
+            print(f"大戶股權歷史資料已合併 {count} 筆 ({len(store.date_labels)} 週)。")
+        _merged_mtimes.add(store.mtime)
+    return count
+
+
+def load_series(code: str, start_date: str = None, end_date: str = None, db_path: str = DB_PATH):
+    """
+    查詢單一股票在日期區間內的大戶股權
+    :param start_date: 起始日期 ('YYYY-MM-DD')，None 表示不限
+    :param end_date: 結束日期 ('YYYY-MM-DD')，None 表示不限
+    :return: {'code', 'name', 'dates': 日期字串陣列, 'values': 持股比例陣列}；沒有資料時回傳 None
+    """
+    with _connect(db_path) as conn:
+        rows = conn.execute(
+            'SELECT week, ratio FROM holdings WHERE code = ? AND week >= ? AND week <= ? ORDER BY week',
+            (str(code), start_date or '0000-00-00', end_date or '9999-99-99')).fetchall()
+        name_row = conn.execute('SELECT name FROM stocks WHERE code = ?', (str(code),)).fetchone()
+    if not rows:
+        return None
+    return {
+        'code': str(code),
+        'name': name_row[0] if name_row else str(code),
+        'dates': np.array([week for week, _ in rows]),
+        'values': np.array([ratio for _, ratio in rows], dtype=float),
+    }
+
+
+class ShareholderHistory:
+    """歷史資料庫中所有股票的完整大戶股權 (股票 × 週)，缺值為 NaN"""
+
+    def __init__(self, matrix: pd.DataFrame, names: dict) -> None:
+        """
+        :param matrix: load_matrix 的結果 (index 為週、欄位為股票代碼)
+        :param names: {代碼: 名稱}
+        """
+        self.date_labels = np.array(matrix.index.strftime('%Y-%m-%d').tolist(), dtype=str)
+        self.values = matrix.to_numpy(dtype=float).T.copy()
+        self.names = names
+        self._rows = {str(code): row for row, code in enumerate(matrix.columns)}
+
+    def series(self, code: str):
+        """與 load_series 相同格式的完整歷史；沒有資料時回傳 None"""
+        row = self._rows.get(str(code))
+        if row is None:
+            return None
+        values = self.values[row]
+        valid = ~np.isnan(values)
+        return {
+            'code': str(code),
+            'name': self.names.get(str(code), str(code)),
+            'dates': self.date_labels[valid],
+            'values': values[valid],
+        }
+
+
+def get_history(version, db_path: str = DB_PATH) -> ShareholderHistory:
+    """
+    取得記憶體中的完整歷史；version 改變時 (大戶股權.csv 更新並合併後) 重新讀取資料庫
+    CSV 已更新但背景工作尚未合併時先沿用資料庫內容，每次只查詢此版本是否已合併，合併後再重新讀取一次。
+    :param version: 資料版本 (目前 大戶股權.csv 的修改時間，沒有 CSV 時為 None)
+    """
+    global _history
+    cached = _history
+    if cached is not None and cached[0] == (db_path, version) and cached[1]:
+        return cached[2]
+    with _history_lock:
+        cached = _history
+        with _connect(db_path) as conn:
+            merged = version is None or conn.execute('SELECT 1 FROM merges WHERE source_mtime = ?',
+                                                     (version,)).fetchone() is not None
+            if cached is not None and cached[0] == (db_path, version) and cached[1] == merged:
+                return cached[2]
+            names = dict(conn.execute('SELECT code, name FROM stocks').fetchall())
+        cached = ((db_path, version), merged, ShareholderHistory(load_matrix(db_path=db_path), names))
+        _history = cached
+    return cached[2]
+
+
+def load_matrix(start_date: str = None, end_date: str = None, codes: list = None,
+                db_path: str = DB_PATH) -> pd.DataFrame:
+    """
+    查詢日期區間內的大戶股權矩陣，供跨週篩選使用
+    :param codes: 只查詢這些股票，None 表示全部
+    :return: index 為週 (DatetimeIndex)、欄位為股票代碼的 DataFrame
+    """
+    query = 'SELECT week, code, ratio FROM holdings WHERE week >= ? AND week <= ?'
+    params = [start_date or '0000-00-00', end_date or '9999-99-99']
+    if codes:
+        query += f" AND code IN ({','.join('?' * len(codes))})"
+        params += [str(code) for code in codes]
+    with _connect(db_path) as conn:
+        data = pd.read_sql_query(query, conn, params=params)
+    matrix = data.pivot(index='week', columns='code', values='ratio')
+    matrix.index = pd.to_datetime(matrix.index)
+    matrix.columns.name = None
+    return matrix.sort_index()
+
+
+def weeks(db_path: str = DB_PATH) -> list:
+    """歷史資料庫中所有的週資料日期"""
+    with _connect(db_path) as conn:
+        return [row[0] for row in conn.execute('SELECT DISTINCT week FROM holdings ORDER BY week')]
@@ -0,0 +1,115 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+# 大戶股權資料的共用記憶體儲存
+# 大戶股權.csv 只在啟動或檔案更新後讀取一次：日期欄位預先解析並排序，
+# 持股比例轉為 (股票數 × 週數) 的 float 陣列，並以代碼建立列索引。
+# 查詢單一股票只需一次 dict 查找與陣列切片，不必每次重新讀取與解析整個 CSV。
+
+SHAREHOLDERS_CSV = '大戶股權.csv'
+
+
+class ShareholderStore:
+    def __init__(self, codes: list, names: list, dates: pd.DatetimeIndex, values: np.ndarray, mtime: float) -> None:
+        """
+        :param codes: 股票代碼 (依檔案順序)
+        :param names: 股票名稱
+        :param dates: 已排序的週資料日期
+        :param values: (股票數 × 週數) 的大戶持股比例，缺值為 NaN
+        :param mtime: 讀取時 CSV 的修改時間
+        """
+        self.codes = codes
+        self.names = names
+        self.dates = dates
+        self.date_labels = np.array(dates.strftime('%Y-%m-%d'))
+        self.values = values
+        self.mtime = mtime
+        self._rows = {}
+        for row, code in enumerate(codes):
+            self._rows.setdefault(code, row)
+
+    @classmethod
+    def load(cls, csv_path: str = SHAREHOLDERS_CSV) -> 'ShareholderStore':
+        """讀取並解析 大戶股權.csv"""
+        mtime = os.path.getmtime(csv_path)
+        df = pd.read_csv(csv_path, dtype={'Code': str})
+        df = df.dropna(subset=['Code'])
+
+        # 只保留可解析為日期的欄位，並依日期排序
+        date_columns = df.columns[2:]
+        parsed = pd.to_datetime(pd.Series(date_columns), errors='coerce')
+        valid = parsed.notna().values
+        order = np.argsort(parsed[valid].values, kind='stable')
+        columns = date_columns[valid][order]
+        dates = pd.DatetimeIndex(parsed[valid].values[order])
+
+        values = df[columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+        codes = df['Code'].str.strip().tolist()
+        names = df['Name'].astype(str).str.strip().tolist()
+        return cls(codes, names, dates, values, mtime)
+
+    def __contains__(self, code) -> bool:
+        return str(code) in self._rows
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def name(self, code: str):
+        row = self._rows.get(str(code))
+        return None if row is None else self.names[row]
+
+    def series(self, code: str):
+        """
+        單一股票的大戶股權資料 (依日期排序、已去除缺值)
+        :return: {'code', 'name', 'dates': 日期字串陣列, 'values': 持股比例陣列}；找不到時回傳 None
+        """
+        row = self._rows.get(str(code))
+        if row is None:
+            return None
+        values = self.values[row]
+        valid = ~np.isnan(values)
+        return {
+            'code': self.codes[row],
+            'name': self.names[row],
+            'dates': self.date_labels[valid],
+            'values': values[valid],
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def reload(csv_path: str = SHAREHOLDERS_CSV):
+    """重新讀取 CSV 並以單一指派替換共用的儲存；檔案不存在或無法解析時回傳 None"""
+    global _store
+    with _store_lock:
+        try:
+            store = ShareholderStore.load(csv_path)
+        except FileNotFoundError:
+            store = None
+        except Exception as e:
+            print(f"讀取 '{csv_path}' 時發生錯誤: {e}")
+            store = None
+        _store = store
+    return store
+
+
+def get_store(csv_path: str = SHAREHOLDERS_CSV):
+    """
+    取得共用的大戶股權資料；尚未載入或 CSV 已更新時重新讀取
+    :return: ShareholderStore；CSV 不存在時回傳 None
+    """
+    store = _store
+    try:
+        mtime = os.path.getmtime(csv_path)
+    except OSError:
+        mtime = None
+    if mtime is None:
+        return None
+    if store is None or store.mtime != mtime:
+        store = reload(csv_path)
+    return store
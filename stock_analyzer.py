@@ -3,24 +3,41 @@ import matplotlib
 matplotlib.use('Agg')  # 【新增】設定 Matplotlib 後端為 Agg (必須在 pyplot 導入前)
 import matplotlib.pyplot as plt
 from matplotlib.font_manager import fontManager
-# 設定支援中文的字型 (例如：微軟正黑體)
-plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']
-plt.rcParams['axes.unicode_minus'] = False # 解決負號顯示問題
+from chart_fonts import apply_cjk_fonts
+# 設定支援中文的字型 (依序使用系統上存在的微軟正黑體、黑體或 Noto Sans CJK 等)
+apply_cjk_fonts(plt.rcParams)
 
 import requests # 新增導入 requests
-import twstock
 import pandas as pd
 import numpy as np
 import mplfinance as mpf
 from datetime import date, timedelta
+from functools import lru_cache
 import matplotlib.pyplot as plt
 from matplotlib.font_manager import fontManager
 import matplotlib.dates as mdates
 
+from indicator_engine import compute_indicators, compute_signals, column, stack_price_series, \
+    weighted_moving_average
+from indicator_state import IndicatorState
+import price_store
+import price_matrix
+from finmind_client import get_client
+from symbol_table import get_symbol_table
+import chart_template
+
 # 移除特定字型設定
 # # fontManager.addfont('TaipeiSansTCBeta-Regular.ttf')
 # # plt.rc('font', family='Taipei Sans TC Beta')
 
+# 圖表與前端資料從第 101 筆開始，避開指標暖身期的 NaN
+CHART_START_INDEX = 101
+
+# 儲存圖片時的繪圖模式，可由環境變數 CHART_RENDER_MODE 調整：
+# 'fast' 重複使用每個行程預先建立的圖表範本，只更新資料 (見 chart_template.py)；
+# 'mplfinance' 每次以 mplfinance 重新建立整張圖
+CHART_RENDER_MODE = os.getenv('CHART_RENDER_MODE', 'fast')
+
 class TaiwanStockAnalyzer:
     def __init__(self, stock_id: str, days: int = 300) -> None:
         """
@@ -34,55 +51,49 @@ class TaiwanStockAnalyzer:
         self.stock_name = self._get_stock_name()
         self.price_data: pd.DataFrame = pd.DataFrame()
         self.indicators = {}
-        # 從環境變數讀取 FinMind API token，如果未設定則為 None
-        self.finmind_api_token = os.getenv('FINMIND_API_TOKEN')
 
 
     def _get_stock_name(self) -> str:
-        """利用 twstock 取得股票名稱"""
-        try:
-            info = twstock.codes[self.stock_id]
-            return info.name
-        except KeyError:
-            # 如果 twstock 找不到，可以考慮未來從 FinMind API 獲取，或返回代碼本身
-            print(f"警告: 股票代碼 {self.stock_id} 在 twstock.codes 中未找到。將使用代碼作為名稱。")
+        """利用股票索引 (twstock + 大戶股權.csv) 取得股票名稱"""
+        name = get_symbol_table().name(self.stock_id)
+        if name is None:
+            # 如果索引中找不到，可以考慮未來從 FinMind API 獲取，或返回代碼本身
+            print(f"警告: 股票代碼 {self.stock_id} 在股票索引中未找到。將使用代碼作為名稱。")
             return self.stock_id
+        return name
 
     def fetch_data(self) -> None:
-        """從 FinMind API 抓取股票資料"""
-        print(f"正在從 FinMind API 抓取股票 {self.stock_id} 的資料...")
-        
-        finmind_url = "https://api.finmindtrade.com/api/v4/data"
-        
-        params = {
-            "dataset": "TaiwanStockPrice",
-            "data_id": self.stock_id,
-            "start_date": self.start_date.strftime('%Y-%m-%d'),
-            "end_date": date.today().strftime('%Y-%m-%d'), # FinMind 通常包含 end_date 當天
-        }
-        # 如果有 API token，則加入到 headers
-        headers = {}
-        if self.finmind_api_token:
-            headers["Authorization"] = f"Bearer {self.finmind_api_token}"
-            print("使用 FinMind API Token 進行驗證。")
+        """從本地日K資料讀取股票資料，只向 FinMind API 請求最後一筆之後尚未儲存的日期"""
+        matrix = price_matrix.get_matrix()
+        if matrix is not None and matrix.is_fresh(self.stock_id, self.start_date):
+            # 全市場日K矩陣已確認到最近交易日：直接使用 memmap 的 view，不查詢資料庫
+            self.price_data = matrix.prices(self.stock_id, self.start_date)
         else:
-            print("警告: 未設定 FINMIND_API_TOKEN 環境變數，將嘗試匿名存取 FinMind API。部分資料可能受限。")
+            fetch_start = price_store.missing_start(self.stock_id, self.start_date)
+            if fetch_start is None:
+                print(f"股票 {self.stock_id} 的本地日K已更新至最近交易日，不需請求 FinMind API。")
+            else:
+                new_data = self._fetch_from_finmind(fetch_start)
+                price_store.save_prices(self.stock_id, new_data, fetch_start)
+            self.price_data = price_store.load_prices(self.stock_id, self.start_date).dropna(subset=['Close'])
+        if self.price_data.empty:
+            raise ValueError(f"處理 FinMind API 資料時發生錯誤: 股票 {self.stock_id} 在指定日期範圍內沒有任何日K資料。")
 
+        print(f"成功取得 {self.stock_id} 的資料。共 {len(self.price_data)} 筆。")
 
+    def _fetch_from_finmind(self, start_date: date) -> pd.DataFrame:
+        """從 FinMind API 抓取指定日期之後的股票資料 (沒有新資料時回傳空的 DataFrame)"""
+        print(f"正在從 FinMind API 抓取股票 {self.stock_id} 自 {start_date} 起的資料...")
+        
         try:
-            response = requests.get(finmind_url, params=params, headers=headers, timeout=20)
-            response.raise_for_status() # 如果 HTTP 請求返回不成功的狀態碼，則拋出 HTTPError
-            
-            raw_data = response.json()
-            
-            if raw_data.get("status") != 200 and raw_data.get("msg") != "success": # FinMind API 成功時 status code 可能是 200，msg 是 "success"
-                error_message_from_api = raw_data.get('error_message', 'FinMind API 回傳錯誤，但未提供詳細訊息。')
-                status_code_from_api = raw_data.get('status_code', 'N/A')
-                raise ValueError(f"FinMind API 錯誤 (代碼: {status_code_from_api}): {error_message_from_api}")
-
-            data_list = raw_data.get('data')
+            data_list = get_client().price(
+                self.stock_id,
+                start_date.strftime('%Y-%m-%d'),
+                date.today().strftime('%Y-%m-%d'), # FinMind 通常包含 end_date 當天
+            )
             if not data_list:
-                raise ValueError(f"FinMind API 未回傳股票 {self.stock_id} 在指定日期範圍內的資料。")
+                print(f"FinMind API 未回傳股票 {self.stock_id} 自 {start_date} 起的新資料。")
+                return pd.DataFrame(columns=price_store.PRICE_COLUMNS, index=pd.DatetimeIndex([], name='Date'))
 
             data = pd.DataFrame(data_list)
             
@@ -118,12 +129,9 @@ class TaiwanStockAnalyzer:
             # Volume 可能需要除以 1000 如果是以「張」為單位，但 FinMind 的 TaiwanStockPrice 是「股」
             # data['Volume'] = data['Volume'] / 1000 # 如果 FinMind 回傳的是「股」而 yfinance 是「張」，則不需要此行
 
-            self.price_data = data.dropna(subset=['Close']) # 主要依賴 'Close' 是否有效
-            
-            if self.price_data.empty:
-                raise ValueError(f"股票 {self.stock_id} 從 FinMind API 取得資料後，在去除 'Close' 為空的資料後無剩餘數據。")
-            
-            print(f"成功從 FinMind API 抓取並處理 {self.stock_id} 的資料。共 {len(self.price_data)} 筆。")
+            data = data.dropna(subset=['Close']) # 主要依賴 'Close' 是否有效
+            print(f"成功從 FinMind API 抓取並處理 {self.stock_id} 的資料。共 {len(data)} 筆。")
+            return data
 
         except requests.exceptions.RequestException as e:
             raise ValueError(f"連線 FinMind API 時發生錯誤: {e}")
@@ -132,274 +140,339 @@ class TaiwanStockAnalyzer:
         except Exception as e: # 捕捉其他未預期錯誤
             raise ValueError(f"抓取 FinMind API 資料時發生未預期錯誤: {type(e).__name__} - {e}")
 
+    def calculate_indicators(self) -> None:
+        """計算技術指標 (使用向量化指標引擎，不使用 TA-lib)"""
+        close = self.price_data['Close'].values
+        high = self.price_data['High'].values
+        low = self.price_data['Low'].values
+
+        indicators = compute_indicators(close, high, low)
+        self.indicators.update(column(indicators, 0))
+
     def calculate_weighted_moving_average(self, prices, period):
         """
         計算加權移動平均線 (WMA)
         WMA(N) = {(當期收盤價 x N) + [前期收盤價 x (N – 1)] + …… + 第N期收盤價 x 1} / 加權乘數的總和
-        加權乘數總和 = N + (N – 1) + (N – 2) + …… + 1 = N * (N + 1) / 2
 
         :param prices: 價格序列
         :param period: WMA 周期
-        :return: 加權移動平均值列表
+        :return: 加權移動平均值陣列 (前 period-1 筆為 NaN)
         """
-        result = np.zeros_like(prices, dtype=float)
-        result[:] = np.nan  # 初始化為 NaN
-
-        # 加權乘數總和: N + (N-1) + ... + 1 = N*(N+1)/2
-        weight_sum = period * (period + 1) / 2
-
-        for i in range(period - 1, len(prices)):
-            weighted_sum = 0
-            for j in range(period):
-                # 給最近的價格最高權重 (period)，給最早的價格最低權重 (1)
-                weight = period - j
-                weighted_sum += prices[i - j] * weight
-
-            result[i] = weighted_sum / weight_sum
+        return weighted_moving_average(prices, period)[:, 0]
 
-        return result
-
-    def _calculate_sma(self, data, period):
-        """計算簡單移動平均線"""
-        return pd.Series(data).rolling(window=period).mean().values
+    def calculate_signals(self) -> None:
+        """計算交易訊號 (階梯 I、乖離 J、多空 K、KD L)"""
+        self.indicators.update(compute_signals(self.indicators))
 
-    def _calculate_stochastic(self, high, low, close, k_period=9, k_slowing=3, d_period=3):
+    def append_bar(self, bar: pd.Series, state: IndicatorState) -> dict:
         """
-        計算 KD 指標
-        k_period: 計算%K的周期
-        k_slowing: %K緩衝期
-        d_period: 計算%D的周期
+        以增量指標狀態加入一根新的日K：更新 state 並把最新一筆指標與訊號接到 self.indicators 之後，不重算整段歷史
+        :param bar: 以日期為 name、含 High/Low/Close 的資料列
+        :param state: 與目前 price_data 同步的 IndicatorState (已包含此日期時不重複加入)
+        :return: 最新一筆的指標與訊號
         """
-        high_series = pd.Series(high)
-        low_series = pd.Series(low)
-        close_series = pd.Series(close)
-
-        # 計算 %K 原始值 (未平滑)
-        min_low = low_series.rolling(window=k_period).min()
-        max_high = high_series.rolling(window=k_period).max()
-        raw_k = 100 * ((close_series - min_low) / (max_high - min_low))
-
-        # 平滑 %K
-        k = raw_k.rolling(window=k_slowing).mean().values
+        if state.last_date is not None and str(bar.name)[:10] <= state.last_date:
+            return state.latest
+        latest = state.update(bar.name, bar['High'], bar['Low'], bar['Close'])
+        self.price_data = pd.concat([self.price_data, bar.to_frame().T.astype(float)])
+        for key, value in latest.items():
+            self.indicators[key] = np.append(self.indicators.get(key, []), value)
+        return latest
 
-        # 計算 %D (對 %K 再次平滑)
-        d = pd.Series(k).rolling(window=d_period).mean().values
-
-        return k, d
-
-    def _calculate_macd(self, prices, fast_period=12, slow_period=26, signal_period=9):
+    def create_chart(self, save_path: str = None) -> None:
         """
-        計算 MACD 指標
-        fast_period: 快線週期
-        slow_period: 慢線週期
-        signal_period: 信號線週期
+        建立並顯示或儲存技術分析圖表
+        使用 mplfinance 的 make_addplot 來添加各個指標
         """
-        prices_series = pd.Series(prices)
+        plot_analysis_chart(self.price_data, self.indicators, f'{self.stock_name} ({self.stock_id})', save_path)
+
+@lru_cache(maxsize=None)
+def _mpf_style():
+    """技術分析圖的 mplfinance 樣式 (紅漲綠跌)"""
+    rc = {
+        'figure.figsize': (18, 18),  # 增加圖表高度以容納更多面板
+        'axes.labelsize': 12,
+        'xtick.labelsize': 10,
+        'ytick.labelsize': 10
+    }
+    apply_cjk_fonts(rc)
+    return mpf.make_mpf_style(
+        base_mpf_style='yahoo',
+        marketcolors=mpf.make_marketcolors(
+          up='red',     # 上漲 K 線顏色
+          down='green', # 下跌 K 線顏色
+          edge='inherit', # 繼承顏色
+          wick='inherit', # 繼承顏色
+          volume='inherit' # 繼承顏色
+        ),
+        rc=rc
+    )
+
+def plot_analysis_chart(price_data: pd.DataFrame, indicators: dict, title: str, save_path: str = None) -> None:
+    """
+    依日K與指標繪製技術分析圖表 (模組層級函式，可交給繪圖行程池執行)
+    :param price_data: 以日期為 index 的 OHLCV DataFrame
+    :param indicators: calculate_indicators / calculate_signals 產生的指標字典
+    :param title: 圖表標題
+    :param save_path: 圖片儲存路徑；None 時直接顯示
+    """
+    # 為避免指標計算出現 NaN，從資料中剔除前一段資料
+    start_idx = CHART_START_INDEX
+    chart_data = price_data.iloc[start_idx:].copy()
+
+    if save_path and CHART_RENDER_MODE == 'fast':
+        chart_indicators = {key: np.asarray(values, dtype=float)[start_idx:] for key, values in indicators.items()}
+        chart_template.get_template().render(chart_data, chart_indicators, title, save_path)
+        return
+
+    # 將各項指標轉為 Series，並對齊日期索引
+    series_dict = {}
+    for key, values in indicators.items():
+        series_dict[key] = pd.Series(values, index=price_data.index).iloc[start_idx:]
+
+    # 建立 addplot 列表
+    ap = []
+
+    # 添加移動平均線
+    ap.append(mpf.make_addplot(series_dict['sma5'], color='blue', width=1, panel=0, label='週線'))
+    ap.append(mpf.make_addplot(series_dict['sma20'], color='orange', width=1, panel=0, label='月線'))
+    ap.append(mpf.make_addplot(series_dict['sma60'], color='red', width=1, panel=0, label='季線'))
+
+    # 添加 KD 指標 (panel=2)
+    ap.append(mpf.make_addplot(series_dict['k'], color='red', width=1, panel=2, label='K值'))
+    ap.append(mpf.make_addplot(series_dict['d'], color='green', width=1, panel=2, label='D值'))
+    ap.append(mpf.make_addplot(series_dict['L_value'], type='scatter', color='blue', panel=2, label='KD信號'))
+
+    # 添加乖離率 (panel=3)
+    ap.append(mpf.make_addplot(series_dict['dev_5_20'], color='red', width=1, panel=3, label='週-月'))
+    ap.append(mpf.make_addplot(series_dict['dev_20_60'], color='green', width=1, panel=3, label='月-季'))
+    ap.append(mpf.make_addplot(series_dict['dev_5_60'], color='orange', width=1, panel=3, label='週-季'))
+
+    # 添加信號 (panel=4)
+    ap.append(mpf.make_addplot(series_dict['I_value'], type='bar', color='red', width=1, panel=4, label='階梯信號'))
+    ap.append(mpf.make_addplot(series_dict['J_value'], type='scatter', color='blue', panel=4, label='乖離信號'))
+    ap.append(mpf.make_addplot(series_dict['K_value'], color='orange', width=2, panel=4, label='多空信號'))
+
+    # 添加 MACD 指標 (panel=5)
+    ap.append(mpf.make_addplot(series_dict['macd'], color='blue', width=1, panel=5, label='MACD'))
+    ap.append(mpf.make_addplot(series_dict['macd_signal'], color='red', width=1, panel=5, label='Signal'))
+
+    # 修改 MACD 柱狀圖，將正值設為紅色，負值設為綠色
+    # 創建正值和負值的 Series
+    macd_hist_pos = series_dict['macd_hist'].copy()
+    macd_hist_neg = series_dict['macd_hist'].copy()
+
+    # 將負值設為 NaN 在正值 Series 中，將正值設為 NaN 在負值 Series 中
+    macd_hist_pos[macd_hist_pos <= 0] = np.nan
+    macd_hist_neg[macd_hist_neg > 0] = np.nan
+
+    # 分別添加正值（紅色）和負值（綠色）柱狀圖
+    ap.append(mpf.make_addplot(macd_hist_pos, type='bar', color='red', width=0.7, panel=5, label='Histogram (+)'))
+    ap.append(mpf.make_addplot(macd_hist_neg, type='bar', color='green', width=0.7, panel=5, label='Histogram (-)'))
+
+    # 添加WMA指標 (panel=6)
+    ap.append(mpf.make_addplot(series_dict['wma5'], color='red', width=1.5, panel=6, label='5WMA'))
+    ap.append(mpf.make_addplot(series_dict['wma10'], color='green', width=1.5, panel=6, label='10WMA'))
+
+    # 圖表樣式每個行程只建立一次
+    style = _mpf_style()
+
+    if save_path:
+        # 如果要儲存圖片，不使用 returnfig
+        mpf.plot(
+            chart_data,
+            type='candle',
+            addplot=ap,
+            volume=True,
+            panel_ratios=(40, 15, 15, 15, 15, 15, 15),  # 調整面板比例以包含兩個新面板
+            style=style,
+            title=title,
+            show_nontrading=False,
+            xrotation=90,
+            figscale=2.0,
+            savefig=save_path
+        )
+        plt.close()
+    else:
+        # 如果要顯示圖片，使用 returnfig
+        fig, axlist = mpf.plot(
+            chart_data,
+            type='candle',
+            addplot=ap,
+            volume=True,
+            panel_ratios=(40, 15, 15, 15, 15, 15, 15),  # 調整面板比例以包含兩個新面板
+            style=style,
+            title=title,
+            show_nontrading=False,
+            xrotation=90,
+            figscale=2.0,
+            returnfig=True
+        )
 
-        # 計算快線 EMA
-        ema_fast = prices_series.ewm(span=fast_period, adjust=False).mean()
+        # 設定所有子圖的日期格式和旋轉角度
+        for ax in axlist:
+            ax.tick_params(axis='x', rotation=90)
 
-        # 計算慢線 EMA
-        ema_slow = prices_series.ewm(span=slow_period, adjust=False).mean()
+        plt.show()
 
-        # 計算 MACD 線
-        macd = ema_fast - ema_slow
+def _save_analysis_chart(analyzer: TaiwanStockAnalyzer, save_path: str = None) -> str:
+    """將分析結果繪製成圖並存到 static 資料夾 (或指定路徑)，回傳網頁引用的相對路徑"""
+    if save_path:
+        print(f"產生圖表並儲存至: {save_path}")
+        analyzer.create_chart(save_path=save_path)
+        return save_path.replace('\\', '/')
 
-        # 計算信號線 (MACD 的 EMA)
-        signal = macd.ewm(span=signal_period, adjust=False).mean()
+    # 設定儲存路徑到 static 資料夾
+    static_folder = 'static'
+    if not os.path.exists(static_folder):
+        os.makedirs(static_folder) # 如果 static 資料夾不存在則建立
 
-        # 計算柱狀圖
-        histogram = macd - signal
+    # 使用固定的檔名格式，方便網頁引用
+    image_filename = f"stock_analysis_{analyzer.stock_id}.png"
+    save_image_path = os.path.join(static_folder, image_filename)
 
-        return macd.values, signal.values, histogram.values
+    print(f"產生圖表並儲存至: {save_image_path}")
+    analyzer.create_chart(save_path=save_image_path) # 強制儲存
 
-    def calculate_indicators(self) -> None:
-        """計算技術指標 (不使用 TA-lib)"""
-        close = self.price_data['Close'].values
-        high = self.price_data['High'].values
-        low = self.price_data['Low'].values
+    # 回傳相對於網頁根目錄的路徑
+    return os.path.join('static', image_filename).replace('\\', '/') # 確保路徑分隔符為 /
 
-        # 計算簡單移動平均線 (SMA)
-        self.indicators['sma5'] = self._calculate_sma(close, 5)
-        self.indicators['sma20'] = self._calculate_sma(close, 20)
-        self.indicators['sma60'] = self._calculate_sma(close, 60)
+def indicator_payload(analyzer: TaiwanStockAnalyzer, float32: bool = False) -> dict:
+    """
+    將日K、技術指標與交易訊號整理為欄式 (columnar) 資料，供前端直接繪圖
+    與技術分析圖相同，從第 CHART_START_INDEX 筆開始輸出；NaN 以 null 表示。
+    :param analyzer: 已完成 calculate_indicators / calculate_signals 的分析器
+    :param float32: True 時數值只保留 float32 精度 (約 7 位有效數字)，縮小傳輸量
+    :return: {'code', 'name', 'dates': [...], 'columns': {欄位名稱: [...]}}
+    """
+    price_data = analyzer.price_data.iloc[CHART_START_INDEX:]
+    columns = {name.lower(): price_data[name].values for name in ['Open', 'High', 'Low', 'Close', 'Volume']}
+    for key, values in analyzer.indicators.items():
+        columns[key] = np.asarray(values, dtype=float)[CHART_START_INDEX:]
+
+    def to_list(values):
+        if float32:
+            # 以 float32 的最短表示法輸出，例如 12.3 而不是 12.300000190734863
+            return [None if np.isnan(v) else float(str(v)) for v in np.asarray(values, dtype=np.float32)]
+        return [None if np.isnan(v) else v for v in np.asarray(values, dtype=float).tolist()]
+
+    return {
+        'code': analyzer.stock_id,
+        'name': analyzer.stock_name,
+        'dates': price_data.index.strftime('%Y-%m-%d').tolist(),
+        'columns': {name: to_list(values) for name, values in columns.items()},
+    }
+
+def fetch_analyzer(stock_id: str, days: int = 300) -> TaiwanStockAnalyzer:
+    """建立分析器並抓取資料 (只涉及網路與資料庫 I/O，可在執行緒中並行呼叫)"""
+    analyzer = TaiwanStockAnalyzer(stock_id, days)
+    print(f"正在抓取 {stock_id} ({analyzer.stock_name}) 的資料...")
+    analyzer.fetch_data()
+    return analyzer
+
+def render_analyzers(analyzers: list, save_paths: dict = None) -> dict:
+    """
+    以向量化指標引擎一次計算已抓取資料的所有股票的指標與訊號，再逐檔繪圖。
+    :param analyzers: 已完成 fetch_data 的 TaiwanStockAnalyzer 列表
+    :param save_paths: 以股票代碼為鍵的圖表儲存路徑；未指定的股票儲存到 static 資料夾
+    :return: 以股票代碼為鍵的字典，值為圖片相對路徑或錯誤訊息。
+    """
+    compute_batch_indicators(analyzers)
 
-        # 計算 KD 指標
-        self.indicators['k'], self.indicators['d'] = self._calculate_stochastic(high, low, close)
+    save_paths = save_paths or {}
+    results = {}
+    for analyzer in analyzers:
+        try:
+            results[analyzer.stock_id] = _save_analysis_chart(analyzer, save_paths.get(analyzer.stock_id))
+        except Exception as e:
+            results[analyzer.stock_id] = f"分析過程發生錯誤 ({analyzer.stock_id}): {str(e)}"
+            print(results[analyzer.stock_id])
 
-        # 計算均線間的乖離百分比
-        self.indicators['dev_5_20'] = (self.indicators['sma5'] - self.indicators['sma20']) / self.indicators['sma20'] * 100
-        self.indicators['dev_20_60'] = (self.indicators['sma20'] - self.indicators['sma60']) / self.indicators['sma60'] * 100
-        self.indicators['dev_5_60'] = (self.indicators['sma5'] - self.indicators['sma60']) / self.indicators['sma60'] * 100
-        self.indicators['dev_1_20'] = (close - self.indicators['sma20']) / self.indicators['sma20'] * 100
+    return results
 
-        # 計算 MACD 指標
-        self.indicators['macd'], self.indicators['macd_signal'], self.indicators['macd_hist'] = self._calculate_macd(close)
+def compute_batch_indicators(analyzers: list) -> None:
+    """
+    以向量化指標引擎一次計算已抓取資料的所有股票的指標與訊號，寫回各分析器。
+    增量指標狀態不在此保存，由 refresh_indicator_states 在背景工作中更新。
+    :param analyzers: 已完成 fetch_data 的 TaiwanStockAnalyzer 列表
+    """
+    if not analyzers:
+        return
+
+    print(f"以向量化引擎計算 {len(analyzers)} 檔股票的技術指標與交易訊號中...")
+    price_frames = [analyzer.price_data for analyzer in analyzers]
+    indicators = compute_indicators(
+        stack_price_series([frame['Close'].values for frame in price_frames]),
+        stack_price_series([frame['High'].values for frame in price_frames]),
+        stack_price_series([frame['Low'].values for frame in price_frames]),
+    )
+    signals = compute_signals(indicators)
+    for col, analyzer in enumerate(analyzers):
+        length = len(analyzer.price_data)
+        analyzer.indicators.update(column(indicators, col, length))
+        analyzer.indicators.update(column(signals, col, length))
+
+def analyze_stocks(stock_ids: list, days: int = 300, save_paths: dict = None) -> dict:
+    """
+    批次分析多檔股票：逐檔抓取資料後，以向量化指標引擎一次計算所有股票的指標與訊號，再逐檔繪圖。
+    :param stock_ids: 股票代碼列表
+    :param days: 分析期間天數
+    :param save_paths: 以股票代碼為鍵的圖表儲存路徑；未指定的股票儲存到 static 資料夾
+    :return: 以股票代碼為鍵的字典，值為圖片相對路徑或錯誤訊息。
+    """
+    results = {}
+    analyzers = []
+    for stock_id in stock_ids:
+        try:
+            analyzers.append(fetch_analyzer(stock_id, days))
+        except Exception as e:
+            results[stock_id] = f"分析過程發生錯誤 ({stock_id}): {str(e)}"
+            print(results[stock_id])
 
-        # 計算週線指標 (5WMA 和 10WMA)
-        self.indicators['wma5'] = self.calculate_weighted_moving_average(close, 5)
-        self.indicators['wma10'] = self.calculate_weighted_moving_average(close, 10)
+    results.update(render_analyzers(analyzers, save_paths))
+    return results
 
-    def calculate_signals(self) -> None:
-        """計算交易訊號"""
-        # 階梯訊號
-        self.indicators['I_value'] = self._calculate_stair_signal()
-
-        # 乖離訊號
-        self.indicators['J_value'] = self._calculate_deviation_signal()
-
-        # 趨勢訊號：若 dev_5_60 為正則為多頭 (3)，否則空頭 (-3)
-        self.indicators['K_value'] = [3 if dev >= 0 else -3 for dev in self.indicators['dev_5_60']]
-
-        # KD 訊號：當 K 值大於等於80時視為超買（100）；低於等於20則為超賣（0）；中間則不顯示
-        self.indicators['L_value'] = [100 if k >= 80 else (0 if k <= 20 else np.nan) for k in self.indicators['k']]
-
-    def _calculate_stair_signal(self) -> list:
-        """根據均線乖離計算階梯型態訊號"""
-        signals = []
-        for i in range(len(self.price_data)):
-            dev_5_20 = self.indicators['dev_5_20'][i]
-            dev_20_60 = self.indicators['dev_20_60'][i]
-            dev_5_60 = self.indicators['dev_5_60'][i]
-
-            if dev_5_20 >= dev_5_60 and dev_5_60 >= dev_20_60:
-                signals.append(1)
-            elif dev_5_60 >= dev_5_20 and dev_5_20 >= dev_20_60:
-                signals.append(2)
-            elif dev_5_60 >= dev_20_60 and dev_20_60 >= dev_5_20:
-                signals.append(3)
-            elif dev_20_60 >= dev_5_60 and dev_5_60 >= dev_5_20:
-                signals.append(-1)
-            elif dev_20_60 >= dev_5_20 and dev_5_20 >= dev_5_60:
-                signals.append(-2)
+def refresh_indicator_states(stock_ids: list = None, days: int = 300, progress=None) -> dict:
+    """
+    收盤後更新觀察清單的增量指標狀態：已有狀態的股票只補抓並加入最後一筆之後的新日K，
+    沒有狀態的股票才讀取完整資料建立狀態。由背景工作 (background_jobs.INDICATOR_REFRESH) 執行，
+    不在繪圖或 API 的請求中寫入狀態檔。
+    :param stock_ids: 股票代碼列表；None 時更新所有已保存狀態的股票
+    :param days: 建立新狀態時的資料天數
+    :param progress: 每檔完成後呼叫 progress(stock_id, done, total)
+    :return: 以股票代碼為鍵的字典，值為最新的指標與訊號，或錯誤訊息字串 (抓取失敗時不沿用舊狀態)。
+    """
+    if stock_ids is None:
+        stock_ids = IndicatorState.saved_ids()
+    latest_day = price_store.latest_trading_day()
+    results = {}
+    for done, stock_id in enumerate(stock_ids, start=1):
+        try:
+            state = IndicatorState.load(stock_id)
+            if state is not None and date.fromisoformat(state.last_date) >= latest_day:
+                results[stock_id] = state.latest  # 已包含最近交易日，不需查詢
             else:
-                signals.append(-3)
-        return signals
-
-    def _calculate_deviation_signal(self) -> list:
-        """根據收盤價與月線乖離計算乖離訊號"""
-        return [4 if dev >= 5 else (-4 if dev <= -5 else np.nan)
-                for dev in self.indicators['dev_1_20']]
-
-    def create_chart(self, save_path: str = None) -> None:
-        """
-        建立並顯示或儲存技術分析圖表
-        使用 mplfinance 的 make_addplot 來添加各個指標
-        """
-        # 為避免指標計算出現 NaN，從資料中剔除前一段資料
-        start_idx = 101
-        price_data = self.price_data.iloc[start_idx:].copy()
-
-        # 將各項指標轉為 Series，並對齊日期索引
-        series_dict = {}
-        for key, values in self.indicators.items():
-            series_dict[key] = pd.Series(values, index=self.price_data.index).iloc[start_idx:]
-
-        # 建立 addplot 列表
-        ap = []
-
-        # 添加移動平均線
-        ap.append(mpf.make_addplot(series_dict['sma5'], color='blue', width=1, panel=0, label='週線'))
-        ap.append(mpf.make_addplot(series_dict['sma20'], color='orange', width=1, panel=0, label='月線'))
-        ap.append(mpf.make_addplot(series_dict['sma60'], color='red', width=1, panel=0, label='季線'))
-
-        # 添加 KD 指標 (panel=2)
-        ap.append(mpf.make_addplot(series_dict['k'], color='red', width=1, panel=2, label='K值'))
-        ap.append(mpf.make_addplot(series_dict['d'], color='green', width=1, panel=2, label='D值'))
-        ap.append(mpf.make_addplot(series_dict['L_value'], type='scatter', color='blue', panel=2, label='KD信號'))
-
-        # 添加乖離率 (panel=3)
-        ap.append(mpf.make_addplot(series_dict['dev_5_20'], color='red', width=1, panel=3, label='週-月'))
-        ap.append(mpf.make_addplot(series_dict['dev_20_60'], color='green', width=1, panel=3, label='月-季'))
-        ap.append(mpf.make_addplot(series_dict['dev_5_60'], color='orange', width=1, panel=3, label='週-季'))
-
-        # 添加信號 (panel=4)
-        ap.append(mpf.make_addplot(series_dict['I_value'], type='bar', color='red', width=1, panel=4, label='階梯信號'))
-        ap.append(mpf.make_addplot(series_dict['J_value'], type='scatter', color='blue', panel=4, label='乖離信號'))
-        ap.append(mpf.make_addplot(series_dict['K_value'], color='orange', width=2, panel=4, label='多空信號'))
-
-        # 添加 MACD 指標 (panel=5)
-        ap.append(mpf.make_addplot(series_dict['macd'], color='blue', width=1, panel=5, label='MACD'))
-        ap.append(mpf.make_addplot(series_dict['macd_signal'], color='red', width=1, panel=5, label='Signal'))
-
-        # 修改 MACD 柱狀圖，將正值設為紅色，負值設為綠色
-        # 創建正值和負值的 Series
-        macd_hist_pos = series_dict['macd_hist'].copy()
-        macd_hist_neg = series_dict['macd_hist'].copy()
-
-        # 將負值設為 NaN 在正值 Series 中，將正值設為 NaN 在負值 Series 中
-        macd_hist_pos[macd_hist_pos <= 0] = np.nan
-        macd_hist_neg[macd_hist_neg > 0] = np.nan
-
-        # 分別添加正值（紅色）和負值（綠色）柱狀圖
-        ap.append(mpf.make_addplot(macd_hist_pos, type='bar', color='red', width=0.7, panel=5, label='Histogram (+)'))
-        ap.append(mpf.make_addplot(macd_hist_neg, type='bar', color='green', width=0.7, panel=5, label='Histogram (-)'))
-
-        # 添加WMA指標 (panel=6)
-        ap.append(mpf.make_addplot(series_dict['wma5'], color='red', width=1.5, panel=6, label='5WMA'))
-        ap.append(mpf.make_addplot(series_dict['wma10'], color='green', width=1.5, panel=6, label='10WMA'))
-
-        # 設定圖表樣式
-        style = mpf.make_mpf_style(
-            base_mpf_style='yahoo',
-            marketcolors=mpf.make_marketcolors(
-              up='red',     # 上漲 K 線顏色
-              down='green', # 下跌 K 線顏色
-              edge='inherit', # 繼承顏色
-              wick='inherit', # 繼承顏色
-              volume='inherit' # 繼承顏色
-            ),
-            rc={
-                'font.family': 'sans-serif', # 使用上面設定的 sans-serif 字型
-                'font.sans-serif': ['Microsoft JhengHei'], # 再次確保字型設定
-                'axes.unicode_minus': False, # 解決負號顯示問題
-                'figure.figsize': (18, 18),  # 增加圖表高度以容納更多面板
-                'axes.labelsize': 12,
-                'xtick.labelsize': 10,
-                'ytick.labelsize': 10
-            }
-        )
-
-        # 設定圖表標題和各個面板的高度比例
-        title = f'{self.stock_name} ({self.stock_id})'
-
-        if save_path:
-            # 如果要儲存圖片，不使用 returnfig
-            mpf.plot(
-                price_data,
-                type='candle',
-                addplot=ap,
-                volume=True,
-                panel_ratios=(40, 15, 15, 15, 15, 15, 15),  # 調整面板比例以包含兩個新面板
-                style=style,
-                title=title,
-                show_nontrading=False,
-                xrotation=90,
-                figscale=2.0,
-                savefig=save_path
-            )
-            plt.close()
-        else:
-            # 如果要顯示圖片，使用 returnfig
-            fig, axlist = mpf.plot(
-                price_data,
-                type='candle',
-                addplot=ap,
-                volume=True,
-                panel_ratios=(40, 15, 15, 15, 15, 15, 15),  # 調整面板比例以包含兩個新面板
-                style=style,
-                title=title,
-                show_nontrading=False,
-                xrotation=90,
-                figscale=2.0,
-                returnfig=True
-            )
-
-            # 設定所有子圖的日期格式和旋轉角度
-            for ax in axlist:
-                ax.tick_params(axis='x', rotation=90)
-
-            plt.show()
+                analyzer = TaiwanStockAnalyzer(stock_id, days)
+                if state is None:
+                    analyzer.fetch_data()
+                    state = IndicatorState.from_price_data(stock_id, analyzer.price_data)
+                else:
+                    start_date = date.fromisoformat(state.last_date) + timedelta(days=1)
+                    fetch_start = price_store.missing_start(stock_id, start_date)
+                    if fetch_start is not None:
+                        price_store.save_prices(stock_id, analyzer._fetch_from_finmind(fetch_start), fetch_start)
+                    # 停牌等沒有新日K的情況是正常結果，不是錯誤
+                    bars = price_store.load_prices(stock_id, start_date).dropna(subset=['Close'])
+                    for _, bar in bars.iterrows():
+                        analyzer.append_bar(bar, state)
+                state.save()
+                results[stock_id] = state.latest
+        except Exception as e:
+            results[stock_id] = f"更新指標狀態時發生錯誤 ({stock_id}): {str(e)}"
+            print(results[stock_id])
+        if progress:
+            progress(stock_id, done, len(stock_ids))
+    return results
 
 def analyze_stock(stock_id: str, days: int = 300, save_path: str = None) -> str:
     """
@@ -409,31 +482,5 @@ def analyze_stock(stock_id: str, days: int = 300, save_path: str = None) -> str:
     :param save_path: 圖表儲存路徑。如果為 None，將儲存到 static 資料夾。
     :return: 成功時回傳圖片的相對路徑，失敗時回傳錯誤訊息。
     """
-    try:
-        analyzer = TaiwanStockAnalyzer(stock_id, days)
-        print(f"正在抓取 {stock_id} ({analyzer.stock_name}) 的資料...")
-        analyzer.fetch_data()
-        print("計算技術指標中...")
-        analyzer.calculate_indicators()
-        print("計算交易訊號中...")
-        analyzer.calculate_signals()
-
-        # 設定儲存路徑到 static 資料夾
-        static_folder = 'static'
-        if not os.path.exists(static_folder):
-            os.makedirs(static_folder) # 如果 static 資料夾不存在則建立
-
-        # 使用固定的檔名格式，方便網頁引用
-        image_filename = f"stock_analysis_{stock_id}.png"
-        save_image_path = os.path.join(static_folder, image_filename)
-
-        print(f"產生圖表並儲存至: {save_image_path}")
-        analyzer.create_chart(save_path=save_image_path) # 強制儲存
-
-        # 回傳相對於網頁根目錄的路徑
-        return os.path.join('static', image_filename).replace('\\', '/') # 確保路徑分隔符為 /
-
-    except Exception as e:
-        error_message = f"分析過程發生錯誤 ({stock_id}): {str(e)}"
-        print(error_message)
-        return error_message # 回傳錯誤訊息
\ No newline at end of file
+    save_paths = {stock_id: save_path} if save_path else None
+    return analyze_stocks([stock_id], days, save_paths)[stock_id]
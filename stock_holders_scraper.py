@@ -1,14 +1,49 @@
+import os
 import requests
 from bs4 import BeautifulSoup
 import pandas as pd
 import re
+import numpy as np
 from typing import Optional
 from datetime import datetime
-from io import StringIO
+from io import BytesIO, StringIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 大戶股權表格的欄位位置：第 4 欄為「代碼 名稱」，第 7~18 欄為最近 12 週的大戶持股比例
+CODE_COLUMN = 3
+VALUE_COLUMNS = range(6, 18)
+TABLE_CLASSES = {'display', 'dataTable', 'no-footer'}
+
+CODE_NAME_PATTERN = re.compile(r'(\d{4})\s*(.*)')
+
+STOCK_HOLDERS_URL = 'https://norway.twsthr.info/StockHoldersContinue.aspx'
+
+# 排名區間 (valuerank) 分段抓取：每段的排名數與同時抓取的段數，
+# 可由環境變數 SHAREHOLDER_SHARD_SIZE / SHAREHOLDER_FETCH_WORKERS 調整
+SHARD_SIZE = int(os.getenv('SHAREHOLDER_SHARD_SIZE', '500'))
+FETCH_WORKERS = int(os.getenv('SHAREHOLDER_FETCH_WORKERS', '6'))
+
+
+class TableLayoutError(Exception):
+    """表格結構與預期不符 (改用 BeautifulSoup + pandas.read_html 解析)"""
+
 
 class StockHoldersScraper:
-    def __init__(self):
-        self.url = 'https://norway.twsthr.info/StockHoldersContinue.aspx'
+    def __init__(self, url: str = STOCK_HOLDERS_URL, shard_size: int = SHARD_SIZE,
+                 max_workers: int = FETCH_WORKERS, timeout: int = 60):
+        """
+        :param url: 網站位址 (測試時可指向本地假伺服器)
+        :param shard_size: 每段抓取的排名數
+        :param max_workers: 同時抓取的段數 (也是連線池大小)
+        :param timeout: 單次請求逾時秒數
+        """
+        self.url = url
+        self.shard_size = shard_size
+        self.max_workers = max_workers
+        self.timeout = timeout
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36'
         }
@@ -22,17 +57,103 @@ class StockHoldersScraper:
             'valuerank': '1-3000',
             'display': '1'
         }
+        self.session = requests.Session()
+        retry = Retry(total=3, backoff_factor=1.0, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=['GET'], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
 
-    def fetch_data(self) -> Optional[str]:
-        """從網站獲取資料"""
+    def fetch_data(self, valuerank: str = None) -> Optional[str]:
+        """
+        從網站獲取資料
+        :param valuerank: 排名區間 (例如 '1-500')，None 表示 params 中的完整區間
+        """
+        params = dict(self.params, valuerank=valuerank) if valuerank else self.params
         try:
-            response = requests.get(self.url, headers=self.headers, params=self.params)
+            response = self.session.get(self.url, headers=self.headers, params=params, timeout=self.timeout)
+            response.raise_for_status()
             response.encoding = 'utf-8'
             return response.text
         except requests.RequestException as e:
-            print(f"抓取資料時發生錯誤: {e}")
+            print(f"抓取資料時發生錯誤 ({params['valuerank']}): {e}")
             return None
 
+    def rank_range(self) -> tuple:
+        """params 中 valuerank 的 (起始排名, 結束排名)"""
+        match = re.match(r'(\d+)-(\d+)', self.params.get('valuerank', ''))
+        return (int(match.group(1)), int(match.group(2))) if match else (1, 3000)
+
+    def rank_shards(self) -> list:
+        """將排名區間切成每段 shard_size 名，例如 [(1, 500), (501, 1000), ...]"""
+        first, last = self.rank_range()
+        size = max(1, self.shard_size)
+        return [(start, min(start + size - 1, last)) for start in range(first, last + 1, size)]
+
+    def _fetch_shard(self, shard: tuple) -> Optional[pd.DataFrame]:
+        """抓取並解析一段排名區間 (在抓取執行緒中解析，先到的段先解析)"""
+        start, end = shard
+        html_content = self.fetch_data(f'{start}-{end}')
+        if html_content is None:
+            return None
+        return self.process_table(html_content, capacity=end - start + 1)
+
+    def fetch_sharded(self) -> Optional[pd.DataFrame]:
+        """
+        分段同時抓取整個排名區間，每段下載完成即解析，最後依排名順序合併並檢查
+        更新時間取決於最慢的一段，而不是整頁的下載與解析時間。
+        :return: 合併後的 DataFrame；任何一段失敗或檢查未通過時回傳 None (不寫入不完整的資料)
+        """
+        shards = self.rank_shards()
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(shards)))) as executor:
+            futures = {executor.submit(self._fetch_shard, shard): shard for shard in shards}
+            for future in as_completed(futures):
+                shard = futures[future]
+                try:
+                    results[shard] = future.result()
+                except Exception as e:
+                    print(f"處理排名 {shard[0]}-{shard[1]} 時發生錯誤: {e}")
+                    results[shard] = None
+                if results[shard] is not None:
+                    print(f"排名 {shard[0]}-{shard[1]} 已解析 {len(results[shard])} 筆")
+
+        failed = [f'{start}-{end}' for (start, end), df in results.items() if df is None]
+        if failed:
+            print(f"排名區間 {', '.join(sorted(failed, key=lambda r: int(r.split('-')[0])))} 抓取失敗，放棄本次更新")
+            return None
+        return self.merge_shards([results[shard] for shard in shards], shards)
+
+    @staticmethod
+    def merge_shards(frames: list, shards: list) -> Optional[pd.DataFrame]:
+        """
+        依排名順序合併各段結果並檢查：
+          - 各段的週日期欄位必須相同 (抓取途中網站換週時放棄本次更新)
+          - 只有最後的段可以少於預期筆數 (股票總數不足區間上限)，中間的段不可缺漏
+          - 相同代碼只保留排名較前的一筆 (抓取期間排名變動造成的重複)
+        :return: 合併後的 DataFrame；檢查未通過時回傳 None
+        """
+        columns = list(frames[0].columns)
+        for df, (start, end) in zip(frames, shards):
+            if list(df.columns) != columns:
+                print(f"排名 {start}-{end} 的週日期與其他區段不同 (網站可能正在更新)，放棄本次更新")
+                return None
+
+        short = None
+        for df, (start, end) in zip(frames, shards):
+            if short is not None and len(df):
+                print(f"排名 {short} 的資料不完整 (後面的區段仍有資料)，放棄本次更新")
+                return None
+            if len(df) < end - start + 1 and short is None:
+                short = f'{start}-{end}'
+
+        merged = pd.concat(frames, ignore_index=True)
+        duplicated = merged['Code'].notna() & merged['Code'].duplicated()
+        if duplicated.any():
+            print(f"移除 {int(duplicated.sum())} 筆重複的股票代碼: {', '.join(merged.loc[duplicated, 'Code'])}")
+            merged = merged[~duplicated].reset_index(drop=True)
+        return merged
+
     @staticmethod
     def parse_date(date_str: str) -> str:
         """將日期字串解析為標準化格式"""
@@ -55,8 +176,120 @@ class StockHoldersScraper:
 
         return date_str
 
-    def process_table(self, html_content: str) -> Optional[pd.DataFrame]:
-        """處理 HTML 表格並回傳 DataFrame"""
+    def process_table(self, html_content: str, capacity: int = None) -> Optional[pd.DataFrame]:
+        """
+        處理 HTML 表格並回傳 DataFrame
+        以 lxml iterparse 單次走訪表格，直接寫入預先配置的 NumPy 欄位；
+        表格結構與預期不符時改用 BeautifulSoup + pandas.read_html 解析。
+        """
+        try:
+            return self.parse_table_stream(html_content, capacity)
+        except TableLayoutError as e:
+            print(f"表格結構與預期不符 ({e})，改用 pandas.read_html 解析")
+            return self.process_table_read_html(html_content)
+        except Exception as e:
+            print(f"處理表格時發生錯誤: {e}")
+            return None
+
+    def parse_table_stream(self, html_content: str, capacity: int = None) -> Optional[pd.DataFrame]:
+        """
+        以 lxml iterparse 單次走訪 HTML：每一列結束時取出代碼、名稱與 12 週的持股比例，
+        寫入預先配置的陣列後立即釋放該列的元素，不建立整份文件樹，也不重新序列化表格。
+        :param capacity: 預先配置的列數，None 表示依 valuerank 區間估計
+        :return: 與 process_table_read_html 相同欄位的 DataFrame；找不到表格時回傳 None
+        :raises TableLayoutError: 表格欄位數不足
+        """
+        if capacity is None:
+            first, last = self.rank_range()
+            capacity = last - first + 1
+        capacity = max(1, capacity)
+        codes = np.empty(capacity, dtype=object)
+        names = np.empty(capacity, dtype=object)
+        values = np.full((capacity, len(VALUE_COLUMNS)), np.nan)
+        header = None
+        rows = 0
+
+        table_depth = 0  # 目前位於目標表格內的巢狀表格層數，0 表示不在表格內
+        found = False
+        in_thead = False
+        cells = []
+
+        events = etree.iterparse(BytesIO(html_content.encode('utf-8')), events=('start', 'end'),
+                                 html=True, encoding='utf-8', recover=True)
+        for event, element in events:
+            tag = element.tag
+            if event == 'start':
+                if tag == 'table':
+                    if table_depth:
+                        table_depth += 1
+                    elif not found and TABLE_CLASSES & set((element.get('class') or '').split()):
+                        found = True
+                        table_depth = 1
+                elif table_depth == 1 and tag == 'thead':
+                    in_thead = True
+                elif table_depth == 1 and tag == 'tr':
+                    cells = []
+                continue
+
+            if not table_depth:
+                element.clear()
+                continue
+            if tag == 'table':
+                table_depth -= 1
+                if not table_depth:
+                    element.clear()
+                    break
+            elif table_depth > 1:
+                continue
+            elif tag in ('td', 'th'):
+                text = ' '.join(''.join(element.itertext()).split())
+                cells.extend([(tag, text)] * int(element.get('colspan') or 1))
+            elif tag == 'thead':
+                in_thead = False
+            elif tag == 'tr':
+                is_header = in_thead or all(cell_tag == 'th' for cell_tag, _ in cells)
+                if cells and is_header:
+                    header = [text for _, text in cells]
+                elif cells:
+                    if rows == capacity:
+                        capacity *= 2
+                        codes = np.resize(codes, capacity)
+                        names = np.resize(names, capacity)
+                        values = np.vstack([values, np.full_like(values, np.nan)])
+                    self._fill_row(cells, rows, codes, names, values)
+                    rows += 1
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+        if not found:
+            print("在 HTML 內容中找不到表格")
+            return None
+        if header is None or len(header) <= VALUE_COLUMNS[-1]:
+            raise TableLayoutError(f"標題列只有 {0 if header is None else len(header)} 欄")
+
+        df = pd.DataFrame({'Code': codes[:rows], 'Name': names[:rows]})
+        for i, column in enumerate(VALUE_COLUMNS):
+            df[self.parse_date(header[column])] = values[:rows, i]
+        return df
+
+    @staticmethod
+    def _fill_row(cells: list, row: int, codes: np.ndarray, names: np.ndarray, values: np.ndarray) -> None:
+        """將一列的儲存格寫入陣列；欄位不足或無法轉為數字的儲存格保留為缺值"""
+        if len(cells) > CODE_COLUMN:
+            match = CODE_NAME_PATTERN.search(cells[CODE_COLUMN][1])
+            if match:
+                codes[row], names[row] = match.group(1), match.group(2)
+        for i, column in enumerate(VALUE_COLUMNS):
+            if column >= len(cells):
+                break
+            try:
+                values[row, i] = float(cells[column][1].replace(',', ''))
+            except ValueError:
+                pass
+
+    def process_table_read_html(self, html_content: str) -> Optional[pd.DataFrame]:
+        """以 BeautifulSoup 找出表格後交由 pandas.read_html 解析 (原本的解析方式)"""
         try:
             soup = BeautifulSoup(html_content, 'lxml')
             table = soup.find('table', class_=["display", "dataTable", "no-footer"])
@@ -116,19 +349,21 @@ def main():
     # 初始化爬蟲
     scraper = StockHoldersScraper()
 
-    # 獲取並處理資料
-    html_content = scraper.fetch_data()
-    if html_content:
-        df = scraper.process_table(html_content)
-        if df is not None:
-            # 儲存到 CSV
-            scraper.save_to_csv(df)
-            print("資料處理完成。")
-            print(df.head())
-        else:
-            print("處理表格資料失敗")
+    # 分段獲取並處理資料
+    df = scraper.fetch_sharded()
+    if df is not None:
+        # 儲存到 CSV
+        scraper.save_to_csv(df)
+        print("資料處理完成。")
+        print(df.head())
     else:
         print("從網站獲取資料失敗")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
+    # 直接執行時也把新的 CSV 合併進大戶股權歷史資料庫 (背景工作由 run_shareholder_update 合併)
+    import shareholder_store
+    import shareholder_history
+    store = shareholder_store.reload()
+    if store is not None:
+        shareholder_history.merge_store(store)
\ No newline at end of file
@@ -3,80 +3,56 @@ import matplotlib
 matplotlib.use('Agg')  # 【新增】設定 Matplotlib 後端為 Agg (必須在 pyplot 導入前)
 import matplotlib.pyplot as plt
 import numpy as np
-import os
 import datetime
+import sqlite3
 import requests
-import twstock
+
+from finmind_client import get_client
+from chart_fonts import apply_cjk_fonts
+from symbol_table import get_symbol_table
+from shareholder_store import get_store
+import shareholder_history
+import revenue_store
 
 # 設定中文字型，以確保在不同作業系統上都能正確顯示
-plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei', 'Heiti TC', 'sans-serif']
-plt.rcParams['axes.unicode_minus'] = False # 解決負號顯示問題
+apply_cjk_fonts(plt.rcParams)
 
-def get_stock_code(stock_identifier, df):
-    """
-    根據股票代碼或名稱查找股票代碼。
-    (此函式保留給 plot_stock_major_shareholders 使用)
-    """
-    identifier_str = str(stock_identifier)
-    if identifier_str.isdigit() and int(identifier_str) in df['Code'].values:
-        return identifier_str
-    exact_match = df.loc[df['Name'] == identifier_str, 'Code']
-    if not exact_match.empty:
-        return str(exact_match.iloc[0])
-    partial_match = df[df['Name'].str.contains(identifier_str, na=False)]
-    if not partial_match.empty:
-        return str(partial_match['Code'].iloc[0])
-    return None
+# 大戶股權圖最多標示數值與日期刻度的週數
+MAX_LABELED_WEEKS = 12
 
-def plot_stock_revenue_trend(stock_identifier, save_path):
+def fetch_revenue_data(stock_identifier):
     """
-    從 FinMind API 讀取資料並繪製營收趨勢圖，儲存為圖片。
+    讀取並整理月營收資料 (不繪圖，可在執行緒中並行呼叫)。
     資料範圍：最近三個完整年度 + 當年度至今。
-    修正：使用 revenue_year 和 revenue_month 對應營收月份。
+    月營收保存在本地資料庫 (revenue_store)，只有在公告期間內或資料過期時才向 FinMind API 請求。
 
     Parameters:
     stock_identifier (str or int): 股票代碼或名稱。
-    save_path (str): 圖片儲存路徑。
 
     Returns:
-    str: 成功時回傳 None，失敗時回傳錯誤訊息。
+    tuple: (revenue_data, error_message)。成功時 error_message 為 None，
+           失敗時 revenue_data 為 None。
     """
     # --- 1. 股票代碼與名稱解析 ---
-    try:
-        stock_info = twstock.codes[str(stock_identifier)]
-        stock_code = stock_info.code
-        stock_name = stock_info.name
-    except KeyError:
-        return f"錯誤: 在 twstock 資料庫中找不到股票 '{stock_identifier}'"
+    symbols = get_symbol_table()
+    stock_code = symbols.resolve(stock_identifier, shareholders_only=False)
+    if stock_code is None:
+        return None, f"錯誤: 在股票索引中找不到股票 '{stock_identifier}'"
+    stock_name = symbols.name(stock_code)
 
     # --- 2. 從 FinMind API 獲取資料 ---
     try:
-        finmind_api_token = os.getenv('FINMIND_API_TOKEN')
-        finmind_url = "https://api.finmindtrade.com/api/v4/data"
-        
         current_year = datetime.date.today().year
         start_year = current_year - 3
-        start_date = f"{start_year}-01-01"
+        start_date = datetime.date(start_year, 1, 1)
         end_date = datetime.date.today().strftime('%Y-%m-%d')
 
-        params = {
-            "dataset": "TaiwanStockMonthRevenue",
-            "data_id": stock_code,
-            "start_date": start_date,
-            "end_date": end_date,
-        }
-        headers = {}
-        if finmind_api_token:
-            headers["Authorization"] = f"Bearer {finmind_api_token}"
-
-        response = requests.get(finmind_url, params=params, headers=headers, timeout=20)
-        response.raise_for_status()
-
-        raw_data = response.json()
-        if raw_data.get("status") != 200:
-             raise ValueError(f"FinMind API 錯誤: {raw_data.get('msg', '未知錯誤')}")
-
-        data_list = raw_data.get('data')
+        # 只在本地月營收過期 (依公告期間判斷) 時向 FinMind 請求缺少的月份
+        fetch_start = revenue_store.missing_start(stock_code, start_date)
+        if fetch_start is not None:
+            new_rows = get_client().month_revenue(stock_code, fetch_start.isoformat(), end_date)
+            revenue_store.save_revenue(stock_code, new_rows, fetch_start)
+        data_list = revenue_store.load_revenue(stock_code, start_date)
         if not data_list:
             raise ValueError(f"FinMind API 未回傳股票 {stock_code} 的月營收資料。")
 
@@ -90,11 +66,11 @@ def plot_stock_revenue_trend(stock_identifier, save_path):
             raise ValueError(f"FinMind API 回傳的資料缺少必要欄位: {', '.join(missing_cols)}")
 
     except requests.exceptions.RequestException as e:
-        return f"錯誤: 連線 FinMind API 時發生錯誤: {e}"
+        return None, f"錯誤: 連線 FinMind API 時發生錯誤: {e}"
     except ValueError as e:
-        return f"錯誤: 處理 FinMind API 資料時發生錯誤: {e}"
+        return None, f"錯誤: 處理 FinMind API 資料時發生錯誤: {e}"
     except Exception as e:
-        return f"錯誤: 獲取營收資料時發生未預期錯誤: {e}"
+        return None, f"錯誤: 獲取營收資料時發生未預期錯誤: {e}"
 
     # --- 3. 數據處理 ---
     revenue_df.rename(columns={'revenue': 'Revenue'}, inplace=True)
@@ -114,6 +90,38 @@ def plot_stock_revenue_trend(stock_identifier, save_path):
 
     revenue_df = revenue_df[revenue_df['Year'] >= start_year]
     
+    revenue_data = {
+        'stock_code': stock_code,
+        'stock_name': stock_name,
+        'current_year': current_year,
+        'revenue_df': revenue_df,
+    }
+    return revenue_data, None
+
+
+def plot_stock_revenue_trend(stock_identifier, save_path, revenue_data=None):
+    """
+    從 FinMind API 讀取資料並繪製營收趨勢圖，儲存為圖片。
+    資料範圍：最近三個完整年度 + 當年度至今。
+    修正：使用 revenue_year 和 revenue_month 對應營收月份。
+
+    Parameters:
+    stock_identifier (str or int): 股票代碼或名稱。
+    save_path (str): 圖片儲存路徑。
+    revenue_data (dict): 已由 fetch_revenue_data 取得的資料；None 時自動抓取。
+
+    Returns:
+    str: 成功時回傳 None，失敗時回傳錯誤訊息。
+    """
+    if revenue_data is None:
+        revenue_data, error_msg = fetch_revenue_data(stock_identifier)
+        if error_msg:
+            return error_msg
+
+    stock_code = revenue_data['stock_code']
+    stock_name = revenue_data['stock_name']
+    current_year = revenue_data['current_year']
+    revenue_df = revenue_data['revenue_df']
     current_year_data = revenue_df[revenue_df['Year'] == current_year].copy()
 
     # --- 4. 繪圖部分 ---
@@ -164,57 +172,78 @@ def plot_stock_revenue_trend(stock_identifier, save_path):
     return None
 
 
-def plot_stock_major_shareholders(stock_identifier, save_path):
+def load_major_shareholders_data(stock_identifier, start_date=None, end_date=None):
     """
-    從 大戶股權.csv 讀取資料並繪製大戶股權圖，儲存為圖片。
-    (此函式維持原樣，不受影響)
+    從大戶股權歷史資料庫 (shareholder_history) 取出單一股票在日期區間內的資料 (不繪圖，可在執行緒中並行呼叫)。
+    未指定日期區間 (圖表預設的完整歷史) 時由記憶體中的歷史矩陣取出，不查詢資料庫；
+    新的 大戶股權.csv 由背景工作 (run_shareholder_update) 合併進資料庫，此處只讀取。
+    資料庫無法使用或尚無此股票的資料 (CSV 尚未合併) 時改用 CSV 中的最近幾週資料。
+
+    Parameters:
+    stock_identifier (str or int): 股票代碼或名稱。
+    start_date (str): 起始日期 'YYYY-MM-DD'，None 表示不限。
+    end_date (str): 結束日期 'YYYY-MM-DD'，None 表示不限。
+
+    Returns:
+    tuple: (shareholder_data, error_message)。成功時 error_message 為 None，
+           失敗時 shareholder_data 為 None。
     """
+    store = get_store()
+    symbols = get_symbol_table()
+    stock_code = symbols.resolve(stock_identifier) or symbols.resolve(stock_identifier, shareholders_only=False)
+    if not stock_code:
+        if store is None:
+            return None, "錯誤: 找不到 大戶股權.csv 檔案。"
+        return None, f"錯誤: 在 大戶股權.csv 中找不到股票 {stock_identifier}"
+
     try:
-        major_shareholders_df = pd.read_csv('大戶股權.csv')
-    except FileNotFoundError:
-        return "錯誤: 找不到 大戶股權.csv 檔案。"
+        if start_date is None and end_date is None:
+            history = shareholder_history.get_history(store.mtime if store is not None else None)
+            shareholder_data = history.series(stock_code)
+        else:
+            shareholder_data = shareholder_history.load_series(stock_code, start_date, end_date)
+    except sqlite3.Error as e:
+        print(f"警告: 無法讀取大戶股權歷史資料庫，改用 大戶股權.csv: {e}")
+        shareholder_data = None
 
-    stock_code = get_stock_code(stock_identifier, major_shareholders_df)
-    if not stock_code:
-        return f"錯誤: 在 大戶股權.csv 中找不到股票 {stock_identifier}"
+    # 資料庫沒有此股票 (例如既有的 大戶股權.csv 尚未合併進資料庫) 時改用 CSV 中的最近幾週資料
+    if (shareholder_data is None or len(shareholder_data['dates']) == 0) and store is not None:
+        shareholder_data = store.series(stock_code)
+        if shareholder_data is not None:
+            dates = shareholder_data['dates']
+            in_range = (dates >= (start_date or '0000-00-00')) & (dates <= (end_date or '9999-99-99'))
+            shareholder_data = dict(shareholder_data, dates=dates[in_range], values=shareholder_data['values'][in_range])
 
-    stock_data = major_shareholders_df[major_shareholders_df['Code'] == int(stock_code)]
+    if shareholder_data is None or len(shareholder_data['dates']) == 0:
+        return None, f"錯誤: 在 大戶股權.csv 中找不到股票代碼 {stock_code} 的資料"
+    return shareholder_data, None
 
-    if stock_data.empty:
-        return f"錯誤: 在 大戶股權.csv 中找不到股票代碼 {stock_code} 的資料"
-    
-    stock_major_shareholders = stock_data.iloc[0, 2:]
-    
-    valid_dates = []
-    valid_values = []
-    for date_str, value in stock_major_shareholders.items():
-        try:
-            pd.to_datetime(date_str)
-            valid_dates.append(date_str)
-            valid_values.append(value)
-        except (ValueError, TypeError):
-            continue
-            
-    dates = pd.to_datetime(valid_dates, errors='coerce')
-    values = pd.to_numeric(valid_values, errors='coerce')
 
-    valid_mask = ~pd.isna(dates) & ~np.isnan(values)
-    dates = dates[valid_mask]
-    values = values[valid_mask]
-    
-    sorted_idx = dates.argsort()
-    sorted_dates_str = dates[sorted_idx].strftime('%Y-%m-%d')
-    sorted_values = values[sorted_idx]
+def plot_stock_major_shareholders(stock_identifier, save_path, shareholder_data=None):
+    """
+    從大戶股權歷史資料繪製大戶股權圖，儲存為圖片。
+    shareholder_data 為已由 load_major_shareholders_data 取得的資料 (可指定日期區間)；None 時自動讀取全部歷史。
+    """
+    if shareholder_data is None:
+        shareholder_data, error_msg = load_major_shareholders_data(stock_identifier)
+        if error_msg:
+            return error_msg
+
+    sorted_dates_str = shareholder_data['dates']
+    sorted_values = shareholder_data['values']
 
     # --- 繪圖部分 ---
     fig, ax = plt.subplots(figsize=(12, 7))
     ax.step(sorted_dates_str, sorted_values, where='pre', marker='o', linestyle='-', color='dodgerblue', linewidth=3)
     
-    for i, value in enumerate(sorted_values):
+    # 累積多年資料時只標示數值於最近幾週，並減少日期刻度，避免文字重疊
+    label_from = max(0, len(sorted_values) - MAX_LABELED_WEEKS)
+    for i, value in enumerate(sorted_values[label_from:], start=label_from):
         ax.text(sorted_dates_str[i], sorted_values[i], f'{value:.2f}%', ha='center', va='bottom', fontsize=10, color='darkblue')
+    tick_step = max(1, -(-len(sorted_dates_str) // MAX_LABELED_WEEKS))
+    ax.set_xticks(list(sorted_dates_str[::tick_step]))
 
-    stock_name = stock_data['Name'].values[0]
-    title = f"{stock_data['Code'].values[0]} {stock_name} 大戶股權變化圖 (持股>400張)"
+    title = f"{shareholder_data['code']} {shareholder_data['name']} 大戶股權變化圖 (持股>400張)"
     plt.title(title, fontsize=16)
     plt.xlabel('日期 (週為單位)', fontsize=12)
     plt.ylabel('大戶股權比例 (%)', fontsize=12)
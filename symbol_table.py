@@ -0,0 +1,166 @@
+import threading
+
+import twstock
+
+import shareholder_store
+
+# 股票代碼與名稱的索引
+# 以 twstock.codes (上市櫃股票、ETF 等，排除權證) 與大戶股權資料 (shareholder_store) 建立一次，提供：
+#   - 代碼查詢與代碼前綴查詢 (dict，O(1))
+#   - 完整名稱查詢 (dict，O(1))
+#   - 名稱前綴 / 子字串查詢 (名稱的所有子字串 -> 代碼，O(1) 取得候選)
+# 大戶股權.csv 更新後重新建立新的索引，再以單一指派替換，查詢中的請求不會看到建到一半的索引。
+
+SHAREHOLDERS_CSV = shareholder_store.SHAREHOLDERS_CSV
+
+# 名稱子字串索引的最大長度；股票名稱通常不超過此長度，較長的查詢改以逐一比對
+MAX_SUBSTRING_LENGTH = 8
+
+
+class SymbolTable:
+    def __init__(self, entries: dict, shareholder_codes: list, csv_mtime=None) -> None:
+        """
+        :param entries: {代碼: {'code', 'name', 'type', 'market'}}
+        :param shareholder_codes: 大戶股權.csv 中的代碼 (依檔案順序)
+        :param csv_mtime: 建立索引時 大戶股權.csv 的修改時間
+        """
+        self.entries = entries
+        self.shareholder_codes = shareholder_codes
+        self.csv_mtime = csv_mtime
+        self._shareholder_rank = {code: rank for rank, code in enumerate(shareholder_codes)}
+
+        self.by_name = {}
+        self.by_substring = {}
+        self.by_code_prefix = {}
+        for code in self._ordered_codes():
+            for end in range(1, len(code) + 1):
+                self.by_code_prefix.setdefault(code[:end], []).append(code)
+            name = entries[code]['name']
+            self.by_name.setdefault(name, code)
+            seen = set()
+            for start in range(len(name)):
+                for end in range(start + 1, min(len(name), start + MAX_SUBSTRING_LENGTH) + 1):
+                    part = name[start:end]
+                    if part not in seen:
+                        seen.add(part)
+                        self.by_substring.setdefault(part, []).append(code)
+
+    def _ordered_codes(self) -> list:
+        """大戶股權.csv 中的股票依檔案順序排在前面，其餘依代碼排序"""
+        others = sorted(code for code in self.entries if code not in self._shareholder_rank)
+        return self.shareholder_codes + others
+
+    @classmethod
+    def build(cls, csv_path: str = SHAREHOLDERS_CSV) -> 'SymbolTable':
+        """從 twstock.codes 與 大戶股權.csv 建立索引"""
+        entries = {}
+        for code, info in twstock.codes.items():
+            if '權證' in info.type:
+                continue
+            entries[code] = {'code': code, 'name': info.name, 'type': info.type, 'market': info.market}
+
+        shareholder_codes = []
+        store = shareholder_store.get_store(csv_path)
+        if store is not None:
+            for code, name in zip(store.codes, store.names):
+                if code in entries:
+                    entries[code]['name'] = name
+                else:
+                    entries[code] = {'code': code, 'name': name, 'type': '', 'market': ''}
+            shareholder_codes = list(dict.fromkeys(store.codes))
+        csv_mtime = store.mtime if store is not None else None
+        return cls(entries, shareholder_codes, csv_mtime)
+
+    @property
+    def has_shareholders(self) -> bool:
+        """是否已載入 大戶股權.csv"""
+        return self.csv_mtime is not None
+
+    def lookup(self, code: str):
+        """依代碼查詢，找不到時回傳 None"""
+        return self.entries.get(str(code).strip())
+
+    def name(self, code: str, default: str = None) -> str:
+        entry = self.lookup(code)
+        return entry['name'] if entry else default
+
+    def in_shareholders(self, code: str) -> bool:
+        return str(code) in self._shareholder_rank
+
+    def resolve(self, identifier, shareholders_only: bool = True):
+        """
+        將使用者輸入的代碼或名稱解析為代碼：代碼 -> 完整名稱 -> 名稱包含輸入字串的第一檔
+        :param shareholders_only: 只接受 大戶股權.csv 中的股票 (首頁需要三張圖)
+        :return: 股票代碼；找不到時回傳 None
+        """
+        query = str(identifier).strip()
+        if not query:
+            return None
+        allowed = self.in_shareholders if shareholders_only else (lambda code: code in self.entries)
+
+        if query.isdigit():
+            for code in (query, str(int(query))):
+                if allowed(code):
+                    return code
+        code = self.by_name.get(query)
+        if code is not None and allowed(code):
+            return code
+        for code in self._name_matches(query):
+            if allowed(code):
+                return code
+        return None
+
+    def _name_matches(self, query: str) -> list:
+        if len(query) <= MAX_SUBSTRING_LENGTH:
+            return self.by_substring.get(query, [])
+        return [code for code in self._ordered_codes() if query in self.entries[code]['name']]
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """
+        自動完成查詢：代碼前綴與名稱子字串，依完全相符、前綴相符、子字串相符排序
+        :return: [{'code', 'name', 'type', 'market', 'shareholders'}, ...]
+        """
+        query = str(query).strip()
+        if not query or limit <= 0:
+            return []
+
+        ranked = {}
+
+        def add(code, rank):
+            if code in self.entries and rank < ranked.get(code, (9,))[0]:
+                ranked[code] = (rank, 0 if self.in_shareholders(code) else 1, code)
+
+        if query in self.entries:
+            add(query, 0)
+        if query in self.by_name:
+            add(self.by_name[query], 0)
+        for code in self.by_code_prefix.get(query, []):
+            add(code, 1)
+        for code in self._name_matches(query):
+            add(code, 1 if self.entries[code]['name'].startswith(query) else 2)
+
+        codes = sorted(ranked, key=ranked.get)[:limit]
+        return [dict(self.entries[code], shareholders=self.in_shareholders(code)) for code in codes]
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def rebuild(csv_path: str = SHAREHOLDERS_CSV) -> SymbolTable:
+    """重新建立索引並以單一指派替換目前的索引"""
+    global _table
+    with _table_lock:
+        table = SymbolTable.build(csv_path)
+        _table = table
+    print(f"股票索引已建立，共 {len(table.entries)} 檔 (大戶股權 {len(table.shareholder_codes)} 檔)。")
+    return table
+
+
+def get_symbol_table(csv_path: str = SHAREHOLDERS_CSV) -> SymbolTable:
+    """取得目前的股票索引；尚未建立或 大戶股權.csv 已更新時重新建立"""
+    table = _table
+    store = shareholder_store.get_store(csv_path)
+    if table is None or table.csv_mtime != (store.mtime if store is not None else None):
+        table = rebuild(csv_path)
+    return table
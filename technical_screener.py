@@ -0,0 +1,141 @@
+import os
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import price_matrix
+from indicator_engine import compute_indicators, compute_signals
+from symbol_table import get_symbol_table
+
+# 全市場技術面篩選
+# 以全市場日K矩陣 (price_matrix) 一次計算所有股票的技術指標與 I/J/K/L 訊號 (與技術分析圖相同的引擎與期間)，
+# 再取每檔股票最後兩根日K判斷當日事件 (階梯訊號改變、KD 交叉、MACD 柱狀體翻正/翻負等)。
+# 計算結果依矩陣版本保留在記憶體中，之後的篩選與排序只是對約 1800 列的表格做布林運算。
+
+# 指標計算的期間 (日曆天)，與 TaiwanStockAnalyzer 的預設分析期間相同，EMA 類指標才會與圖表一致，
+# 可由環境變數 TECH_SCREEN_DAYS 調整
+TECH_SCREEN_DAYS = int(os.getenv('TECH_SCREEN_DAYS', '300'))
+
+SIGNAL_COLUMNS = ['I_value', 'J_value', 'K_value', 'L_value']
+INDICATOR_COLUMNS = ['k', 'd', 'macd_hist', 'dev_5_20', 'dev_20_60', 'dev_5_60', 'dev_1_20']
+
+# 事件名稱 -> 說明
+EVENTS = {
+    'stair_changed': '階梯訊號 (I) 與前一日不同',
+    'trend_changed': '多空訊號 (K) 翻轉',
+    'kd_golden_cross': 'K 值由下往上穿越 D 值',
+    'kd_death_cross': 'K 值由上往下穿越 D 值',
+    'macd_turn_positive': 'MACD 柱狀體由負轉正',
+    'macd_turn_negative': 'MACD 柱狀體由正轉負',
+}
+
+TABLE_COLUMNS = ['代碼', '股票名稱', '日期', '筆數', '收盤價', '成交量', *SIGNAL_COLUMNS, 'I_prev',
+                 *INDICATOR_COLUMNS, *EVENTS]
+
+_table = None  # ((矩陣版本, 起始日期), 篩選表)
+_table_lock = threading.Lock()
+
+
+def build_table(matrix: price_matrix.PriceMatrix, start_date: date) -> pd.DataFrame:
+    """
+    計算全市場每檔股票最新一根日K的指標、訊號與事件
+    :param matrix: 全市場日K矩陣
+    :param start_date: 指標計算的起始日期
+    :return: 每檔股票一列的表格 (只含有足夠資料計算季線的股票)
+    """
+    dates, aligned, order = matrix.aligned_window(start_date)
+    if len(dates) < 2:
+        return pd.DataFrame(columns=TABLE_COLUMNS)
+
+    indicators = compute_indicators(aligned['Close'], aligned['High'], aligned['Low'])
+    series = {**indicators, **compute_signals(indicators)}
+    latest = {key: values[-1] for key, values in series.items()}
+    previous = {key: values[-2] for key, values in series.items()}
+
+    counts = np.count_nonzero(~np.isnan(aligned['Close']), axis=0)
+    last_dates = dates[order[-1]]
+    with np.errstate(invalid='ignore'):
+        events = {
+            'stair_changed': latest['I_value'] != previous['I_value'],
+            'trend_changed': latest['K_value'] != previous['K_value'],
+            'kd_golden_cross': (previous['k'] <= previous['d']) & (latest['k'] > latest['d']),
+            'kd_death_cross': (previous['k'] >= previous['d']) & (latest['k'] < latest['d']),
+            'macd_turn_positive': (previous['macd_hist'] <= 0) & (latest['macd_hist'] > 0),
+            'macd_turn_negative': (previous['macd_hist'] >= 0) & (latest['macd_hist'] < 0),
+        }
+
+    symbols = get_symbol_table()
+    table = pd.DataFrame({
+        '代碼': matrix.codes,
+        '股票名稱': [symbols.name(code) or code for code in matrix.codes],
+        '日期': last_dates.strftime('%Y-%m-%d'),
+        '筆數': counts,
+        '收盤價': aligned['Close'][-1],
+        '成交量': aligned['Volume'][-1],
+        **{key: latest[key] for key in SIGNAL_COLUMNS},
+        'I_prev': previous['I_value'],
+        **{key: latest[key] for key in INDICATOR_COLUMNS},
+        **events,
+    }, columns=TABLE_COLUMNS)
+    # 季線尚未形成的股票 (上市未滿 60 個交易日) 訊號沒有意義
+    return table[~np.isnan(latest['dev_5_60'])].reset_index(drop=True)
+
+
+def get_table(days: int = TECH_SCREEN_DAYS):
+    """
+    取得目前矩陣版本的篩選表 (矩陣重建或起始日期改變後重新計算)
+    :return: (篩選表, 最新交易日 'YYYY-MM-DD')；尚未建立全市場日K矩陣時回傳 (None, None)
+    """
+    global _table
+    matrix = price_matrix.get_matrix()
+    if matrix is None:
+        return None, None
+    start_date = date.today() - timedelta(days=days)
+    key = (matrix.version, start_date)
+    cached = _table
+    if cached is None or cached[0] != key:
+        with _table_lock:
+            cached = _table
+            if cached is None or cached[0] != key:
+                cached = (key, build_table(matrix, start_date))
+                _table = cached
+    latest_day = matrix.dates[-1].strftime('%Y-%m-%d') if len(matrix.dates) else None
+    return cached[1], latest_day
+
+
+def screen(stair: int = None, deviation: int = None, trend: int = None, kd: int = None, events: list = None,
+           sort: str = '成交量', ascending: bool = False, limit: int = None, include_stale: bool = False):
+    """
+    依 I/J/K/L 訊號與當日事件篩選全市場股票並排序
+    :param stair: 階梯訊號 I_value (1, 2, 3, -1, -2, -3)
+    :param deviation: 乖離訊號 J_value (4 或 -4)
+    :param trend: 多空訊號 K_value (3 或 -3)
+    :param kd: KD 訊號 L_value (100 超買或 0 超賣)
+    :param events: 須同時發生的事件名稱 (見 EVENTS)
+    :param sort: 排序欄位
+    :param include_stale: 是否包含最後一根日K不是最新交易日的股票 (停牌等)
+    :return: (篩選結果, 最新交易日)；尚未建立全市場日K矩陣時回傳 (None, None)
+    :raises ValueError: 未知的事件或排序欄位
+    """
+    unknown = [event for event in events or [] if event not in EVENTS]
+    if unknown:
+        raise ValueError(f"未知的事件: {', '.join(unknown)}，可用事件: {', '.join(EVENTS)}")
+    table, latest_day = get_table()
+    if table is None:
+        return None, None
+    if sort not in table.columns:
+        raise ValueError(f"未知的排序欄位 '{sort}'")
+
+    mask = np.ones(len(table), dtype=bool)
+    if not include_stale:
+        mask &= (table['日期'] == latest_day).to_numpy()
+    for column, value in (('I_value', stair), ('J_value', deviation), ('K_value', trend), ('L_value', kd)):
+        if value is not None:
+            mask &= (table[column] == value).to_numpy()
+    for event in events or []:
+        mask &= table[event].to_numpy()
+
+    result = table[mask].sort_values(sort, ascending=ascending, ignore_index=True)
+    return (result.head(limit) if limit else result), latest_day
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from backtester import FEE_RATE, TAX_RATE, daily_returns, evaluate
+
+
+def _evaluate(close, held):
+    close = np.asarray(close, dtype=float)
+    order = np.repeat(np.arange(len(close))[:, None], close.shape[1], axis=1)
+    return evaluate(close, daily_returns(close), np.asarray(held, dtype=bool), order, len(close))
+
+
+def test_single_trade_compounds_to_trade_return():
+    close = [[10], [20], [11], [12], [15]]
+    held = [[False], [True], [True], [False], [False]]  # 第 1 日收盤買進、第 3 日收盤賣出
+    result = _evaluate(close, held)
+
+    expected = 12 * (1 - FEE_RATE - TAX_RATE) / (20 * (1 + FEE_RATE)) - 1
+    assert result['trades'] == 1
+    assert result['avg_trade_return'] == pytest.approx(expected)
+    assert result['total_return'] == pytest.approx(expected)
+    # 只有第 2、3 日的報酬屬於前一日收盤已持有的部位
+    assert result['avg_holdings'] == pytest.approx(2 / 5)
+
+
+def test_stock_bought_at_close_does_not_dilute_that_day():
+    close = [[10, 10], [11, 10], [12, 20], [12, 20]]
+    held = [[True, False], [True, False], [True, True], [True, True]]
+    result = _evaluate(close, held)
+
+    # 第 2 日只有第一檔已持有 (+9.09%)；第二檔在第 2 日收盤才買進，手續費計入第 3 日
+    first_day = 11 / 10 / (1 + FEE_RATE)
+    expected = first_day * (12 / 11) * (1 + (1 / (1 + FEE_RATE) - 1) / 2)
+    assert result['total_return'] == pytest.approx(expected - 1)
@@ -0,0 +1,41 @@
+import pandas as pd
+
+import concentration_history
+
+
+def _snapshot(value):
+    return pd.DataFrame({'代碼': ['2330'], '股票名稱': ['台積電'], '1日集中度': [value], '5日集中度': [value],
+                         '10日集中度': [value], '20日集中度': [value], '60日集中度': [value],
+                         '120日集中度': [value], '10日均量': [5000]})
+
+
+def test_empty_history_returns_empty_frame(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # 交易日曆查詢使用工作目錄下的日K資料庫
+    db_path = str(tmp_path / 'concentration.db')
+    result = concentration_history.rising_streak(2, db_path=db_path)
+    assert result.empty and '連續天數' in result.columns
+
+
+def test_missing_trading_day_breaks_streak(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db_path = str(tmp_path / 'concentration.db')
+    # 2024-01-03 (週三) 沒有快照：1/2 -> 1/4 不算連續上升
+    for day, value in [('2024-01-01', 1.0), ('2024-01-02', 2.0), ('2024-01-04', 3.0), ('2024-01-05', 4.0)]:
+        concentration_history.save_snapshot(day, _snapshot(value), db_path)
+    panel = concentration_history.load_panel(db_path=db_path)
+    assert len(panel) == 5
+    assert panel.streak(panel.rising())[0] == 1
+    assert concentration_history.rising_streak(2, db_path=db_path).empty
+
+
+def test_daily_capture_is_queued_until_the_trading_day_has_a_snapshot(tmp_path, monkeypatch):
+    import background_jobs
+    import job_queue
+    import price_store
+
+    monkeypatch.chdir(tmp_path)  # 工作佇列與快照資料庫寫在工作目錄下
+    job_id = background_jobs.queue_concentration_capture()
+    assert job_queue.get_job(job_id)['kind'] == background_jobs.CONCENTRATION_CAPTURE
+
+    concentration_history.save_snapshot(price_store.latest_trading_day(), _snapshot(1.0))
+    assert background_jobs.queue_concentration_capture() is None
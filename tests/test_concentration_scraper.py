@@ -0,0 +1,113 @@
+import importlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+concentration = importlib.import_module('1日籌碼集中度')
+
+VALUES = {
+    '2330': ('台積電', [5.1, 4.2, 3.3, 2.4, 1.5, 0.6, 30000]),
+    '2317': ('鴻海', [3.0, 3.0, 2.0, 1.0, 0.5, 0.1, 20000]),
+}
+
+
+def _page() -> str:
+    """
+    模擬來源網頁：目標表格之前另有含「代碼」的表格；目標表格有標題列、
+    colspan 儲存格、儲存格內的巢狀表格，以及資料之後的說明列
+    """
+    def cell(value, colspan=1):
+        return f'<td colspan="{colspan}">{value}</td>' if colspan > 1 else f'<td>{value}</td>'
+
+    header = ''.join(cell(name) for name in ['編號', '代碼', '名稱'] + concentration.NUMERIC_COLUMNS)
+    name, values = VALUES['2330']
+    first = (cell(1) + cell('2330') + f'<td>{name}<table><tr><td></td><td></td></tr></table></td>'
+             + ''.join(cell(value) for value in values))
+    name, values = VALUES['2317']
+    second = cell(2) + cell('2317') + cell(name) + cell(values[0], colspan=2) + ''.join(cell(v) for v in values[2:])
+    return f'''<html><body>
+<table><tr><td>代碼</td><td>名稱</td></tr><tr><td>9999</td><td>其他表格</td></tr></table>
+<table id="{concentration.TABLE_ID}">
+<tr><td colspan="10">籌碼集中度 1日排行</td></tr>
+<tr>{header}</tr>
+<tr>{first}</tr>
+<tr>{second}</tr>
+<tr><td colspan="10">說明：資料僅供參考</td></tr>
+<tr><td colspan="10">資料來源：券商分點</td></tr>
+</table>
+</body></html>'''
+
+
+def test_parse_concentration_table():
+    df = concentration.parse_concentration_table(_page())
+    assert list(df.columns) == concentration.ALL_COLUMNS
+    assert df['代碼'].tolist() == ['2330', '2317']
+    assert df['股票名稱'].tolist() == ['台積電', '鴻海']
+    for row, code in enumerate(['2330', '2317']):
+        assert df.loc[row, concentration.NUMERIC_COLUMNS].tolist() == VALUES[code][1]
+
+
+def test_parse_without_header_returns_none():
+    assert concentration.parse_concentration_table('<html><body><table><tr><td>1</td></tr></table></body></html>') is None
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    """回傳排行網頁的本地網站：帶 ETag，條件式請求的 ETag 相符時回應 304"""
+    monkeypatch.chdir(tmp_path)  # 歷史快照寫在工作目錄下
+    state = {'statuses': []}
+    body = _page().encode('big5')
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.headers.get('If-None-Match') == '"v1"':
+                state['statuses'].append(304)
+                self.send_response(304)
+                self.send_header('ETag', '"v1"')
+                self.end_headers()
+                return
+            state['statuses'].append(200)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', '"v1"')
+            self.send_header('Last-Modified', 'Mon, 05 Feb 2024 07:00:00 GMT')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    monkeypatch.setattr(concentration, 'CONCENTRATION_URL', f'http://127.0.0.1:{httpd.server_address[1]}/rank.htm')
+    monkeypatch.setattr(concentration, '_snapshot', None)
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_not_modified_reuses_the_parsed_snapshot(site, monkeypatch):
+    parses = []
+    parse = concentration.parse_concentration_table
+
+    def counting_parse(html_text):
+        parses.append(1)
+        return parse(html_text)
+
+    monkeypatch.setattr(concentration, 'parse_concentration_table', counting_parse)
+
+    first = concentration.fetch_stock_concentration_data()
+    assert first['代碼'].tolist() == ['2330', '2317']
+    # 確認間隔內不向網站請求
+    assert concentration.fetch_stock_concentration_data()['代碼'].tolist() == ['2330', '2317']
+    assert site['statuses'] == [200]
+
+    second = concentration.fetch_stock_concentration_data(force_refresh=True)
+    assert site['statuses'] == [200, 304]
+    assert len(parses) == 1
+    assert second.equals(first)
+    # 回傳的是副本，呼叫端修改不影響快照
+    second.loc[0, '代碼'] = '0000'
+    assert concentration.fetch_stock_concentration_data()['代碼'].tolist() == ['2330', '2317']
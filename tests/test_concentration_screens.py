@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from concentration_screens import DEFAULT_SCREENS, Screen, ScreenError
+
+
+@pytest.mark.parametrize('expression', [
+    '`1日集中度` and `5日集中度` > 0',
+    'not `1日集中度`',
+    '`1日集中度` > 1 or 2',
+    '`1日集中度` + 1',
+    '(`1日集中度` > 1) + 1',
+])
+def test_rejects_non_boolean_operands(expression):
+    with pytest.raises(ScreenError):
+        Screen('test', expression)
+
+
+def test_default_screens_compile_and_chained_comparisons_vectorize():
+    for name, definition in DEFAULT_SCREENS.items():
+        Screen(name, **definition)
+    screen = Screen('test', 'not `1日集中度` > 1 and `5日集中度` > `10日集中度` > 0')
+    arrays = {
+        '1日集中度': np.array([0.0, 2.0, 0.0, np.nan]),
+        '5日集中度': np.array([3.0, 3.0, 1.0, 3.0]),
+        '10日集中度': np.array([1.0, 1.0, 2.0, 1.0]),
+    }
+    np.testing.assert_array_equal(screen.evaluate(arrays), [True, False, False, True])
+
+
+def test_evaluation_errors_are_screen_errors():
+    screen = Screen('test', '`1日集中度` > threshold', {'threshold': 1})
+    with pytest.raises(ScreenError):
+        screen.evaluate({'1日集中度': np.ones(3)}, {'threshold': 'x'})
@@ -0,0 +1,89 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from finmind_scheduler import BATCH, INTERACTIVE, QuotaExceededError, RequestScheduler
+
+
+@pytest.fixture
+def quota_endpoint(monkeypatch):
+    """
+    回應 FinMind 剩餘額度查詢的本地假端點
+    state['used'] / state['limit'] 為回傳的已使用次數與上限，state['delay'] 為回應前等待的秒數
+    """
+    monkeypatch.setenv('FINMIND_API_TOKEN', 'test')
+    state = {'used': 590, 'limit': 600, 'delay': 0, 'requests': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state['requests'] += 1
+            time.sleep(state['delay'])
+            body = json.dumps({'user_count': state['used'], 'api_request_limit': state['limit']}).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    state['url'] = f'http://127.0.0.1:{httpd.server_address[1]}/'
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_batch_is_deferred_near_the_budget_limit(quota_endpoint):
+    scheduler = RequestScheduler(quota_url=quota_endpoint['url'])
+    scheduler.sync_quota()
+    status = scheduler.status()
+    assert status['hourly_limit'] == 600 and status['remaining'] == 10 and status['batch_deferred']
+
+    # 剩餘 10 次，低於 20% 保留量：批次請求延後，互動查詢仍可取得額度
+    with pytest.raises(QuotaExceededError):
+        scheduler.acquire(BATCH, timeout=0.2)
+    scheduler.acquire(INTERACTIVE, timeout=0.2)
+    assert scheduler.status()['remaining'] == 9
+
+
+def test_interactive_requests_go_before_waiting_batch():
+    scheduler = RequestScheduler(hourly_limit=36000, batch_reserve=0, quota_url=None)  # 每 0.1 秒回補 1 次
+    with scheduler._cond:
+        scheduler.tokens = 0.0
+        scheduler._last_refill = time.monotonic()
+    order = []
+
+    def take(priority):
+        scheduler.acquire(priority, timeout=5)
+        order.append(priority)
+
+    batch = threading.Thread(target=take, args=(BATCH,))
+    batch.start()
+    time.sleep(0.02)  # 批次請求先排隊
+    interactive = threading.Thread(target=take, args=(INTERACTIVE,))
+    interactive.start()
+    batch.join()
+    interactive.join()
+    assert order == [INTERACTIVE, BATCH]
+
+
+def test_slow_quota_sync_does_not_block_acquire(quota_endpoint):
+    quota_endpoint['delay'] = 1.0
+    scheduler = RequestScheduler(hourly_limit=600, quota_url=quota_endpoint['url'])
+
+    started = time.monotonic()
+    for _ in range(3):
+        scheduler.acquire(INTERACTIVE, timeout=0.5)
+    assert time.monotonic() - started < 0.5
+    assert quota_endpoint['requests'] <= 1  # 同一時間只有一個同步
+
+    # 同步完成後以 FinMind 回傳的額度校正
+    deadline = time.monotonic() + 5
+    while scheduler.used_remote is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert scheduler.status()['remaining'] == 10
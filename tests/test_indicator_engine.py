@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicator_engine import INDICATOR_KEYS, SIGNAL_KEYS, column, compute_indicators, compute_signals, \
+    stack_price_series
+
+# 向量化指標引擎與改寫前逐檔計算結果的一致性
+# fixtures/indicator_baseline.npz 由改寫前的 TaiwanStockAnalyzer (git 的 baseline 提交) 產生：
+# 對 4 檔長度不同的模擬股價 (其中一檔含價格不變的盤整區段) 執行 calculate_indicators / calculate_signals，
+# 保存輸入的 High/Low/Close 與所有指標、訊號欄位。
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'indicator_baseline.npz')
+COLUMNS = INDICATOR_KEYS + SIGNAL_KEYS
+
+
+@pytest.fixture(scope='module')
+def baseline():
+    with np.load(FIXTURE) as data:
+        stocks = []
+        n = 0
+        while f'close_{n}' in data:
+            stocks.append({key: data[f'{key}_{n}'] for key in ['close', 'high', 'low'] + COLUMNS})
+            n += 1
+    return stocks
+
+
+def assert_matches(got: dict, expected: dict, label: str) -> None:
+    for key in COLUMNS:
+        np.testing.assert_allclose(np.asarray(got[key], dtype=float), expected[key], rtol=1e-9, atol=1e-9,
+                                   err_msg=f'{label}: {key}')
+
+
+def test_single_stock_matches_baseline(baseline):
+    for n, stock in enumerate(baseline):
+        indicators = compute_indicators(stock['close'], stock['high'], stock['low'])
+        results = column({**indicators, **compute_signals(indicators)}, 0)
+        assert_matches(results, stock, f'第 {n} 檔')
+
+
+def test_batch_matches_baseline(baseline):
+    """長度不一的股票靠右對齊堆疊後一次計算，結果與逐檔計算相同"""
+    indicators = compute_indicators(stack_price_series([stock['close'] for stock in baseline]),
+                                    stack_price_series([stock['high'] for stock in baseline]),
+                                    stack_price_series([stock['low'] for stock in baseline]))
+    signals = compute_signals(indicators)
+    for n, stock in enumerate(baseline):
+        results = column({**indicators, **signals}, n, len(stock['close']))
+        assert_matches(results, stock, f'批次第 {n} 檔')
+
+
+def test_analyzer_matches_baseline(baseline):
+    from stock_analyzer import TaiwanStockAnalyzer
+
+    for n, stock in enumerate(baseline):
+        analyzer = TaiwanStockAnalyzer.__new__(TaiwanStockAnalyzer)
+        analyzer.price_data = pd.DataFrame({'High': stock['high'], 'Low': stock['low'], 'Close': stock['close']})
+        analyzer.indicators = {}
+        analyzer.calculate_indicators()
+        analyzer.calculate_signals()
+        assert_matches(analyzer.indicators, stock, f'分析器第 {n} 檔')
+        np.testing.assert_allclose(analyzer.calculate_weighted_moving_average(stock['close'], 5), stock['wma5'],
+                                   rtol=1e-9, atol=1e-9)
@@ -0,0 +1,75 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from indicator_engine import INDICATOR_KEYS, SIGNAL_KEYS
+from indicator_state import IndicatorState
+
+# 增量指標狀態與完整重算 (fixtures/indicator_baseline.npz) 的一致性
+# 逐根加入日K的結果需與完整重算相同；離散訊號 (I/J/K/L) 必須完全相等，
+# 包含第 3 檔價格不變的盤整區段 (均線相等時的階梯訊號)。
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'indicator_baseline.npz')
+
+
+def _stocks():
+    with np.load(FIXTURE) as data:
+        n = 0
+        while f'close_{n}' in data:
+            yield {key: data[f'{key}_{n}'] for key in ['close', 'high', 'low'] + INDICATOR_KEYS + SIGNAL_KEYS}
+            n += 1
+
+
+def test_incremental_updates_match_full_recompute():
+    for n, stock in enumerate(_stocks()):
+        dates = pd.date_range('2020-01-01', periods=len(stock['close'])).strftime('%Y-%m-%d')
+        split = len(dates) // 3
+        price_data = pd.DataFrame({'High': stock['high'], 'Low': stock['low'], 'Close': stock['close']},
+                                  index=pd.DatetimeIndex(dates))
+        state = IndicatorState.from_price_data('TEST', price_data.iloc[:split])
+        state = IndicatorState.from_dict(json.loads(json.dumps(state.to_dict())))  # 模擬保存後再讀回
+
+        for i in range(split, len(dates)):
+            latest = state.update(dates[i], stock['high'][i], stock['low'][i], stock['close'][i])
+            for key in SIGNAL_KEYS:
+                np.testing.assert_array_equal(latest[key], stock[key][i], err_msg=f'第 {n} 檔第 {i} 筆: {key}')
+            for key in INDICATOR_KEYS:
+                np.testing.assert_allclose(latest[key], stock[key][i], rtol=1e-9, atol=1e-9,
+                                           err_msg=f'第 {n} 檔第 {i} 筆: {key}')
+
+
+def test_flat_prices_keep_the_stair_signal():
+    stock = list(_stocks())[3]
+    dates = pd.date_range('2020-01-01', periods=99).strftime('%Y-%m-%d')
+    state = IndicatorState('TEST')
+    for i, bar_date in enumerate(dates):
+        latest = state.update(bar_date, stock['high'][i], stock['low'][i], stock['close'][i])
+    assert latest['I_value'] == stock['I_value'][98] == 1
+
+
+def test_old_state_format_is_rebuilt(tmp_path):
+    (tmp_path / 'TEST.json').write_text(json.dumps({'stock_id': 'TEST', 'sma': {'5': [1.0]}}), encoding='utf-8')
+    assert IndicatorState.load('TEST', folder=str(tmp_path)) is None
+
+
+def test_analyzer_append_bar_extends_indicators():
+    from stock_analyzer import TaiwanStockAnalyzer
+
+    stock = list(_stocks())[3]
+    price_data = pd.DataFrame({'High': stock['high'], 'Low': stock['low'], 'Close': stock['close']},
+                              index=pd.date_range('2020-01-01', periods=len(stock['close'])))
+    analyzer = TaiwanStockAnalyzer.__new__(TaiwanStockAnalyzer)
+    analyzer.price_data = price_data.iloc[:-1]
+    analyzer.indicators = {}
+    analyzer.calculate_indicators()
+    analyzer.calculate_signals()
+    state = IndicatorState.from_price_data('TEST', analyzer.price_data)
+
+    analyzer.append_bar(price_data.iloc[-1], state)
+    analyzer.append_bar(price_data.iloc[-1], state)  # 同一日K不重複加入
+    assert len(analyzer.price_data) == len(price_data)
+    for key in INDICATOR_KEYS + SIGNAL_KEYS:
+        np.testing.assert_allclose(np.asarray(analyzer.indicators[key], dtype=float), stock[key],
+                                   rtol=1e-9, atol=1e-9, err_msg=key)
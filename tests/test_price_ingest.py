@@ -0,0 +1,136 @@
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+
+import price_ingest
+import price_matrix
+import price_store
+from finmind_client import FinMindClient
+from finmind_scheduler import RequestScheduler
+
+STOCKS = ['1101', '2330', '2317']
+
+
+@pytest.fixture
+def finmind(tmp_path, monkeypatch):
+    """
+    以日期回應 TaiwanStockPrice 全市場查詢的本地假 FinMind API
+    state['days'] 為有交易的日期，state['fail'] 中的日期回應錯誤訊息
+    """
+    monkeypatch.chdir(tmp_path)  # 日K資料庫與矩陣寫在工作目錄下
+    state = {'days': set(), 'fail': set(), 'requests': []}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            day = query['start_date'][0]
+            state['requests'].append(day)
+            if day in state['fail']:
+                payload = {'status': 402, 'msg': 'Requests reach the upper limit.'}
+            else:
+                rows = [{'date': day, 'stock_id': code, 'open': 10.0 + i, 'max': 11.0 + i, 'min': 9.0 + i,
+                         'close': 10.5 + i, 'Trading_Volume': 1000 * (i + 1)}
+                        for i, code in enumerate(STOCKS)] if day in state['days'] else []
+                payload = {'status': 200, 'msg': 'success', 'data': rows}
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    state['client'] = FinMindClient(base_url=f'http://127.0.0.1:{httpd.server_address[1]}/api/v4/data',
+                                    max_retries=0, scheduler=RequestScheduler(hourly_limit=100000, quota_url=None))
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _weekdays(weeks: int = 2) -> list:
+    """最近交易日之前約兩個月、從週一開始的 weeks 週平日"""
+    start = price_store.latest_trading_day() - timedelta(days=60)
+    start -= timedelta(days=start.weekday())
+    return [day.date() for day in pd.bdate_range(start, periods=5 * weeks)]
+
+
+def _coverage(stock_id: str) -> tuple:
+    with price_store._connect() as conn:
+        return conn.execute('SELECT start_date, checked_through FROM coverage WHERE stock_id = ?',
+                            (stock_id,)).fetchone()
+
+
+def test_ingest_records_holiday_between_trading_days_and_is_idempotent(finmind):
+    days = _weekdays()
+    holiday = days[2]
+    finmind['days'] = {day.isoformat() for day in days if day != holiday}
+
+    summary = price_ingest.ingest_range(days[0], days[-1], finmind['client'])
+    assert summary == {'days': 10, 'rows': 27, 'pending': []}
+    assert price_store.ingested_days(days[0], days[-1]) == set(days)
+    assert price_store.market_holidays(days[0], days[-1]) == {holiday}
+    # 連續匯入的區間跨過假日，各股票已確認到區間最後一天
+    assert _coverage('2330') == (days[0].isoformat(), days[-1].isoformat())
+    matrix = price_matrix.get_matrix()
+    assert matrix.shape == (9, 3) and matrix.last_dates['2330'] == days[-1].isoformat()
+
+    requests = len(finmind['requests'])
+    assert price_ingest.ingest_range(days[0], days[-1], finmind['client'])['days'] == 0
+    assert len(finmind['requests']) == requests
+
+
+def test_empty_days_without_later_data_are_not_recorded(finmind):
+    days = _weekdays()
+    # FinMind 暫時只發布到倒數第三天：最後兩天的空結果不可記錄為假日
+    finmind['days'] = {day.isoformat() for day in days[:-2]}
+    summary = price_ingest.ingest_range(days[0], days[-1], finmind['client'])
+    assert summary['pending'] == [day.isoformat() for day in days[-2:]]
+    assert price_store.market_holidays(days[0], days[-1]) == set()
+    assert _coverage('2330')[1] == days[-3].isoformat()
+
+    finmind['days'] = {day.isoformat() for day in days}
+    finmind['requests'].clear()
+    summary = price_ingest.ingest_range(days[0], days[-1], finmind['client'])
+    assert finmind['requests'] == [day.isoformat() for day in days[-2:]]
+    assert summary == {'days': 2, 'rows': 6, 'pending': []}
+    assert _coverage('2330')[1] == days[-1].isoformat()
+
+
+def test_interrupted_ingest_resumes_from_unfinished_days(finmind):
+    days = _weekdays()
+    holiday = days[4]
+    finmind['days'] = {day.isoformat() for day in days if day != holiday}
+    finmind['fail'] = {days[5].isoformat()}  # 假日的隔天中斷
+    with pytest.raises(ValueError):
+        price_ingest.ingest_range(days[0], days[-1], finmind['client'])
+    assert price_store.ingested_days(days[0], days[-1]) == set(days[:4])  # 假日尚待之後的日期確認
+
+    finmind['fail'] = set()
+    finmind['requests'].clear()
+    summary = price_ingest.ingest_range(days[0], days[-1], finmind['client'])
+    assert finmind['requests'] == [day.isoformat() for day in days[4:]]
+    assert summary == {'days': 6, 'rows': 15, 'pending': []}
+    assert price_store.market_holidays(days[0], days[-1]) == {holiday}
+    assert _coverage('2330') == (days[0].isoformat(), days[-1].isoformat())
+
+
+def test_new_days_queue_an_indicator_refresh(tmp_path, monkeypatch):
+    import background_jobs
+    import job_queue
+    from indicator_state import IndicatorState
+
+    monkeypatch.chdir(tmp_path)  # 工作佇列與指標狀態寫在工作目錄下
+    assert background_jobs.queue_indicator_refresh({'days': 2, 'rows': 6, 'pending': []}) is None  # 觀察清單為空
+    IndicatorState('2330').save()
+    assert background_jobs.queue_indicator_refresh({'days': 1, 'rows': 0, 'pending': ['2024-01-02']}) is None
+    job_id = background_jobs.queue_indicator_refresh({'days': 2, 'rows': 6, 'pending': []})
+    assert job_queue.get_job(job_id)['kind'] == background_jobs.INDICATOR_REFRESH
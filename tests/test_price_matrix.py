@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import price_matrix
+import price_store
+
+
+def _frame(days, offset: float):
+    index = pd.DatetimeIndex([pd.Timestamp(day) for day in days], name='Date')
+    close = offset + np.arange(len(days), dtype=float)
+    return pd.DataFrame({'Open': close, 'High': close + 1, 'Low': close - 1, 'Close': close,
+                         'Volume': 1000.0}, index=index)
+
+
+def test_fresh_stock_is_served_as_views_without_queries(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    latest = price_store.latest_trading_day()
+    start = latest - timedelta(days=40)
+    days = [day.date() for day in pd.bdate_range(start, latest)]
+    price_store.save_prices('2330', _frame(days, 100.0), start)
+    # 停牌一天且只確認到前一交易日的股票
+    price_store.save_prices('2317', _frame([day for day in days[:-1] if day != days[5]], 50.0), start)
+    price_matrix.build()
+    matrix = price_matrix.get_matrix()
+
+    analysis_start = start + timedelta(days=3)
+    assert matrix.is_fresh('2330', analysis_start)
+    assert not matrix.is_fresh('2317', analysis_start)
+    assert not matrix.is_fresh('2330', start - timedelta(days=1))
+
+    prices = matrix.prices('2330', analysis_start)
+    expected = price_store.load_prices('2330', analysis_start)
+    pd.testing.assert_frame_equal(prices, expected, check_freq=False)
+    assert np.shares_memory(prices['Close'].to_numpy(), matrix['Close'])
+
+    gapped = matrix.prices('2317', start)
+    pd.testing.assert_frame_equal(gapped, price_store.load_prices('2317', start), check_freq=False)
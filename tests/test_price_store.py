@@ -0,0 +1,82 @@
+from datetime import date, timedelta
+
+import pandas as pd
+
+import price_store
+
+
+def _frame(days):
+    index = pd.DatetimeIndex([pd.Timestamp(day) for day in days], name='Date')
+    return pd.DataFrame({column: 1.0 for column in price_store.PRICE_COLUMNS}, index=index)
+
+
+def _next_trading_day(db_path: str) -> None:
+    """模擬進入下一個交易日：把最後查詢的交易日往前移一天"""
+    with price_store._connect(db_path) as conn:
+        conn.execute("UPDATE last_checks SET trading_day = '2000-01-01'")
+
+
+def test_save_prices_confirms_only_returned_dates(tmp_path):
+    db_path = str(tmp_path / 'prices.db')
+    latest = price_store.latest_trading_day()
+    start = latest - timedelta(days=30)
+    last_returned = price_store.previous_weekday(latest)
+
+    # FinMind 尚未發布最近交易日的資料：本交易日內不再請求，之後從最後一筆的隔天開始請求
+    price_store.save_prices('2330', _frame([start, last_returned]), start, db_path)
+    assert price_store.missing_start('2330', start, db_path) is None
+    _next_trading_day(db_path)
+    assert price_store.missing_start('2330', start, db_path) == last_returned + timedelta(days=1)
+
+    # 空的回應 (停牌或尚未發布) 不延伸已確認的範圍，但同一個交易日內不再重複請求
+    price_store.save_prices('2330', _frame([]), last_returned + timedelta(days=1), db_path)
+    assert price_store.missing_start('2330', start, db_path) is None
+    _next_trading_day(db_path)
+    assert price_store.missing_start('2330', start, db_path) == last_returned + timedelta(days=1)
+
+    price_store.save_prices('2330', _frame([latest]), last_returned + timedelta(days=1), db_path)
+    _next_trading_day(db_path)
+    assert price_store.missing_start('2330', start, db_path) is None
+
+
+def test_save_prices_empty_response_for_new_stock(tmp_path):
+    db_path = str(tmp_path / 'prices.db')
+    start = date(2024, 1, 2)
+    price_store.save_prices('9999', _frame([]), start, db_path)
+    assert price_store.missing_start('9999', start, db_path) is None
+    _next_trading_day(db_path)
+    assert price_store.missing_start('9999', start, db_path) == start
+
+
+def test_recorded_holidays_count_as_covered(tmp_path):
+    db_path = str(tmp_path / 'prices.db')
+    latest = price_store.latest_trading_day()
+    previous = price_store.previous_weekday(latest)
+    start = latest - timedelta(days=30)
+
+    # 全市場匯入已確認最近交易日是假日；之後才第一次查詢的股票只回傳到前一個交易日
+    price_store.save_market_day(latest, [], db_path)
+    price_store.save_prices('2330', _frame([start, previous]), start, db_path)
+    _next_trading_day(db_path)
+    assert price_store.missing_start('2330', start, db_path) is None
+
+    # 沒有假日紀錄時仍需請求最近交易日
+    price_store.save_prices('2317', _frame([start, previous]), start, db_path)
+    with price_store._connect(db_path) as conn:
+        conn.execute('DELETE FROM market_days')
+    _next_trading_day(db_path)
+    assert price_store.missing_start('2317', start, db_path) == latest
+
+
+def test_data_version_changes_only_with_stored_bars(tmp_path):
+    db_path = str(tmp_path / 'prices.db')
+    latest = price_store.latest_trading_day()
+    previous = price_store.previous_weekday(latest)
+    start = latest - timedelta(days=30)
+
+    price_store.save_prices('2330', _frame([previous]), start, db_path)
+    pending = price_store.data_version('2330', db_path)
+    assert pending == f'{previous.isoformat()}~{latest.isoformat()}'
+
+    price_store.save_prices('2330', _frame([latest]), previous + timedelta(days=1), db_path)
+    assert price_store.data_version('2330', db_path) == latest.isoformat()
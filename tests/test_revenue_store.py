@@ -0,0 +1,42 @@
+from datetime import date
+
+import revenue_store
+
+
+def _item(stock_id: str, year: int, month: int, announced: str) -> dict:
+    return {'stock_id': stock_id, 'revenue_year': year, 'revenue_month': month, 'date': announced, 'revenue': 1e9}
+
+
+def _checked_on(stock_id: str, db_path: str) -> str:
+    with revenue_store._connect(db_path) as conn:
+        return conn.execute('SELECT checked_on FROM revenue_coverage WHERE stock_id = ?', (stock_id,)).fetchone()[0]
+
+
+def test_market_revenue_confirms_only_returned_stocks(tmp_path):
+    db_path = str(tmp_path / 'revenue.db')
+    for stock_id in ('2330', '2317'):
+        revenue_store.save_revenue(stock_id, [_item(stock_id, 2020, 1, '2020-02-10')], date(2020, 1, 1), db_path)
+    with revenue_store._connect(db_path) as conn:
+        conn.execute("UPDATE revenue_coverage SET checked_on = '2020-02-10'")
+
+    # 空的回應不視為確認過，也不記錄為已預熱
+    assert revenue_store.save_market_revenue([], db_path) == 0
+    assert _checked_on('2330', db_path) == '2020-02-10'
+    assert revenue_store.warm_up_due(db_path=db_path)
+
+    today = revenue_store.today()
+    assert revenue_store.save_market_revenue([_item('2330', 2020, 2, today.isoformat())], db_path) == 1
+    assert _checked_on('2330', db_path) == today.isoformat()
+    assert _checked_on('2317', db_path) == '2020-02-10'
+
+
+def test_warm_up_job_is_queued_only_when_due(tmp_path, monkeypatch):
+    import background_jobs
+    import job_queue
+
+    monkeypatch.chdir(tmp_path)  # 工作佇列與月營收資料庫寫在工作目錄下
+    job_id = background_jobs.queue_revenue_warm_up()
+    assert job_queue.get_job(job_id)['kind'] == background_jobs.REVENUE_WARM_UP
+
+    revenue_store.save_market_revenue([_item('2330', 2020, 2, revenue_store.today().isoformat())])
+    assert background_jobs.queue_revenue_warm_up() is None
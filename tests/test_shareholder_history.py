@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+import shareholder_history
+from shareholder_store import ShareholderStore
+
+
+def test_history_is_served_from_memory_and_refreshed_after_merge(tmp_path):
+    db_path = str(tmp_path / 'shareholders.db')
+    store = ShareholderStore(['2330', '2317'], ['台積電', '鴻海'], pd.DatetimeIndex(['2024-01-05', '2024-01-12']),
+                             np.array([[50.0, 51.0], [np.nan, 40.0]]), mtime=123.0)
+
+    # CSV 已更新但尚未合併：沿用資料庫內容
+    assert shareholder_history.get_history(store.mtime, db_path).series('2330') is None
+
+    shareholder_history.merge_store(store, db_path)
+    history = shareholder_history.get_history(store.mtime, db_path)
+    series = history.series('2317')
+    assert list(series['dates']) == ['2024-01-12'] and series['name'] == '鴻海'
+    np.testing.assert_array_equal(history.series('2330')['values'],
+                                  shareholder_history.load_series('2330', db_path=db_path)['values'])
+    assert shareholder_history.get_history(store.mtime, db_path) is history
+
+
+def test_existing_csv_is_served_before_the_first_merge(tmp_path, monkeypatch):
+    import stock_information_plot
+
+    # 既有安裝：已有 大戶股權.csv，但歷史資料庫是空的 (尚未執行更新工作)
+    monkeypatch.chdir(tmp_path)
+    pd.DataFrame({'Code': ['2330'], 'Name': ['台積電'], '2024-01-05': [50.0], '2024-01-12': [51.0]}) \
+        .to_csv(tmp_path / '大戶股權.csv', index=False)
+
+    data, error = stock_information_plot.load_major_shareholders_data('2330')
+    assert error is None
+    assert list(data['dates']) == ['2024-01-05', '2024-01-12']
+    np.testing.assert_array_equal(data['values'], [50.0, 51.0])
+
+    data, error = stock_information_plot.load_major_shareholders_data('2330', start_date='2024-01-10')
+    assert error is None and list(data['dates']) == ['2024-01-12']
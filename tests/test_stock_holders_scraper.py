@@ -0,0 +1,96 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from stock_holders_scraper import StockHoldersScraper
+
+WEEKS = ['2024<br>0105'] + [f'12{day:02d}' for day in range(29, 18, -1)]
+
+
+def _page(ranking: list, start: int, end: int) -> str:
+    """與 StockHoldersContinue.aspx 相同版面的表格，只含排名 start~end 的股票"""
+    header = ['排行', '', '圖', '代碼名稱', '收盤價', '漲跌'] + WEEKS + ['週增減', '備註']
+    rows = []
+    for rank, code in enumerate(ranking[start - 1:end], start=start):
+        cells = [str(rank), '', '', f'<a href="#">{code} 股票{code}</a>', '100.00', '0.50']
+        cells += [f'{50 + week + rank / 100:.2f}' for week in range(12)] + ['0.10', '']
+        rows.append('<tr>' + ''.join(f'<td>{cell}</td>' for cell in cells) + '</tr>')
+    return ('<html><body><table class="display dataTable no-footer"><thead><tr>'
+            + ''.join(f'<th>{label}</th>' for label in header)
+            + '</tr></thead><tbody>' + ''.join(rows) + '</tbody></table></body></html>')
+
+
+@pytest.fixture
+def server():
+    """以排名區間 (valuerank) 回應的本地假網站；state['fail'] 中的區間回應 404"""
+    state = {'ranking': [], 'fail': set(), 'requests': []}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            valuerank = parse_qs(urlparse(self.path).query)['valuerank'][0]
+            state['requests'].append(valuerank)
+            if valuerank in state['fail']:
+                self.send_error(404)
+                return
+            start, end = (int(part) for part in valuerank.split('-'))
+            body = _page(state['ranking'], start, end).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    state['url'] = f'http://127.0.0.1:{httpd.server_address[1]}/StockHoldersContinue.aspx'
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _scraper(url: str) -> StockHoldersScraper:
+    scraper = StockHoldersScraper(url=url, shard_size=10, max_workers=3, timeout=5)
+    scraper.params['valuerank'] = '1-30'
+    return scraper
+
+
+def test_fetch_sharded_merges_shards_in_rank_order(server):
+    server['ranking'] = [str(1101 + i) for i in range(25)]
+    df = _scraper(server['url']).fetch_sharded()
+
+    assert sorted(server['requests']) == ['1-10', '11-20', '21-30']
+    assert df['Code'].tolist() == server['ranking']
+    assert df.columns[2] == '2024-01-05'
+    assert df.iloc[12, 2] == pytest.approx(50.13)
+
+
+def test_fetch_sharded_drops_codes_repeated_across_shards(server):
+    # 抓取期間排名變動：排名 10 的股票同時出現在下一段的第一名
+    ranking = [str(1101 + i) for i in range(25)]
+    server['ranking'] = ranking[:10] + [ranking[9]] + ranking[10:24]
+    df = _scraper(server['url']).fetch_sharded()
+
+    assert df['Code'].tolist() == ranking[:24]
+    assert df.iloc[9, 2] == pytest.approx(50.10)  # 保留排名較前的一筆
+
+
+def test_fetch_sharded_aborts_when_a_shard_fails(server):
+    server['ranking'] = [str(1101 + i) for i in range(25)]
+    server['fail'] = {'11-20'}
+    assert _scraper(server['url']).fetch_sharded() is None
+
+
+def test_merge_shards_rejects_gap_before_last_shard():
+    ranking = [str(1101 + i) for i in range(25)]
+    scraper = _scraper('http://127.0.0.1:9/')
+    shards = scraper.rank_shards()
+    frames = [scraper.process_table(_page(ranking, start, end), capacity=end - start + 1)
+              for start, end in shards]
+    frames[0] = frames[0].iloc[:9]
+    assert StockHoldersScraper.merge_shards(frames, shards) is None